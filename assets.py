@@ -0,0 +1,180 @@
+#Piece images and sounds of the game window, the engine modules never import pygame
+#piece images are scaled once per square size and kept in an atlas file, all pieces side by side as raw RGBA
+#behind a small header, so a later start reads one file in one go and cuts it into subsurfaces without
+#decoding or scaling any PNG; the atlas is built again when it is missing or older than an image in images/
+#atlases are also kept in memory, every board of the same square size shares them
+#sounds are decoded the first time they play instead of at startup
+#
+#usage: python assets.py      time to first frame with the PNGs and with the atlas, each in a fresh process
+import argparse
+import os
+import statistics
+import struct
+import subprocess
+import sys
+import time
+
+STARTED = time.perf_counter() #before pygame is imported, for the time to first frame
+import pygame as p
+
+IMAGE_DIRECTORY = "images"
+ATLAS_DIRECTORY = os.path.join(IMAGE_DIRECTORY, "cache")
+#order of the pieces in the atlas, left to right, the board piece names (see gameState.PIECE_CODES)
+ATLAS_PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+ATLAS_MAGIC = b"PCAT"
+ATLAS_HEADER = struct.Struct("<4sHH") #magic, square size, number of pieces
+ATLASES = {} #square size -> piece -> surface, loaded in this process
+
+
+def image_path(piece):
+    return os.path.join(IMAGE_DIRECTORY, piece + ".png")
+
+
+def atlas_path(square_size):
+    return os.path.join(ATLAS_DIRECTORY, "pieces_%d.rgba" % square_size)
+
+
+#one surface with every piece scaled to square_size, side by side
+def build_atlas(square_size):
+    atlas = p.Surface((square_size * len(ATLAS_PIECES), square_size), p.SRCALPHA)
+    for index, piece in enumerate(ATLAS_PIECES):
+        image = p.transform.scale(p.image.load(image_path(piece)), (square_size, square_size))
+        atlas.blit(image, (index * square_size, 0))
+    return atlas
+
+
+#written under a temporary name and renamed, so another window starting at the same time never reads half a file
+def write_atlas(path, atlas, square_size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temporary_path, "wb") as atlas_file:
+        atlas_file.write(ATLAS_HEADER.pack(ATLAS_MAGIC, square_size, len(ATLAS_PIECES)))
+        atlas_file.write(p.image.tobytes(atlas, "RGBA"))
+    os.replace(temporary_path, path)
+
+
+#the atlas surface in the file, None if it is missing, out of date or not an atlas of this size
+def read_atlas(path, square_size):
+    try:
+        if os.path.getmtime(path) < max(os.path.getmtime(image_path(piece)) for piece in ATLAS_PIECES):
+            return None
+        with open(path, "rb") as atlas_file:
+            data = atlas_file.read()
+    except OSError:
+        return None
+    width = square_size * len(ATLAS_PIECES)
+    if len(data) != ATLAS_HEADER.size + width * square_size * 4:
+        return None
+    if ATLAS_HEADER.unpack_from(data) != (ATLAS_MAGIC, square_size, len(ATLAS_PIECES)):
+        return None
+    return p.image.frombuffer(memoryview(data)[ATLAS_HEADER.size:], (width, square_size), "RGBA") #no copy of the pixels
+
+
+#piece -> image scaled to square_size, from memory, the atlas file, or built from the PNGs (and saved)
+def load_piece_images(square_size):
+    if square_size not in ATLASES:
+        path = atlas_path(square_size)
+        atlas = read_atlas(path, square_size)
+        if atlas is None:
+            atlas = build_atlas(square_size)
+            try:
+                write_atlas(path, atlas, square_size)
+            except OSError: #read only install, the atlas is only kept in memory
+                pass
+        if p.display.get_surface() is not None:
+            atlas = atlas.convert_alpha() #pixel format of the display, faster blits
+        ATLASES[square_size] = {piece: atlas.subsurface((index * square_size, 0, square_size, square_size))
+                                for index, piece in enumerate(ATLAS_PIECES)}
+    return ATLASES[square_size]
+
+
+#a sound decoded the first time it is played
+class LazySound():
+    def __init__(self, path):
+        self.path = path
+        self.sound = None
+
+    def play(self):
+        if self.sound is None:
+            self.sound = p.mixer.Sound(self.path)
+        self.sound.play()
+
+
+#run in a fresh process: start the way main does and print the ms from the process start to the first frame drawn
+#mode "png" loads and scales every PNG and decodes the sounds like before the atlas, "atlas" uses this module
+def first_frame(mode, square_size):
+    import main as game
+    import engineWorker
+    import gameState
+    from renderer import BoardRenderer
+
+    engine = engineWorker.EngineWorker()
+    p.init()
+    screen = p.display.set_mode((square_size * 8, square_size * 8))
+    if mode == "png":
+        images = {piece: p.transform.scale(p.image.load(image_path(piece)), (square_size, square_size)) for piece in ATLAS_PIECES}
+        sounds = [p.mixer.Sound(path) for path in (game.MOVE_SOUND, game.CAPTURE_SOUND)]
+    else:
+        images = load_piece_images(square_size)
+        sounds = [LazySound(path) for path in (game.MOVE_SOUND, game.CAPTURE_SOUND)]
+    renderer = BoardRenderer(screen, images, square_size)
+    renderer.draw(gameState.create_game_state(), [], ())
+    print((time.perf_counter() - STARTED) * 1000)
+    engine.close()
+
+
+#milliseconds to first frame of repeat fresh processes per mode, then the in process cost per square size
+def benchmark(repeat, square_sizes):
+    environment = dict(os.environ, SDL_VIDEODRIVER=os.environ.get("SDL_VIDEODRIVER", "dummy"),
+                       SDL_AUDIODRIVER=os.environ.get("SDL_AUDIODRIVER", "dummy"), PYGAME_HIDE_SUPPORT_PROMPT="1")
+    for square_size in square_sizes:
+        for mode in ("png", "atlas (built)", "atlas"):
+            times = []
+            for _ in range(repeat):
+                if mode == "atlas (built)" and os.path.exists(atlas_path(square_size)):
+                    os.remove(atlas_path(square_size))
+                output = subprocess.run([sys.executable, "-W", "ignore", __file__, "--first-frame", mode.split()[0],
+                                         "--square-size", str(square_size)], env=environment, capture_output=True, text=True,
+                                        check=True).stdout
+                times.append(float(output.split()[-1]))
+            print("square %3d  %-14s first frame %7.1f ms (median of %d, min %.1f)" % (
+                square_size, mode, statistics.median(times), repeat, min(times)))
+
+    #the images alone, the way a second board or a resized window gets them
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    p.init()
+    p.display.set_mode((64, 64))
+    for square_size in square_sizes:
+        start = time.perf_counter()
+        build_atlas(square_size)
+        png = time.perf_counter() - start
+        ATLASES.clear()
+        start = time.perf_counter()
+        atlas = load_piece_images(square_size)
+        from_file = time.perf_counter() - start
+        start = time.perf_counter()
+        load_piece_images(square_size)
+        from_memory = time.perf_counter() - start
+        same = all(p.image.tobytes(atlas[piece], "RGBA") == p.image.tobytes(
+            p.transform.scale(p.image.load(image_path(piece)), (square_size, square_size)).convert_alpha(), "RGBA")
+            for piece in ATLAS_PIECES)
+        print("square %3d  images: PNGs %6.2f ms  atlas file %6.2f ms  memory %6.3f ms  same pixels %s" % (
+            square_size, png * 1000, from_file * 1000, from_memory * 1000, same))
+    p.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first frame with and without the piece atlas")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--square-sizes", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--first-frame", choices=("png", "atlas"), help=argparse.SUPPRESS)
+    parser.add_argument("--square-size", type=int, default=64, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.first_frame:
+        first_frame(args.first_frame, args.square_size)
+    else:
+        benchmark(args.repeat, args.square_sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#Headless batch analysis of many positions on a process pool
+#positions are sent to the workers in chunks and the results stream back as JSON lines,
+#in input order or as soon as each chunk is done
+#
+#usage: python batch.py positions.txt --depth 4 --out results.jsonl     one FEN per line, - for stdin
+#       python batch.py positions.txt --perft 3 --workers 8 --unordered
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import notation
+from search import Searcher, MAX_PLY
+from transpositionTable import TranspositionTable
+import perft
+
+DEFAULT_CHUNK_SIZE = 16
+CHUNKS_PER_WORKER = 2 #chunks queued per worker, bounds memory on huge inputs while keeping every worker busy
+BATCH_TABLE_MB = 2 #cleared before every position, keep it small for shallow searches
+
+_transposition_table = None #one per worker process, set by init_worker
+
+
+def init_worker(table_mb):
+    global _transposition_table
+    _transposition_table = TranspositionTable(table_mb)
+
+
+#analyse one position, options: backend, depth, movetime (ms), perft (depth)
+#errors are reported in the result so one bad FEN does not stop the batch
+def analyse_position(fen, options):
+    result = {"fen": fen}
+    try:
+        game_state = notation.parse_fen(fen, options.get("backend", "mailbox"))
+    except (ValueError, KeyError, IndexError) as error:
+        result["error"] = "invalid FEN: %s" % error
+        return result
+
+    valid_moves = game_state.get_valid_moves()
+    result["legal_moves"] = len(valid_moves)
+    result["checkmate"] = game_state.checkmate
+    result["stalemate"] = game_state.stalemate
+    result["fifty_move_rule"] = game_state.fifty_move_rule
+    result["insufficient_material"] = game_state.insufficient_material
+
+    if options.get("perft"):
+        start = time.perf_counter()
+        result["perft"] = perft.perft(game_state, options["perft"])
+        result["perft_time"] = round(time.perf_counter() - start, 4)
+
+    if (options.get("depth") or options.get("movetime")) and len(valid_moves) != 0:
+        #a clean table per position so results dont depend on which worker got which positions
+        table = _transposition_table if _transposition_table is not None else TranspositionTable(BATCH_TABLE_MB)
+        table.clear()
+        search = Searcher(table).search(game_state, options.get("movetime"), options.get("depth") or MAX_PLY - 1)
+        result["best_move"] = search.best_move.get_chess_notation()
+        result["san"] = notation.to_san(game_state, search.best_move, valid_moves)
+        result["score"] = search.score
+        result["depth"] = search.depth
+        result["nodes"] = search.nodes
+        result["time"] = round(search.elapsed, 4)
+    return result
+
+
+#worker task: analyse a chunk, tagged with the input index of its first position
+def analyse_chunk(first_index, fens, options):
+    results = []
+    for offset, fen in enumerate(fens):
+        result = analyse_position(fen, options)
+        result["index"] = first_index + offset
+        results.append(result)
+    return results
+
+
+#split the FENs into (first index, chunk) without reading the whole iterable
+def chunked(fens, chunk_size):
+    chunk = []
+    first_index = 0
+    for index, fen in enumerate(fens):
+        if not chunk:
+            first_index = index
+        chunk.append(fen)
+        if len(chunk) == chunk_size:
+            yield first_index, chunk
+            chunk = []
+    if chunk:
+        yield first_index, chunk
+
+
+#analyse an iterable of FENs on a pool of workers processes, yields result dicts
+#ordered=True yields in input order, otherwise chunk by chunk as they complete
+def analyse_batch(fens, options, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, ordered=True, table_mb=BATCH_TABLE_MB):
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * CHUNKS_PER_WORKER
+    chunks = chunked(fens, chunk_size)
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(table_mb,)) as executor:
+        pending = collections.deque()
+        for first_index, chunk in chunks:
+            pending.append(executor.submit(analyse_chunk, first_index, chunk, options))
+            if len(pending) < max_pending:
+                continue
+            #queue is full, hand back finished work before submitting more
+            if ordered:
+                yield from pending.popleft().result()
+            else:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield from future.result()
+
+        if ordered:
+            while pending:
+                yield from pending.popleft().result()
+        else:
+            for future in concurrent.futures.as_completed(pending):
+                yield from future.result()
+
+
+#FENs from a file with one position per line, blank lines and # comments are skipped
+def read_fens(file):
+    for line in file:
+        line = line.strip()
+        if line and line[0] != "#":
+            yield line
+
+
+#write results as JSON lines, returns the number written
+def write_jsonl(results, file):
+    count = 0
+    for result in results:
+        file.write(json.dumps(result) + "\n")
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse many positions on a process pool")
+    parser.add_argument("input", help="file with one FEN per line, - for stdin")
+    parser.add_argument("--out", default="-", help="JSONL output file, - for stdout")
+    parser.add_argument("--depth", type=int, help="search depth")
+    parser.add_argument("--movetime", type=int, help="search time per position in milliseconds")
+    parser.add_argument("--perft", type=int, help="perft depth")
+    parser.add_argument("--backend", choices=("mailbox", "bitboard"), default="mailbox")
+    parser.add_argument("--workers", type=int, help="worker processes (default: cpu count)")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK_SIZE, help="positions per task")
+    parser.add_argument("--unordered", action="store_true", help="write results as they complete")
+    parser.add_argument("--hash", type=float, default=BATCH_TABLE_MB, help="transposition table size per worker in MB")
+    args = parser.parse_args()
+
+    options = {"backend": args.backend, "depth": args.depth, "movetime": args.movetime, "perft": args.perft}
+    input_file = sys.stdin if args.input == "-" else open(args.input)
+    output_file = sys.stdout if args.out == "-" else open(args.out, "w")
+    start = time.perf_counter()
+    try:
+        results = analyse_batch(read_fens(input_file), options, args.workers, args.chunk, not args.unordered, args.hash)
+        count = write_jsonl(results, output_file)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    elapsed = time.perf_counter() - start
+    print("%d positions  %.2fs  %.1f positions/s" % (count, elapsed, count / elapsed if elapsed else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+#Vectorized analysis of many positions at once with NumPy, for datasets of millions of positions
+#positions come as (N, 8, 8) int8 boards of gameState.PIECE_INDEX codes (0 empty, 1-6 white p N B R Q K,
+#7-12 black p N B R Q K) or as (N, 12) uint64 bitboards in the order of gameState.PIECE_CODES[1:] (bit row*8 + col),
+#with the side to move, castling bits and en passant square (row*8 + col, -1 for none) of each position
+#all N positions are worked on together, as arrays of bitboards moved with shifts and Kogge-Stone fills:
+#attack maps, check, legal move counts and the tapered evaluation, without any Python code per position
+#only this module needs numpy, the engine itself doesnt
+#
+#usage: python batchEngine.py --positions 5000      check against GameState on random positions and compare speed
+import argparse
+import random
+import time
+
+import numpy as np
+
+import evaluation
+from evaluation import evaluate
+import gameState
+from gameState import DIRECTIONS, KNIGHT_OFFSETS, PIECE_CODES, PIECE_INDEX
+import notation
+import perft
+
+U64 = np.uint64
+FULL = U64(0xFFFFFFFFFFFFFFFF)
+SQUARES = np.arange(64)
+BITS = U64(1) << np.arange(64, dtype=np.uint64)
+#piece types within one colour's (N, 6) bitboards
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+
+def squares_mask(condition):
+    return U64(sum(1 << square for square in range(64) if condition(square // 8, square % 8)))
+
+#shifting by dc columns wraps pieces onto the other side of the board, these masks remove them
+WRAP_MASKS = {0: FULL, 1: ~squares_mask(lambda row, col: col == 0), 2: ~squares_mask(lambda row, col: col < 2),
+              -1: ~squares_mask(lambda row, col: col == 7), -2: ~squares_mask(lambda row, col: col > 5)}
+#rows a single pawn push lands on before a double push is possible
+DOUBLE_PUSH_ROWS = {-1: squares_mask(lambda row, col: row == 5), 1: squares_mask(lambda row, col: row == 2)}
+
+
+def build_square_tables():
+    rays = np.zeros((64, 8), dtype=np.uint64) #RAY_MASKS[square, direction]: squares outwards from square
+    knights = np.zeros(64, dtype=np.uint64)
+    kings = np.zeros(64, dtype=np.uint64)
+    pawn_attacks = np.zeros((2, 64), dtype=np.uint64) #[0 white / 1 black, square]: squares a pawn there attacks
+    for square, (row, col) in enumerate(gameState.SQUARE_COORDS):
+        for direction, ray in enumerate(gameState.RAYS[row][col]):
+            rays[square, direction] = sum(1 << (end_row*8 + end_col) for end_row, end_col in ray)
+        knights[square] = sum(1 << (end_row*8 + end_col) for end_row, end_col in gameState.KNIGHT_SQUARES[row][col])
+        kings[square] = sum(1 << (end_row*8 + end_col) for end_row, end_col in gameState.KING_SQUARES[row][col])
+        for color, forward in ((0, -1), (1, 1)):
+            pawn_attacks[color, square] = sum(1 << ((row + forward)*8 + col + side) for side in (-1, 1)
+                                              if 0 <= row + forward < 8 and 0 <= col + side < 8)
+    return rays, knights, kings, pawn_attacks
+
+RAY_MASKS, KNIGHT_MASKS, KING_MASKS, PAWN_ATTACK_MASKS = build_square_tables()
+#directions going to higher square numbers, their nearest blocker is the lowest set bit
+POSITIVE_DIRECTIONS = [dr*8 + dc > 0 for dr, dc in DIRECTIONS]
+
+#evaluation tables by piece code (see evaluation.build_scores)
+MIDDLEGAME_TABLE = np.array([evaluation.MIDDLEGAME_SCORES[piece] for piece in PIECE_CODES], dtype=np.int64)
+ENDGAME_TABLE = np.array([evaluation.ENDGAME_SCORES[piece] for piece in PIECE_CODES], dtype=np.int64)
+PHASE_TABLE = np.array([evaluation.PHASES[piece] for piece in PIECE_CODES], dtype=np.int64)
+POPCOUNT_BYTES = np.array([bin(value).count("1") for value in range(256)], dtype=np.int64)
+
+
+def popcount(bitboards):
+    return POPCOUNT_BYTES[np.ascontiguousarray(bitboards).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def lowest_bit(bitboards):
+    return bitboards & (~bitboards + U64(1))
+
+
+def highest_bit(bitboards):
+    for shift in (1, 2, 4, 8, 16, 32):
+        bitboards = bitboards | (bitboards >> U64(shift))
+    return bitboards ^ (bitboards >> U64(1))
+
+
+#square number of single bit bitboards, powers of 2 are exact in float64
+def bit_square(bitboards):
+    return np.log2(np.maximum(bitboards, U64(1)).astype(np.float64)).astype(np.intp)
+
+
+#every piece moved steps times (dr, dc), without removing the ones that wrapped around
+def shift(bitboards, dr, dc, steps=1):
+    amount = (dr*8 + dc) * steps
+    return bitboards << U64(amount) if amount > 0 else bitboards >> U64(-amount)
+
+
+def step(bitboards, dr, dc):
+    return shift(bitboards, dr, dc) & WRAP_MASKS[dc]
+
+
+#squares the sliders in pieces reach in direction (dr, dc), the first blocker included (Kogge-Stone fill)
+def slide(pieces, empty, dr, dc):
+    wrap = WRAP_MASKS[dc]
+    free = empty & wrap
+    pieces = pieces | (free & shift(pieces, dr, dc))
+    free = free & shift(free, dr, dc)
+    pieces = pieces | (free & shift(pieces, dr, dc, 2))
+    free = free & shift(free, dr, dc, 2)
+    pieces = pieces | (free & shift(pieces, dr, dc, 4))
+    return shift(pieces, dr, dc) & wrap
+
+
+#nearest piece of blockers along each position's ray in a direction
+def nearest_blocker(blockers, direction):
+    return lowest_bit(blockers) if POSITIVE_DIRECTIONS[direction] else highest_bit(blockers)
+
+
+#squares of a ray from its start up to and including blocker (a single bit on the ray)
+def ray_until(ray, blocker, direction):
+    if POSITIVE_DIRECTIONS[direction]:
+        return ray & ((blocker << U64(1)) - U64(1))
+    return np.where(blocker == 0, ray, ray & ~(blocker - U64(1)))
+
+
+#squares attacked by one colour's (N, 6) pieces, white: True where that colour is white (pawn direction)
+def attack_map(pieces, occupied, white):
+    empty = ~occupied
+    pawns = pieces[:, PAWN]
+    attacks = np.where(white, step(pawns, -1, -1) | step(pawns, -1, 1), step(pawns, 1, -1) | step(pawns, 1, 1))
+    for dr, dc in KNIGHT_OFFSETS:
+        attacks |= step(pieces[:, KNIGHT], dr, dc)
+    for dr, dc in DIRECTIONS:
+        attacks |= step(pieces[:, KING], dr, dc)
+    straight = pieces[:, ROOK] | pieces[:, QUEEN]
+    diagonal = pieces[:, BISHOP] | pieces[:, QUEEN]
+    for direction, (dr, dc) in enumerate(DIRECTIONS):
+        attacks |= slide(straight if direction < 4 else diagonal, empty, dr, dc)
+    return attacks
+
+
+#True where square (one per position) is attacked by the enemy pieces, white: True where the enemy is white
+def square_attacked(squares, occupied, enemy, white):
+    pawn_squares = np.where(white, PAWN_ATTACK_MASKS[1][squares], PAWN_ATTACK_MASKS[0][squares])
+    attacked = ((KNIGHT_MASKS[squares] & enemy[:, KNIGHT]) | (KING_MASKS[squares] & enemy[:, KING])
+                | (pawn_squares & enemy[:, PAWN])) != 0
+    straight = enemy[:, ROOK] | enemy[:, QUEEN]
+    diagonal = enemy[:, BISHOP] | enemy[:, QUEEN]
+    for direction in range(8):
+        first = nearest_blocker(RAY_MASKS[squares, direction] & occupied, direction)
+        attacked |= (first & (straight if direction < 4 else diagonal)) != 0
+    return attacked
+
+
+#pawn pushes and captures of pawns that may only land on allowed squares, a promotion counts once like in GameState
+def pawn_move_count(pawns, empty, enemies, allowed, white_to_move):
+    counts = []
+    for forward in (-1, 1):
+        single = step(pawns, forward, 0) & empty
+        double = step(single & DOUBLE_PUSH_ROWS[forward], forward, 0) & empty
+        left = step(pawns, forward, -1) & enemies
+        right = step(pawns, forward, 1) & enemies
+        counts.append(popcount(single & allowed) + popcount(double & allowed) + popcount(left & allowed)
+                      + popcount(right & allowed))
+    return np.where(white_to_move, counts[0], counts[1])
+
+
+#(N, 12) uint64 bitboards of (N, 8, 8) boards
+def bitboards_from_boards(boards):
+    codes = boards.reshape(len(boards), 64)
+    bitboards = np.empty((len(boards), 12), dtype=np.uint64)
+    for piece in range(12):
+        bitboards[:, piece] = np.packbits(codes == piece + 1, axis=1, bitorder="little").view("<u8")[:, 0]
+    return bitboards
+
+
+#(N, 8, 8) int8 boards of (N, 12) uint64 bitboards
+def boards_from_bitboards(bitboards):
+    bits = np.unpackbits(np.ascontiguousarray(bitboards, dtype="<u8").view(np.uint8).reshape(len(bitboards), 12, 8),
+                         axis=2, bitorder="little")
+    codes = (bits * np.arange(1, 13, dtype=np.uint8)[None, :, None]).sum(axis=1, dtype=np.int8)
+    return codes.reshape(len(bitboards), 8, 8)
+
+
+#(boards, white_to_move, castling_bits, enpassant) arrays of GameState objects
+def encode_game_states(game_states):
+    boards = np.array([[[PIECE_INDEX[piece] for piece in row] for row in game_state.board] for game_state in game_states],
+                      dtype=np.int8).reshape(len(game_states), 8, 8)
+    white_to_move = np.array([game_state.white_to_move for game_state in game_states], dtype=bool)
+    castling_bits = np.array([game_state.castling_bits for game_state in game_states], dtype=np.uint8)
+    enpassant = np.array([row*8 + col if (row, col) != (-1, -1) else -1 for row, col in
+                          ((game_state.enpassant_possible or (-1, -1)) for game_state in game_states)], dtype=np.int8)
+    return boards, white_to_move, castling_bits, enpassant
+
+
+#analyse N positions given as (N, 8, 8) int8 boards, see analyse_bitboards for the results
+def analyse(boards, white_to_move, castling_bits=None, enpassant=None):
+    return analyse_bitboards(bitboards_from_boards(boards), white_to_move, castling_bits, enpassant, boards)
+
+
+#analyse N positions given as (N, 12) uint64 bitboards, returns a dict of arrays of length N:
+#white_attacks, black_attacks: bitboards of the squares each colour attacks
+#in_check, checkmate, stalemate: for the side to move
+#legal_moves: number of legal moves (GameState.get_valid_moves)
+#middlegame, endgame, phase, evaluation: the evaluation terms and evaluate() from the side to move
+def analyse_bitboards(bitboards, white_to_move, castling_bits=None, enpassant=None, boards=None):
+    count = len(bitboards)
+    white_to_move = np.asarray(white_to_move, dtype=bool)
+    castling_bits = np.zeros(count, dtype=np.uint8) if castling_bits is None else np.asarray(castling_bits, dtype=np.uint8)
+    enpassant = np.full(count, -1, dtype=np.int8) if enpassant is None else np.asarray(enpassant, dtype=np.int8)
+    white, black = bitboards[:, :6], bitboards[:, 6:]
+    white_pieces = np.bitwise_or.reduce(white, axis=1)
+    black_pieces = np.bitwise_or.reduce(black, axis=1)
+    occupied = white_pieces | black_pieces
+    empty = ~occupied
+    white_attacks = attack_map(white, occupied, np.ones(count, dtype=bool))
+    black_attacks = attack_map(black, occupied, np.zeros(count, dtype=bool))
+
+    side = white_to_move[:, None]
+    ours, theirs = np.where(side, white, black), np.where(side, black, white)
+    our_pieces = np.where(white_to_move, white_pieces, black_pieces)
+    their_pieces = np.where(white_to_move, black_pieces, white_pieces)
+    enemy_attacks = np.where(white_to_move, black_attacks, white_attacks)
+    king = ours[:, KING]
+    king_square = bit_square(king)
+    in_check = (king & enemy_attacks) != 0
+
+    #checks and pins along the 8 lines from the king
+    straight = theirs[:, ROOK] | theirs[:, QUEEN]
+    diagonal = theirs[:, BISHOP] | theirs[:, QUEEN]
+    checkers = ((KNIGHT_MASKS[king_square] & theirs[:, KNIGHT])
+                | (np.where(white_to_move, PAWN_ATTACK_MASKS[0][king_square], PAWN_ATTACK_MASKS[1][king_square])
+                   & theirs[:, PAWN]))
+    check_lines = checkers.copy() #checkers and the squares between them and the king
+    pinned = np.zeros(count, dtype=np.uint64)
+    pins = [] #(direction, pinned piece, squares it may move to) for each line from the king
+    for direction in range(8):
+        ray = RAY_MASKS[king_square, direction]
+        sliders = straight if direction < 4 else diagonal
+        blockers = ray & occupied
+        first = nearest_blocker(blockers, direction)
+        second = nearest_blocker(blockers & ~first, direction)
+        checking = (first & sliders) != 0
+        checkers |= np.where(checking, first, U64(0))
+        check_lines |= np.where(checking, ray_until(ray, first, direction), U64(0))
+        pin = ((first & our_pieces) != 0) & ((second & sliders) != 0)
+        piece = np.where(pin, first, U64(0))
+        pinned |= piece
+        pins.append((direction, piece, np.where(pin, ray_until(ray, second, direction), U64(0))))
+    checker_count = popcount(checkers)
+    check_mask = np.where(checker_count == 0, FULL, np.where(checker_count == 1, check_lines, U64(0)))
+
+    #moves of the pieces that are not pinned
+    targets = ~our_pieces & check_mask
+    legal_moves = np.zeros(count, dtype=np.int64)
+    free_knights = ours[:, KNIGHT] & ~pinned
+    for dr, dc in KNIGHT_OFFSETS:
+        legal_moves += popcount(step(free_knights, dr, dc) & targets)
+    free_straight = (ours[:, ROOK] | ours[:, QUEEN]) & ~pinned
+    free_diagonal = (ours[:, BISHOP] | ours[:, QUEEN]) & ~pinned
+    for direction, (dr, dc) in enumerate(DIRECTIONS):
+        legal_moves += popcount(slide(free_straight if direction < 4 else free_diagonal, empty, dr, dc) & targets)
+    legal_moves += pawn_move_count(ours[:, PAWN] & ~pinned, empty, their_pieces, check_mask, white_to_move)
+
+    #pinned pieces stay on the line between the king and the pinner, a pinned knight cant move
+    for direction, piece, line in pins:
+        movers = ours[:, QUEEN] | (ours[:, ROOK] if direction < 4 else ours[:, BISHOP])
+        legal_moves += np.where((piece & movers) != 0, popcount(line & ~piece & check_mask), 0)
+        legal_moves += pawn_move_count(piece & ours[:, PAWN], empty, their_pieces, line & check_mask, white_to_move)
+
+    #king moves, the enemy attacks are taken through the king so it cant step back along a checking line
+    king_danger = attack_map(theirs, occupied & ~king, ~white_to_move)
+    legal_moves += popcount(KING_MASKS[king_square] & ~our_pieces & ~king_danger)
+
+    #castling as GameState does it: the rights, empty squares and no attacked squares on the king's way
+    kingside = np.where(white_to_move, 1, 4) & castling_bits != 0
+    queenside = np.where(white_to_move, 2, 8) & castling_bits != 0
+    kingside_path = step(king, 0, 1) | step(step(king, 0, 1), 0, 1)
+    queenside_path = step(king, 0, -1) | step(step(king, 0, -1), 0, -1)
+    queenside_empty = queenside_path | step(queenside_path, 0, -1)
+    legal_moves += (~in_check & kingside & ((kingside_path & (occupied | enemy_attacks)) == 0)).astype(np.int64)
+    legal_moves += (~in_check & queenside & ((queenside_path & enemy_attacks) == 0)
+                    & ((queenside_empty & occupied) == 0)).astype(np.int64)
+
+    #en passant: make the capture and test the king, which covers pins along the rank and checks
+    target = np.where(enpassant >= 0, BITS[np.maximum(enpassant, 0)], U64(0))
+    captured = np.where(white_to_move, target << U64(8), target >> U64(8)) & theirs[:, PAWN]
+    attacker_squares = np.where(white_to_move, PAWN_ATTACK_MASKS[1][np.maximum(enpassant, 0)],
+                                PAWN_ATTACK_MASKS[0][np.maximum(enpassant, 0)])
+    capturers = np.where(captured != 0, attacker_squares & ours[:, PAWN], U64(0))
+    remaining = theirs.copy()
+    remaining[:, PAWN] &= ~captured
+    for _ in range(2):
+        capturer = lowest_bit(capturers)
+        capturers &= ~capturer
+        after = (occupied & ~capturer & ~captured) | target
+        legal = (capturer != 0) & ~square_attacked(king_square, after, remaining, ~white_to_move)
+        legal_moves += legal.astype(np.int64)
+
+    #evaluation terms, the same blend as evaluation.evaluate
+    if boards is None:
+        boards = boards_from_bitboards(bitboards)
+    codes = boards.reshape(count, 64).astype(np.intp)
+    middlegame = MIDDLEGAME_TABLE[codes, SQUARES].sum(axis=1)
+    endgame = ENDGAME_TABLE[codes, SQUARES].sum(axis=1)
+    phase = PHASE_TABLE[codes].sum(axis=1)
+    blend_phase = np.minimum(phase, evaluation.MAX_PHASE)
+    score = np.trunc((middlegame * blend_phase + endgame * (evaluation.MAX_PHASE - blend_phase))
+                     / evaluation.MAX_PHASE).astype(np.int64)
+
+    return {
+        "white_attacks": white_attacks,
+        "black_attacks": black_attacks,
+        "in_check": in_check,
+        "legal_moves": legal_moves,
+        "checkmate": (legal_moves == 0) & in_check,
+        "stalemate": (legal_moves == 0) & ~in_check,
+        "middlegame": middlegame,
+        "endgame": endgame,
+        "phase": phase,
+        "evaluation": np.where(white_to_move, score, -score),
+    }
+
+
+#squares attacked by each colour according to GameState.square_under_attacked, as bitboards
+def game_state_attacks(game_state):
+    attacks = []
+    white_to_move = game_state.white_to_move
+    for attacker_is_white in (True, False):
+        game_state.white_to_move = not attacker_is_white #square_under_attacked tests the side not to move
+        attacks.append(sum(1 << square for square in range(64) if game_state.square_under_attacked(square // 8, square % 8)))
+    game_state.white_to_move = white_to_move
+    return attacks
+
+
+#compare analyse() with GameState on each position, returns a list of mismatch descriptions
+def cross_check(game_states):
+    boards, white_to_move, castling_bits, enpassant = encode_game_states(game_states)
+    results = analyse(boards, white_to_move, castling_bits, enpassant)
+    #the bitboard input, decoded back to boards for the evaluation
+    bitboard_results = analyse_bitboards(bitboards_from_boards(boards), white_to_move, castling_bits, enpassant)
+    mismatches = []
+    for index, game_state in enumerate(game_states):
+        valid_moves = game_state.get_valid_moves()
+        white_attacks, black_attacks = game_state_attacks(game_state)
+        expected = {"legal_moves": len(valid_moves), "in_check": game_state.in_check(),
+                    "checkmate": game_state.checkmate, "stalemate": game_state.stalemate,
+                    "white_attacks": white_attacks, "black_attacks": black_attacks, "evaluation": evaluate(game_state),
+                    "middlegame": game_state.middlegame_score, "endgame": game_state.endgame_score, "phase": game_state.phase}
+        for name, value in expected.items():
+            for source in (results, bitboard_results):
+                if source[name][index] != value:
+                    mismatches.append("%s: %s %s != GameState %s" % (notation.to_fen(game_state), name, source[name][index], value))
+                    break
+    return mismatches
+
+
+#positions from random games started from the start position and the perft suite, which has the castling,
+#en passant, pin and check cases
+def random_positions(count, seed=0, max_plies=150):
+    rng = random.Random(seed)
+    starts = [fen for fen, _ in perft.PERFT_SUITE.values()]
+    fens = []
+    while len(fens) < count:
+        game_state = notation.parse_fen(rng.choice(starts))
+        for ply in range(rng.randrange(max_plies)):
+            moves = game_state.get_valid_moves()
+            if not moves:
+                break
+            game_state.make_move(rng.choice(moves))
+        fens.append(notation.to_fen(game_state))
+    return [notation.parse_fen(fen) for fen in fens]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the NumPy batch analysis against GameState and time both")
+    parser.add_argument("--positions", type=int, default=2000, help="random positions to check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=50, help="copies of the positions in the speed test")
+    args = parser.parse_args()
+
+    game_states = random_positions(args.positions, args.seed)
+    mismatches = cross_check(game_states)
+    for mismatch in mismatches[:20]:
+        print(mismatch)
+    print("%d positions checked, %d mismatches" % (len(game_states), len(mismatches)))
+
+    #speed: one GameState pass against the batch on repeat copies of the positions
+    start = time.perf_counter()
+    for game_state in game_states:
+        game_state.get_valid_moves()
+        game_state_attacks(game_state)
+        evaluate(game_state)
+    game_state_rate = len(game_states) / (time.perf_counter() - start)
+    boards, white_to_move, castling_bits, enpassant = encode_game_states(game_states)
+    boards, white_to_move = np.tile(boards, (args.repeat, 1, 1)), np.tile(white_to_move, args.repeat)
+    castling_bits, enpassant = np.tile(castling_bits, args.repeat), np.tile(enpassant, args.repeat)
+    start = time.perf_counter()
+    analyse(boards, white_to_move, castling_bits, enpassant)
+    batch_rate = len(boards) / (time.perf_counter() - start)
+    print("GameState %10.0f positions/s" % game_state_rate)
+    print("batch     %10.0f positions/s  (%d positions, %.0fx)" % (batch_rate, len(boards), batch_rate / game_state_rate))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
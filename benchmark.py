@@ -0,0 +1,165 @@
+#Micro benchmarks for the engine hot paths
+#
+#usage: python benchmark.py moves      time and memory per generated Move
+#       python benchmark.py cache      legal move cache on undo/redo of a game
+#       python benchmark.py staged     staged move generation against get_valid_moves, alone and in the search
+#       python benchmark.py sparse     perft and evaluation on the suite, by number of pieces
+import argparse
+import random
+import time
+import tracemalloc
+
+import notation
+import perft
+import search
+from move import Move
+from moveCache import MoveCache
+from search import Searcher
+
+
+#best of repeat runs of fn, in seconds
+def best_time(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+#cost of creating Move objects, alone and as part of get_valid_moves on the perft suite positions
+def bench_moves(count=100000):
+    game_state = notation.parse_fen(notation.START_FEN)
+    board = game_state.board
+
+    elapsed = best_time(lambda: [Move((6, 4), (4, 4), board) for _ in range(count)])
+    print("Move()            %8.1f ns/move" % (elapsed / count * 1e9))
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    moves = [Move((6, 4), (4, 4), board) for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print("Move() memory     %8.1f bytes/move" % ((allocated - len(moves) * 8) / count)) #minus the list slot
+    del moves
+
+    total_moves = 0
+    total_time = 0.0
+    for name, (fen, _) in perft.PERFT_SUITE.items():
+        game_state = notation.parse_fen(fen)
+        generated = len(game_state.get_valid_moves())
+        calls = 200
+        elapsed = best_time(lambda: [game_state.get_valid_moves() for _ in range(calls)], repeat=3)
+        total_moves += generated * calls
+        total_time += elapsed
+        print("%-20s %3d moves  %8.1f us/call  %6.2f us/move" % (name, generated, elapsed / calls * 1e6, elapsed / (generated * calls) * 1e6))
+    print("get_valid_moves   %8.2f us/move overall" % (total_time / total_moves * 1e6))
+
+
+#undo a random game back to the start and replay it, the way the UI revisits positions, with and without the move cache
+def bench_move_cache(plies=80, rounds=5):
+    rng = random.Random(1)
+    game_state = notation.parse_fen(notation.START_FEN)
+    for _ in range(plies):
+        moves = game_state.get_valid_moves()
+        if len(moves) == 0:
+            break
+        game_state.make_move(rng.choice(moves))
+    game = list(game_state.move_log)
+
+    def replay(game_state):
+        generated = []
+        for _ in range(rounds):
+            while len(game_state.move_log) != 0:
+                game_state.undo_move()
+                generated.append(game_state.get_valid_moves())
+            for move in game:
+                game_state.make_move(move)
+                generated.append(game_state.get_valid_moves())
+        return generated
+
+    game_state.disable_move_cache()
+    start = time.perf_counter()
+    expected = replay(game_state)
+    uncached = time.perf_counter() - start
+
+    move_cache = game_state.enable_move_cache(MoveCache())
+    start = time.perf_counter()
+    generated = replay(game_state)
+    cached = time.perf_counter() - start
+
+    print("%d plies, %d undo/replay rounds, %d get_valid_moves calls" % (len(game), rounds, len(expected)))
+    print("uncached          %8.1f ms" % (uncached * 1000))
+    print("cached            %8.1f ms  %s" % (cached * 1000, move_cache.stats()))
+    print("same moves        %8s" % (generated == expected))
+
+
+#first move, all moves and captures only: staged generators against the eager get_valid_moves,
+#then a fixed depth search with each
+def bench_staged_moves(calls=200, search_depth=4):
+    totals = [0.0] * 6
+    for name, (fen, _) in perft.PERFT_SUITE.items():
+        game_state = notation.parse_fen(fen)
+        eager = best_time(lambda: [game_state.get_valid_moves() for _ in range(calls)], repeat=3)
+        first = best_time(lambda: [next(game_state.generate_staged_moves()) for _ in range(calls)], repeat=3)
+        staged = best_time(lambda: [list(game_state.generate_staged_moves()) for _ in range(calls)], repeat=3)
+        eager_captures = best_time(lambda: [[move for move in game_state.get_valid_moves() if move.piece_captured != "--"]
+                                            for _ in range(calls)], repeat=3)
+        captures = best_time(lambda: [game_state.generate_captures() for _ in range(calls)], repeat=3)
+        for index, elapsed in enumerate((eager, first, staged, eager_captures, captures)):
+            totals[index] += elapsed
+        print("%-20s eager %6.1f  first %6.1f  all staged %6.1f  captures eager %6.1f  staged %6.1f us/call" % (
+            name, eager / calls * 1e6, first / calls * 1e6, staged / calls * 1e6,
+            eager_captures / calls * 1e6, captures / calls * 1e6))
+    print("total                eager %6.1f  first %6.1f  all staged %6.1f  captures eager %6.1f  staged %6.1f ms" % tuple(
+        total * 1000 for total in totals[:5]))
+
+    for staged_moves in (False, True):
+        nodes = 0
+        start = time.perf_counter()
+        for name in ("startpos", "kiwipete", "position3"):
+            game_state = notation.parse_fen(perft.PERFT_SUITE[name][0])
+            result = Searcher(staged_moves=staged_moves).search(game_state, None, search_depth)
+            nodes += result.nodes
+        elapsed = time.perf_counter() - start
+        print("search depth %d %-7s %8d nodes  %6.2fs  %6d nps" % (search_depth, "staged" if staged_moves else "eager",
+                                                                  nodes, elapsed, nodes / elapsed))
+
+
+#generation and evaluation only visit occupied squares, so their cost should follow the piece count
+def bench_sparse(max_nodes=100000, evaluations=20000):
+    for name, (fen, counts) in sorted(perft.PERFT_SUITE.items(), key=lambda item: sum(char.isalpha() for char in item[1][0].split()[0])):
+        game_state = notation.parse_fen(fen)
+        pieces = sum(len(squares) for squares in game_state.piece_squares.values())
+        perft_depth = max(depth for depth in range(1, len(counts) + 1) if depth == 1 or counts[depth - 1] <= max_nodes)
+        elapsed = best_time(lambda: perft.perft(game_state, perft_depth), repeat=3)
+        nodes = counts[perft_depth - 1]
+        evaluate_time = best_time(lambda: [search.evaluate(game_state) for _ in range(evaluations)], repeat=3)
+        print("%-20s %2d pieces  perft(%d) %8d nodes %7.3fs %7d nps  evaluate %5.2f us" % (
+            name, pieces, perft_depth, nodes, elapsed, nodes / elapsed, evaluate_time / evaluations * 1e6))
+
+
+BENCHMARKS = {
+    "moves": bench_moves,
+    "cache": bench_move_cache,
+    "staged": bench_staged_moves,
+    "sparse": bench_sparse,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Engine micro benchmarks")
+    parser.add_argument("benchmark", nargs="*", help="benchmarks to run: %s (default: all)" % ", ".join(BENCHMARKS))
+    args = parser.parse_args()
+    for name in args.benchmark:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: " + name)
+    for name in args.benchmark or BENCHMARKS:
+        print("==", name)
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+#Bitboard backend for the game state
+#every piece type has a 64 bit integer, bit (row*8 + col) is set when the piece is on (row, col)
+#the list of lists board is still kept in sync so drawing and Move objects keep working
+import castleRights
+from gameState import GameState, mvv_lva_score
+from move import Move
+
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+FULL_BOARD = (1 << 64) - 1
+
+#(change_row, change_col), first 4 orthogonal, last 4 diagonal
+DIRECTIONS = ((-1,0), (0,-1), (1,0), (0,1), (-1,-1), (-1,1), (1,-1), (1,1))
+
+
+def square_bit(row, col):
+    return 1 << (row*8 + col)
+
+
+#yield the index of every set bit, lowest first
+def iterate_bits(bitboard):
+    while bitboard:
+        low_bit = bitboard & -bitboard
+        yield low_bit.bit_length() - 1
+        bitboard ^= low_bit
+
+
+def build_leaper_attacks(offsets):
+    attacks = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        mask = 0
+        for change_row, change_col in offsets:
+            end_row, end_col = row + change_row, col + change_col
+            if 0 <= end_row < 8 and 0 <= end_col < 8:
+                mask |= square_bit(end_row, end_col)
+        attacks.append(mask)
+    return attacks
+
+
+def build_rays():
+    rays = [[0]*64 for _ in DIRECTIONS]
+    for j, (change_row, change_col) in enumerate(DIRECTIONS):
+        for square in range(64):
+            row, col = divmod(square, 8)
+            for i in range(1,8):
+                end_row, end_col = row + change_row*i, col + change_col*i
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+                rays[j][square] |= square_bit(end_row, end_col)
+    return rays
+
+
+KNIGHT_ATTACKS = build_leaper_attacks(((-2,-1), (-2,1), (2,-1), (2, 1), (-1,-2), (-1,2), (1,-2), (1,2)))
+KING_ATTACKS = build_leaper_attacks(DIRECTIONS)
+#squares attacked by a pawn of that color standing on the square
+PAWN_ATTACKS = {"w": build_leaper_attacks(((-1,-1), (-1,1))), "b": build_leaper_attacks(((1,-1), (1,1)))}
+RAYS = build_rays()
+#a ray is "positive" when square indices increase along it, the nearest blocker is then the lowest bit
+POSITIVE_RAY = [change_row*8 + change_col > 0 for change_row, change_col in DIRECTIONS]
+
+#BETWEEN[a][b]: squares strictly between two aligned squares, LINE[a][b]: BETWEEN plus b itself
+BETWEEN = [[0]*64 for _ in range(64)]
+LINE = [[0]*64 for _ in range(64)]
+for _j in range(8):
+    for _start in range(64):
+        _between = 0
+        for _end in iterate_bits(RAYS[_j][_start]) if POSITIVE_RAY[_j] else reversed(list(iterate_bits(RAYS[_j][_start]))):
+            BETWEEN[_start][_end] = _between
+            LINE[_start][_end] = _between | (1 << _end)
+            _between |= 1 << _end
+
+
+def slider_attacks(square, occupied, directions):
+    attacks = 0
+    for j in directions:
+        ray = RAYS[j][square]
+        blockers = ray & occupied
+        if blockers:
+            if POSITIVE_RAY[j]:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAYS[j][first] #cut the ray behind the first blocker
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(square, occupied):
+    return slider_attacks(square, occupied, (0, 1, 2, 3))
+
+
+def bishop_attacks(square, occupied):
+    return slider_attacks(square, occupied, (4, 5, 6, 7))
+
+
+class BitboardGameState(GameState):
+    def load_position(self, board, white_to_move, castling_rights, enpassant_possible=(), halfmove_clock=0, fullmove_number=1):
+        super().load_position(board, white_to_move, castling_rights, enpassant_possible, halfmove_clock, fullmove_number)
+        self.init_bitboards()
+
+    #build the 12 piece bitboards and the occupancy from self.board
+    def init_bitboards(self):
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.color_occupancy = {"w": 0, "b": 0}
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    self.bitboards[piece] |= square_bit(row, col)
+                    self.color_occupancy[piece[0]] |= square_bit(row, col)
+        self.occupied = self.color_occupancy["w"] | self.color_occupancy["b"]
+
+    def make_move(self, move):
+        self.toggle_move_bits(move)
+        super().make_move(move)
+
+    def undo_move(self):
+        if len(self.move_log) != 0:
+            self.toggle_move_bits(self.move_log[-1])
+        super().undo_move()
+
+    #XOR the squares changed by a move, applying it twice restores the bitboards (used by undo)
+    def toggle_move_bits(self, move):
+        color = move.piece_moved[0]
+        start_bit = square_bit(move.start_row, move.start_col)
+        end_bit = square_bit(move.end_row, move.end_col)
+        bitboards = self.bitboards
+        bitboards[move.piece_moved] ^= start_bit
+        if move.is_pawn_promotion:
+            bitboards[color + move.promotion_piece] ^= end_bit
+        else:
+            bitboards[move.piece_moved] ^= end_bit
+        self.color_occupancy[color] ^= start_bit | end_bit
+
+        if move.piece_captured != "--":
+            if move.is_enpassant_move:
+                captured_bit = square_bit(move.start_row, move.end_col)
+            else:
+                captured_bit = end_bit
+            bitboards[move.piece_captured] ^= captured_bit
+            self.color_occupancy[move.piece_captured[0]] ^= captured_bit
+
+        if move.is_castle_move:
+            if move.end_col - move.start_col == 2: #king side
+                rook_bits = square_bit(move.end_row, move.end_col + 1) | square_bit(move.end_row, move.end_col - 1)
+            else: #queen side
+                rook_bits = square_bit(move.end_row, move.end_col - 2) | square_bit(move.end_row, move.end_col + 1)
+            bitboards[color + "R"] ^= rook_bits
+            self.color_occupancy[color] ^= rook_bits
+
+        self.occupied = self.color_occupancy["w"] | self.color_occupancy["b"]
+
+    #bitboard of the enemy pieces attacking square with the given occupancy
+    def attackers_of(self, square, occupied, enemy_color):
+        bitboards = self.bitboards
+        friendly_color = "b" if enemy_color == "w" else "w"
+        return ((KNIGHT_ATTACKS[square] & bitboards[enemy_color + "N"])
+                | (KING_ATTACKS[square] & bitboards[enemy_color + "K"])
+                | (PAWN_ATTACKS[friendly_color][square] & bitboards[enemy_color + "p"])
+                | (rook_attacks(square, occupied) & (bitboards[enemy_color + "R"] | bitboards[enemy_color + "Q"]))
+                | (bishop_attacks(square, occupied) & (bitboards[enemy_color + "B"] | bitboards[enemy_color + "Q"])))
+
+    #determine if the enemy can attack the square (row, col)
+    def square_under_attacked(self, row, col):
+        enemy_color = "b" if self.white_to_move else "w"
+        return self.attackers_of(row*8 + col, self.occupied, enemy_color) != 0
+
+    #generate the valid moves and set the checkmate/stalemate flags
+    def generate_valid_moves(self):
+        ally_color, enemy_color = ("w", "b") if self.white_to_move else ("b", "w")
+        bitboards = self.bitboards
+        king_square = (bitboards[ally_color + "K"] & -bitboards[ally_color + "K"]).bit_length() - 1
+        checkers = self.attackers_of(king_square, self.occupied, enemy_color)
+
+        #pinned pieces can only move on the line between the king and the pinning slider
+        pin_lines = {}
+        snipers = ((rook_attacks(king_square, 0) & (bitboards[enemy_color + "R"] | bitboards[enemy_color + "Q"]))
+                   | (bishop_attacks(king_square, 0) & (bitboards[enemy_color + "B"] | bitboards[enemy_color + "Q"])))
+        for sniper in iterate_bits(snipers):
+            blockers = BETWEEN[king_square][sniper] & self.occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & self.color_occupancy[ally_color]:
+                pin_lines[blockers.bit_length() - 1] = LINE[king_square][sniper]
+
+        moves = []
+        if checkers & (checkers - 1) == 0: #not double check, other pieces can move
+            if checkers:
+                checker = checkers.bit_length() - 1
+                check_mask = BETWEEN[king_square][checker] | checkers
+            else:
+                check_mask = FULL_BOARD
+            self.get_piece_moves(ally_color, check_mask, pin_lines, moves)
+            self.get_enpassant_moves(ally_color, enemy_color, king_square, check_mask, pin_lines, moves)
+            if not checkers:
+                self.get_bitboard_castling_moves(king_square, enemy_color, moves)
+        self.get_bitboard_king_moves(king_square, ally_color, enemy_color, moves)
+
+        #check if checkmate/stalemate
+        if len(moves) == 0:
+            if checkers:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+        else:
+            self.checkmate = False
+            self.stalemate = False
+
+        return moves
+
+    #same stages as GameState.generate_staged_moves, the mailbox legality filter doesnt see the bitboards
+    #so the legal moves are generated at once (cheap with bitboards) and handed out in stage order
+    def generate_staged_moves(self, priority_move_ids=(), killers=(), quiet_order=None):
+        moves = self.generate_valid_moves()
+        by_id = {move.move_id: move for move in moves}
+        yielded = set()
+        for move_id in priority_move_ids:
+            if move_id in by_id and move_id not in yielded:
+                yielded.add(move_id)
+                yield by_id[move_id]
+
+        captures = [move for move in moves if move.piece_captured != "--"]
+        captures.sort(key=mvv_lva_score, reverse=True)
+        for move in captures:
+            if move.move_id not in yielded:
+                yield move
+        for move in moves:
+            if move.is_pawn_promotion and move.piece_captured == "--" and move.move_id not in yielded:
+                yield move
+
+        for killer in killers:
+            move = by_id.get(killer.move_id) if killer is not None else None
+            if (move is not None and move.move_id not in yielded and move.piece_captured == "--"
+                    and not move.is_pawn_promotion):
+                yielded.add(move.move_id)
+                yield move
+
+        quiets = [move for move in moves if move.piece_captured == "--" and not move.is_pawn_promotion]
+        if quiet_order is not None:
+            quiets.sort(key=quiet_order, reverse=True)
+        for move in quiets:
+            if move.move_id not in yielded:
+                yield move
+
+    def generate_captures(self):
+        captures = [move for move in self.generate_valid_moves() if move.piece_captured != "--"]
+        captures.sort(key=mvv_lva_score, reverse=True)
+        return captures
+
+    #All moves that dont consider checks
+    def get_all_possible_moves(self):
+        ally_color, enemy_color = ("w", "b") if self.white_to_move else ("b", "w")
+        king_square = (self.bitboards[ally_color + "K"] & -self.bitboards[ally_color + "K"]).bit_length() - 1
+        moves = []
+        self.get_piece_moves(ally_color, FULL_BOARD, {}, moves)
+        if self.enpassant_possible != ():
+            for start_square in iterate_bits(PAWN_ATTACKS[enemy_color][self.enpassant_square()] & self.bitboards[ally_color + "p"]):
+                moves.append(Move(divmod(start_square, 8), self.enpassant_possible, self.board, is_enpassant_move=True))
+        for end_square in iterate_bits(KING_ATTACKS[king_square] & ~self.color_occupancy[ally_color]):
+            moves.append(Move(divmod(king_square, 8), divmod(end_square, 8), self.board))
+        return moves
+
+    def enpassant_square(self):
+        return self.enpassant_possible[0]*8 + self.enpassant_possible[1]
+
+    #pawn, knight, bishop, rook and queen moves restricted to check_mask and pin lines
+    def get_piece_moves(self, ally_color, check_mask, pin_lines, moves):
+        bitboards = self.bitboards
+        board = self.board
+        occupied = self.occupied
+        own = self.color_occupancy[ally_color]
+        enemy = self.color_occupancy["b" if ally_color == "w" else "w"]
+
+        for piece_type in ("N", "B", "R", "Q"):
+            for start_square in iterate_bits(bitboards[ally_color + piece_type]):
+                if piece_type == "N":
+                    targets = KNIGHT_ATTACKS[start_square]
+                elif piece_type == "B":
+                    targets = bishop_attacks(start_square, occupied)
+                elif piece_type == "R":
+                    targets = rook_attacks(start_square, occupied)
+                else:
+                    targets = rook_attacks(start_square, occupied) | bishop_attacks(start_square, occupied)
+                targets &= ~own & check_mask
+                if start_square in pin_lines:
+                    targets &= pin_lines[start_square]
+                start = divmod(start_square, 8)
+                for end_square in iterate_bits(targets):
+                    moves.append(Move(start, divmod(end_square, 8), board))
+
+        forward, start_row = (-8, 6) if ally_color == "w" else (8, 1)
+        for start_square in iterate_bits(bitboards[ally_color + "p"]):
+            targets = PAWN_ATTACKS[ally_color][start_square] & enemy
+            one_step = start_square + forward
+            if not occupied & (1 << one_step):
+                targets |= 1 << one_step
+                if start_square // 8 == start_row and not occupied & (1 << (one_step + forward)):
+                    targets |= 1 << (one_step + forward)
+            targets &= check_mask
+            if start_square in pin_lines:
+                targets &= pin_lines[start_square]
+            start = divmod(start_square, 8)
+            for end_square in iterate_bits(targets):
+                moves.append(Move(start, divmod(end_square, 8), board))
+
+    def get_enpassant_moves(self, ally_color, enemy_color, king_square, check_mask, pin_lines, moves):
+        if self.enpassant_possible == ():
+            return
+        end_square = self.enpassant_square()
+        captured_square = end_square + (8 if ally_color == "w" else -8)
+        if not check_mask & ((1 << end_square) | (1 << captured_square)):
+            return
+        bitboards = self.bitboards
+        enemy_rooks = bitboards[enemy_color + "R"] | bitboards[enemy_color + "Q"]
+        enemy_bishops = bitboards[enemy_color + "B"] | bitboards[enemy_color + "Q"]
+        for start_square in iterate_bits(PAWN_ATTACKS[enemy_color][end_square] & bitboards[ally_color + "p"]):
+            if start_square in pin_lines and not pin_lines[start_square] & (1 << end_square):
+                continue
+            #both pawns leave their rank, make sure no slider sees the king afterwards
+            occupied = self.occupied ^ (1 << start_square) ^ (1 << captured_square) | (1 << end_square)
+            if rook_attacks(king_square, occupied) & enemy_rooks or bishop_attacks(king_square, occupied) & enemy_bishops:
+                continue
+            moves.append(Move(divmod(start_square, 8), divmod(end_square, 8), self.board, is_enpassant_move=True))
+
+    def get_bitboard_king_moves(self, king_square, ally_color, enemy_color, moves):
+        occupied = self.occupied ^ (1 << king_square) #the king cant shelter behind itself
+        start = divmod(king_square, 8)
+        for end_square in iterate_bits(KING_ATTACKS[king_square] & ~self.color_occupancy[ally_color]):
+            if not self.attackers_of(end_square, occupied, enemy_color):
+                moves.append(Move(start, divmod(end_square, 8), self.board))
+
+    def get_bitboard_castling_moves(self, king_square, enemy_color, moves):
+        row, col = divmod(king_square, 8)
+        if self.castling_bits & (castleRights.WHITE_KING_SIDE if self.white_to_move else castleRights.BLACK_KING_SIDE):
+            if not self.occupied & (square_bit(row, col+1) | square_bit(row, col+2)):
+                if not self.attackers_of(king_square + 1, self.occupied, enemy_color) and not self.attackers_of(king_square + 2, self.occupied, enemy_color):
+                    moves.append(Move((row, col), (row, col+2), self.board, is_castle_move = True))
+        if self.castling_bits & (castleRights.WHITE_QUEEN_SIDE if self.white_to_move else castleRights.BLACK_QUEEN_SIDE):
+            if not self.occupied & (square_bit(row, col-1) | square_bit(row, col-2) | square_bit(row, col-3)):
+                if not self.attackers_of(king_square - 1, self.occupied, enemy_color) and not self.attackers_of(king_square - 2, self.occupied, enemy_color):
+                    moves.append(Move((row, col), (row, col-2), self.board, is_castle_move = True))
@@ -1,7 +1,34 @@
 #data storage for castle rights
+#the game state keeps them packed in 4 bits, CastleRights is the readable form
+WHITE_KING_SIDE = 1
+WHITE_QUEEN_SIDE = 2
+BLACK_KING_SIDE = 4
+BLACK_QUEEN_SIDE = 8
+ALL_CASTLING = 15
+
 class CastleRights():
     def __init__(self, w_king_side, b_king_side, w_queen_side, b_queen_side):
         self.wks = w_king_side
         self.bks = b_king_side
         self.wqs = w_queen_side
         self.bqs = b_queen_side
+
+    def to_bits(self):
+        return ((WHITE_KING_SIDE if self.wks else 0) | (WHITE_QUEEN_SIDE if self.wqs else 0)
+                | (BLACK_KING_SIDE if self.bks else 0) | (BLACK_QUEEN_SIDE if self.bqs else 0))
+
+
+def from_bits(bits):
+    return CastleRights(bits & WHITE_KING_SIDE != 0, bits & BLACK_KING_SIDE != 0,
+                        bits & WHITE_QUEEN_SIDE != 0, bits & BLACK_QUEEN_SIDE != 0)
+
+
+#CASTLING_MASK[row*8 + col]: rights kept when a piece moves from or to that square
+#a king or rook leaving its start square, or a rook captured on it, loses the matching rights
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[0*8 + 0] = ALL_CASTLING & ~BLACK_QUEEN_SIDE #a8 rook
+CASTLING_MASK[0*8 + 7] = ALL_CASTLING & ~BLACK_KING_SIDE #h8 rook
+CASTLING_MASK[0*8 + 4] = ALL_CASTLING & ~(BLACK_KING_SIDE | BLACK_QUEEN_SIDE) #e8 king
+CASTLING_MASK[7*8 + 0] = ALL_CASTLING & ~WHITE_QUEEN_SIDE #a1 rook
+CASTLING_MASK[7*8 + 7] = ALL_CASTLING & ~WHITE_KING_SIDE #h1 rook
+CASTLING_MASK[7*8 + 4] = ALL_CASTLING & ~(WHITE_KING_SIDE | WHITE_QUEEN_SIDE) #e1 king
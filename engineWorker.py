@@ -0,0 +1,121 @@
+#Run engine work (move generation, search) in a separate process so the pygame loop never blocks
+#the UI sends a copy of the GameState with a request id and polls for the response every frame,
+#a request is cancelled by changing the shared active request id, which the search checks as its stop flag
+#the engine modules are only imported in the worker process, the UI opens its window without loading them
+import multiprocessing
+import queue
+
+VALID_MOVES = "valid_moves"
+SEARCH = "search"
+NO_REQUEST = 0
+
+
+#stop flag for the search, set as soon as the request is no longer the active one
+class CancelFlag():
+    def __init__(self, active_request, request_id):
+        self.active_request = active_request
+        self.request_id = request_id
+
+    def is_set(self):
+        return self.active_request.value != self.request_id
+
+
+#worker process: answer requests until None is received
+#with a stats queue the engine functions are instrumented and their stats sent after every request
+def worker_loop(requests, responses, active_request, book_path=None, stats_queue=None):
+    from moveCache import MoveCache
+    from openingBook import OpeningBook
+    from search import Searcher
+
+    instrumentation = None
+    if stats_queue is not None:
+        from instrumentation import Instrumentation
+        instrumentation = Instrumentation()
+        instrumentation.enable()
+    opening_book = OpeningBook(book_path) if book_path is not None else None
+    searcher = Searcher(opening_book=opening_book) #keeps its transposition table between searches
+    move_cache = MoveCache() #positions revisited by undo/reset are answered without generating again
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, kind, game_state, time_limit_ms = request
+        if active_request.value != request_id: #cancelled before it started
+            continue
+
+        if kind == VALID_MOVES:
+            game_state.enable_move_cache(move_cache)
+            moves = game_state.get_valid_moves()
+            payload = (moves, game_state.checkmate, game_state.stalemate)
+        else:
+            payload = searcher.search(game_state, time_limit_ms, stop_event=CancelFlag(active_request, request_id))
+
+        if active_request.value == request_id:
+            responses.put((request_id, kind, payload))
+        if instrumentation is not None:
+            stats_queue.put(instrumentation.stats())
+
+
+class EngineWorker():
+    #book_path: opening book file (see openingBook) the engine plays from before searching, None for no book
+    #instrument: measure the engine functions in the worker process (see instrumentation and engine_stats)
+    def __init__(self, book_path=None, instrument=False):
+        self.requests = multiprocessing.Queue()
+        self.responses = multiprocessing.Queue()
+        self.active_request = multiprocessing.Value("q", NO_REQUEST, lock=False)
+        self.last_request_id = NO_REQUEST
+        self.stats_queue = multiprocessing.Queue() if instrument else None
+        self.last_stats = None
+        self.process = multiprocessing.Process(target=worker_loop, args=(self.requests, self.responses, self.active_request, book_path,
+                                                                         self.stats_queue),
+                                               daemon=True)
+        self.process.start()
+
+    #legal moves and checkmate/stalemate flags of the position, returns the request id
+    def request_valid_moves(self, game_state):
+        return self.send(VALID_MOVES, game_state, None)
+
+    #best move within the time budget, returns the request id
+    def request_search(self, game_state, time_limit_ms):
+        return self.send(SEARCH, game_state, time_limit_ms)
+
+    #only one request is active at a time, sending a new one cancels the previous one
+    def send(self, kind, game_state, time_limit_ms):
+        self.last_request_id += 1
+        self.active_request.value = self.last_request_id
+        self.requests.put((self.last_request_id, kind, game_state, time_limit_ms))
+        return self.last_request_id
+
+    #cancel the pending request, a running search stops at its next stop check
+    def cancel(self):
+        self.active_request.value = NO_REQUEST
+
+    def is_busy(self):
+        return self.active_request.value != NO_REQUEST
+
+    #non blocking, returns (kind, payload) of the active request once it is done, otherwise None
+    def poll(self):
+        while True:
+            try:
+                request_id, kind, payload = self.responses.get_nowait()
+            except queue.Empty:
+                return None
+            if request_id == self.active_request.value: #skip stale answers of cancelled requests
+                self.active_request.value = NO_REQUEST
+                return kind, payload
+
+    #latest Instrumentation.stats() of the worker process, None if it is not instrumented or sent none yet
+    def engine_stats(self):
+        while self.stats_queue is not None:
+            try:
+                self.last_stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                break
+        return self.last_stats
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,131 @@
+#Static evaluation: material plus piece-square tables for the middlegame and the endgame,
+#blended by the game phase (how much non pawn material is left)
+#the game state keeps the middlegame/endgame sums and the phase up to date in make_move/undo_move,
+#so evaluate() is only the blend; compute_terms() recomputes them from scratch
+PIECE_TYPES = ("p", "N", "B", "R", "Q", "K")
+
+MIDDLEGAME_VALUES = {"p": 82, "N": 337, "B": 365, "R": 477, "Q": 1025, "K": 0}
+ENDGAME_VALUES = {"p": 94, "N": 281, "B": 297, "R": 512, "Q": 936, "K": 0}
+#phase of the start position is 24, a bare endgame is 0
+PHASE_WEIGHTS = {"p": 0, "N": 1, "B": 1, "R": 2, "Q": 4, "K": 0}
+MAX_PHASE = 24
+
+#piece-square tables for white, indexed by row*8 + col (row 0 is rank 8), black uses the mirrored row
+MIDDLEGAME_TABLES = {
+    "p": (  0,   0,   0,   0,   0,   0,   0,   0,
+           50,  50,  50,  50,  50,  50,  50,  50,
+           10,  10,  20,  30,  30,  20,  10,  10,
+            5,   5,  10,  25,  25,  10,   5,   5,
+            0,   0,   0,  20,  20,   0,   0,   0,
+            5,  -5, -10,   0,   0, -10,  -5,   5,
+            5,  10,  10, -20, -20,  10,  10,   5,
+            0,   0,   0,   0,   0,   0,   0,   0),
+    "N": (-50, -40, -30, -30, -30, -30, -40, -50,
+          -40, -20,   0,   0,   0,   0, -20, -40,
+          -30,   0,  10,  15,  15,  10,   0, -30,
+          -30,   5,  15,  20,  20,  15,   5, -30,
+          -30,   0,  15,  20,  20,  15,   0, -30,
+          -30,   5,  10,  15,  15,  10,   5, -30,
+          -40, -20,   0,   5,   5,   0, -20, -40,
+          -50, -40, -30, -30, -30, -30, -40, -50),
+    "B": (-20, -10, -10, -10, -10, -10, -10, -20,
+          -10,   0,   0,   0,   0,   0,   0, -10,
+          -10,   0,   5,  10,  10,   5,   0, -10,
+          -10,   5,   5,  10,  10,   5,   5, -10,
+          -10,   0,  10,  10,  10,  10,   0, -10,
+          -10,  10,  10,  10,  10,  10,  10, -10,
+          -10,   5,   0,   0,   0,   0,   5, -10,
+          -20, -10, -10, -10, -10, -10, -10, -20),
+    "R": (  0,   0,   0,   0,   0,   0,   0,   0,
+            5,  10,  10,  10,  10,  10,  10,   5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+            0,   0,   0,   5,   5,   0,   0,   0),
+    "Q": (-20, -10, -10,  -5,  -5, -10, -10, -20,
+          -10,   0,   0,   0,   0,   0,   0, -10,
+          -10,   0,   5,   5,   5,   5,   0, -10,
+           -5,   0,   5,   5,   5,   5,   0,  -5,
+            0,   0,   5,   5,   5,   5,   0,  -5,
+          -10,   5,   5,   5,   5,   5,   0, -10,
+          -10,   0,   5,   0,   0,   0,   0, -10,
+          -20, -10, -10,  -5,  -5, -10, -10, -20),
+    "K": (-30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -20, -30, -30, -40, -40, -30, -30, -20,
+          -10, -20, -20, -20, -20, -20, -20, -10,
+           20,  20,   0,   0,   0,   0,  20,  20,
+           20,  30,  10,   0,   0,  10,  30,  20),
+}
+
+#in the endgame pawns are worth more the further they are, the king goes to the centre
+#and the other pieces keep their middlegame tables
+ENDGAME_TABLES = dict(MIDDLEGAME_TABLES)
+ENDGAME_TABLES["p"] = (  0,   0,   0,   0,   0,   0,   0,   0,
+                        80,  80,  80,  80,  80,  80,  80,  80,
+                        50,  50,  50,  50,  50,  50,  50,  50,
+                        30,  30,  30,  30,  30,  30,  30,  30,
+                        20,  20,  20,  20,  20,  20,  20,  20,
+                        10,  10,  10,  10,  10,  10,  10,  10,
+                         0,   0,   0,   0,   0,   0,   0,   0,
+                         0,   0,   0,   0,   0,   0,   0,   0)
+ENDGAME_TABLES["K"] = (-50, -40, -30, -20, -20, -30, -40, -50,
+                       -30, -20, -10,   0,   0, -10, -20, -30,
+                       -30, -10,  20,  30,  30,  20, -10, -30,
+                       -30, -10,  30,  40,  40,  30, -10, -30,
+                       -30, -10,  30,  40,  40,  30, -10, -30,
+                       -30, -10,  20,  30,  30,  20, -10, -30,
+                       -30, -30,   0,   0,   0,   0, -30, -30,
+                       -50, -30, -30, -30, -30, -30, -30, -50)
+
+
+#SCORES[piece][row*8 + col] = material + table value, positive for white pieces and negative for black,
+#so a position's score from white's point of view is the sum over its pieces
+def build_scores(values, tables):
+    scores = {"--": [0] * 64}
+    for piece_type in PIECE_TYPES:
+        table = tables[piece_type]
+        scores["w" + piece_type] = [values[piece_type] + table[square] for square in range(64)]
+        scores["b" + piece_type] = [-(values[piece_type] + table[(7 - square // 8)*8 + square % 8]) for square in range(64)]
+    return scores
+
+MIDDLEGAME_SCORES = build_scores(MIDDLEGAME_VALUES, MIDDLEGAME_TABLES)
+ENDGAME_SCORES = build_scores(ENDGAME_VALUES, ENDGAME_TABLES)
+PHASES = {"--": 0}
+PHASES.update({color + piece_type: PHASE_WEIGHTS[piece_type] for color in "wb" for piece_type in PIECE_TYPES})
+
+#when True every evaluate() checks the incremental terms against a full recompute (slow, for debugging)
+DEBUG_EVALUATION = False
+
+
+#(middlegame score, endgame score, phase) of a board, scores from white's point of view
+def compute_terms(board):
+    middlegame = endgame = phase = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece != "--":
+                middlegame += MIDDLEGAME_SCORES[piece][row*8 + col]
+                endgame += ENDGAME_SCORES[piece][row*8 + col]
+                phase += PHASES[piece]
+    return middlegame, endgame, phase
+
+
+#raise AssertionError if the terms kept by make_move/undo_move dont match a full recompute
+def check_incremental(game_state):
+    expected = compute_terms(game_state.board)
+    actual = (game_state.middlegame_score, game_state.endgame_score, game_state.phase)
+    assert actual == expected, "incremental evaluation %s != recomputed %s" % (actual, expected)
+
+
+#score in centipawns from the point of view of the side to move
+def evaluate(game_state):
+    if DEBUG_EVALUATION:
+        check_incremental(game_state)
+    phase = min(game_state.phase, MAX_PHASE) #promotions can take it past the start position
+    score = int((game_state.middlegame_score * phase + game_state.endgame_score * (MAX_PHASE - phase)) / MAX_PHASE)
+    return score if game_state.white_to_move else -score
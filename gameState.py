@@ -1,13 +1,72 @@
 #Store the state, info of the game
-from castleRights import CastleRights
+import castleRights
+import evaluation
 from move import Move
+from moveCache import MoveCache
+import zobrist
+
+#precomputed attack tables, indexed by [row][col]
+#directions: first 4 orthogonal (rook-like), last 4 diagonal (bishop-like)
+DIRECTIONS = ((-1,0), (0,-1), (1,0), (0,1), (-1,-1), (-1,1), (1,-1), (1,1))
+KNIGHT_OFFSETS = ((-2,-1), (-2,1), (2,-1), (2, 1), (-1,-2), (-1,2), (1,-2), (1,2))
+
+#RAYS[row][col][direction] -> squares from (row, col) outwards to the edge of the board
+RAYS = [[[[(row + dr*i, col + dc*i) for i in range(1,8) if 0 <= row + dr*i < 8 and 0 <= col + dc*i < 8]
+          for dr, dc in DIRECTIONS] for col in range(8)] for row in range(8)]
+KNIGHT_SQUARES = [[[(row + dr, col + dc) for dr, dc in KNIGHT_OFFSETS if 0 <= row + dr < 8 and 0 <= col + dc < 8]
+                   for col in range(8)] for row in range(8)]
+#KING_SQUARES[row][col] = squares next to (row, col)
+KING_SQUARES = [[[ray[0] for ray in RAYS[row][col] if ray] for col in range(8)] for row in range(8)]
+#indexes into DIRECTIONS/RAYS for each sliding piece
+SLIDER_DIRECTIONS = {"R": (0, 1, 2, 3), "B": (4, 5, 6, 7), "Q": (0, 1, 2, 3, 4, 5, 6, 7)}
+
+#stages of generate_staged_moves, each generated only when the previous one is used up
+CAPTURES = 0
+PROMOTIONS = 1 #promotions that are not captures
+QUIETS = 2
+#victim value * 10 - attacker value, higher is tried first
+MVV_LVA_VALUES = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 0}
+
+#(row, col) of square row*8 + col, shared so make/undo dont build new tuples
+SQUARE_COORDS = [(row, col) for row in range(8) for col in range(8)]
+
+#tables by square index (row*8 + col) for testing attacks from the piece lists
+#SQUARE_LINE[a][b] = direction (index into DIRECTIONS) from a to b, -1 if not on one line
+#BETWEEN_SQUARES[a][b] = (row, col) of the squares strictly between a and b when they are on one line
+def build_line_tables():
+    square_line = [[-1] * 64 for _ in range(64)]
+    between_squares = [[()] * 64 for _ in range(64)]
+    for square, (row, col) in enumerate(SQUARE_COORDS):
+        for direction, ray in enumerate(RAYS[row][col]):
+            for i, (end_row, end_col) in enumerate(ray):
+                square_line[square][end_row*8 + end_col] = direction
+                between_squares[square][end_row*8 + end_col] = tuple(ray[:i])
+    return square_line, between_squares
+
+SQUARE_LINE, BETWEEN_SQUARES = build_line_tables()
+KNIGHT_TARGETS = [frozenset(row*8 + col for row, col in KNIGHT_SQUARES[square // 8][square % 8]) for square in range(64)]
+KING_TARGETS = [frozenset(row*8 + col for row, col in KING_SQUARES[square // 8][square % 8]) for square in range(64)]
+
+#pieces of each colour, the keys of GameState.piece_squares
+COLOR_PIECES = {"w": ("wp", "wN", "wB", "wR", "wQ", "wK"), "b": ("bp", "bN", "bB", "bR", "bQ", "bK")}
+
+#halfmove clock at which the fifty-move rule draws
+FIFTY_MOVE_PLIES = 100
+
+#packed irreversible state (see GameState.pack_state)
+PIECE_CODES = ("--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+PIECE_INDEX = {piece: index for index, piece in enumerate(PIECE_CODES)}
+ENPASSANT_SHIFT = 4 #after the 4 castling bits
+CAPTURED_SHIFT = 11
+HALFMOVE_SHIFT = 15
+KEY_SHIFT = 31
 
 class GameState():
     def __init__(self):
         #initialize 8x8 chess board
         #2 characters, bK - black King
         #"--" represents empty slot
-        self.board = [
+        board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -17,216 +76,618 @@ class GameState():
             ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
         ]
-        self.white_to_move = True #white starts to move
-        self.move_log = []
         self.move_functions = {"p": self.get_pawn_moves, "R": self.get_rook_moves, "N": self.get_knight_moves,
                                 "B": self.get_bishop_moves, "Q": self.get_queen_moves, "K": self.get_king_moves}
+        self.move_cache = None #optional MoveCache, see enable_move_cache
+        self.load_position(board, True, castleRights.CastleRights(True, True, True, True)) #white starts to move
+
+    #set up the game from a position (start position, FEN, ...)
+    #subclasses extend this to rebuild anything derived from the board
+    def load_position(self, board, white_to_move, castling_rights, enpassant_possible=(), halfmove_clock=0, fullmove_number=1):
+        self.board = board
+        self.white_to_move = white_to_move
+        self.move_log = []
+
+        #half moves played before this position, for the fullmove number
+        self.start_ply = 2*(fullmove_number - 1) + (0 if white_to_move else 1)
 
         #for checking valid moves (check, checkmate) and castling moves
-        self.white_king_location = (7,4)
-        self.black_king_location = (0,4)
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == "wK":
+                    self.white_king_location = SQUARE_COORDS[row*8 + col]
+                elif board[row][col] == "bK":
+                    self.black_king_location = SQUARE_COORDS[row*8 + col]
+
+        #piece -> set of squares (row*8 + col) it stands on, kept in step with the board by make_move/undo_move
+        self.piece_squares = build_piece_squares(board)
+
+        #evaluation terms from white's point of view, updated incrementally (see evaluation)
+        self.middlegame_score, self.endgame_score, self.phase = evaluation.compute_terms(board)
 
         self.checkmate = False
         self.stalemate = False
+        #draws, set by get_valid_moves like checkmate/stalemate
+        self.threefold_repetition = False
+        self.fifty_move_rule = False
+        self.insufficient_material = False
 
         #en passant
-        self.enpassant_possible = () #coord where en passant is possible
+        self.enpassant_possible = enpassant_possible #coord where en passant is possible
+
+        #castling rights, 4 bits (see castleRights)
+        self.castling_bits = castling_rights.to_bits()
+
+        #moves since the last capture or pawn move
+        self.halfmove_clock = halfmove_clock
+
+        #position hash, updated incrementally by make_move/undo_move
+        self.zobrist_key = zobrist.compute_key(self)
+
+        #irreversible state before each move, parallel to move_log (see pack_state)
+        self.state_log = []
 
-        #castling rights
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castling_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                                self.current_castling_rights.wqs, self.current_castling_rights.bqs)] #to undo
+        #zobrist key -> times the position occurred in this game, kept in step by make_move/undo_move
+        #keys from before a capture, pawn move or castling rights change cant come back, so no scan is needed
+        self.position_counts = {self.zobrist_key: 1}
 
-    #executes a move, doesnt work on en passant, castling, pawn promotion
+    #move number as in FEN, starts at 1 and goes up after each black move
+    @property
+    def fullmove_number(self):
+        return (self.start_ply + len(self.move_log))//2 + 1
+
+    #castling rights in readable form, the game state keeps them in castling_bits
+    @property
+    def current_castling_rights(self):
+        return castleRights.from_bits(self.castling_bits)
+
+    @current_castling_rights.setter
+    def current_castling_rights(self, castling_rights):
+        self.castling_bits = castling_rights.to_bits()
+
+    #pack what undo_move cant recompute from the move into one int:
+    #castling bits | en passant square + 1 (0 if none) | captured piece | halfmove clock | zobrist key
+    def pack_state(self, move):
+        enpassant = self.enpassant_possible
+        return (self.castling_bits
+                | (enpassant[0]*8 + enpassant[1] + 1 if enpassant != () else 0) << ENPASSANT_SHIFT
+                | PIECE_INDEX[move.piece_captured] << CAPTURED_SHIFT
+                | self.halfmove_clock << HALFMOVE_SHIFT
+                | self.zobrist_key << KEY_SHIFT)
+
+    #executes a move, including en passant, castling and pawn promotion
     def make_move(self, move):
-        self.board[move.start_row][move.start_col] ="--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        self.state_log.append(self.pack_state(move)) #to undo later
+        old_castling = self.castling_bits
+        old_enpassant = self.enpassant_possible
+        board = self.board
+        start_row, start_col, end_row, end_col = move.start_row, move.start_col, move.end_row, move.end_col
+
+        board[start_row][start_col] = "--"
+        board[end_row][end_col] = move.piece_moved
         self.move_log.append(move) #to undo it later
 
         #update king's location (for checking valid moves)
         if move.piece_moved == "wK":
-            self.white_king_location = (move.end_row, move.end_col)
+            self.white_king_location = SQUARE_COORDS[end_row*8 + end_col]
         elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
+            self.black_king_location = SQUARE_COORDS[end_row*8 + end_col]
 
-        #pawn promotion make to queen
+        #pawn promotion, the engine only generates queen promotions
         if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
+            board[end_row][end_col] = move.piece_moved[0] + move.promotion_piece
 
         #en passant
         if move.is_enpassant_move:
-            self.board[move.start_row][move.end_col] = "--" #capturing pawn
+            board[start_row][end_col] = "--" #capturing pawn
 
         #update enpassant_possible var
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2: #only works on 2 square pawn adv
-            self.enpassant_possible = ((move.start_row + move.end_row)//2, move.start_col)
+        if move.piece_moved[1] == "p" and abs(start_row - end_row) == 2: #only works on 2 square pawn adv
+            self.enpassant_possible = SQUARE_COORDS[(start_row + end_row)//2*8 + start_col]
         else:
             self.enpassant_possible = () #reset back to "no" moves
 
         #castling
         if move.is_castle_move:
-            if move.end_col - move.start_col == 2: #this is a king side castle moves
-                self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col + 1] #moves rook
-                self.board[move.end_row][move.end_col+1] = "--" #removes old rook
+            if end_col - start_col == 2: #this is a king side castle moves
+                board[end_row][end_col-1] = board[end_row][end_col + 1] #moves rook
+                board[end_row][end_col+1] = "--" #removes old rook
 
             else: #this is a queen side castle move
-                self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col - 2] #moves rook
-                self.board[move.end_row][move.end_col-2] = "--"
+                board[end_row][end_col+1] = board[end_row][end_col - 2] #moves rook
+                board[end_row][end_col-2] = "--"
 
+        #halfmove clock restarts on captures and pawn moves
+        if move.piece_moved[1] == "p" or move.piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        self.update_piece_squares(move, False)
+        self.update_evaluation(move, 1)
 
         #update castling rights - when rook / king moves
         self.update_castling_rights(move)
-        self.castling_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                                self.current_castling_rights.wqs, self.current_castling_rights.bqs)) #to undo later
 
         self.white_to_move = not self.white_to_move #swap players
+        self.update_zobrist_key(move, old_castling, old_enpassant)
+        position_counts = self.position_counts
+        position_counts[self.zobrist_key] = position_counts.get(self.zobrist_key, 0) + 1
+
+    #XOR what the move changed into the zobrist key, called once the board is updated
+    def update_zobrist_key(self, move, old_castling, old_enpassant):
+        piece_keys = zobrist.PIECE_KEYS
+        key = self.zobrist_key ^ zobrist.BLACK_TO_MOVE_KEY
+        key ^= piece_keys[move.piece_moved][move.start_row*8 + move.start_col]
+        key ^= piece_keys[self.board[move.end_row][move.end_col]][move.end_row*8 + move.end_col] #promoted piece if promotion
+        if move.piece_captured != "--":
+            captured_row = move.start_row if move.is_enpassant_move else move.end_row
+            key ^= piece_keys[move.piece_captured][captured_row*8 + move.end_col]
 
+        if move.is_castle_move:
+            rook_keys = piece_keys[move.piece_moved[0] + "R"]
+            row_start = move.end_row*8
+            if move.end_col - move.start_col == 2: #king side
+                key ^= rook_keys[row_start + move.end_col + 1] ^ rook_keys[row_start + move.end_col - 1]
+            else: #queen side
+                key ^= rook_keys[row_start + move.end_col - 2] ^ rook_keys[row_start + move.end_col + 1]
+
+        if old_castling != self.castling_bits:
+            key ^= zobrist.CASTLING_KEYS[old_castling] ^ zobrist.CASTLING_KEYS[self.castling_bits]
+        if old_enpassant != ():
+            key ^= zobrist.ENPASSANT_KEYS[old_enpassant[1]]
+        if self.enpassant_possible != ():
+            key ^= zobrist.ENPASSANT_KEYS[self.enpassant_possible[1]]
+        self.zobrist_key = key
+
+    #move the pieces of a move in piece_squares, backwards when undoing
+    def update_piece_squares(self, move, undo):
+        piece_squares = self.piece_squares
+        start = move.start_row*8 + move.start_col
+        end = move.end_row*8 + move.end_col
+        end_piece = move.piece_moved[0] + move.promotion_piece if move.is_pawn_promotion else move.piece_moved
+        if undo:
+            piece_squares[end_piece].remove(end)
+            piece_squares[move.piece_moved].add(start)
+        else:
+            piece_squares[move.piece_moved].remove(start)
+            piece_squares[end_piece].add(end)
 
-    def update_castling_rights(self, move):
-        #check white king
-        if move.piece_moved == "wK":
-            self.current_castling_rights.wks = False
-            self.current_castling_rights.wqs = False
-        #check black king
-        elif move.piece_moved == "bK":
-            self.current_castling_rights.bks = False
-            self.current_castling_rights.bqs = False
-        #check rooks
-        elif move.piece_moved == "wR":
-            if move.start_row == 7:
-                if move.start_col == 0: #left rook
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7: #right rook
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == "bR":
-            if move.start_row == 0:
-                if move.start_col == 0: #left rook
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7: #right rook
-                    self.current_castling_rights.bks = False
-
-        #check if rook is taken
-        if move.piece_captured == "wR":
-            if move.end_row == 7:
-                if move.end_col == 0: #left rook
-                    self.current_castling_rights.wqs = False
-                elif move.end_col == 7: #right rook
-                    self.current_castling_rights.wks = False
-        elif move.piece_captured == "bR":
-            if move.end_col == 0:
-                if move.end_col == 0: #left rook
-                    self.current_castling_rights.bqs = False
-                elif move.end_col == 7: #right rook
-                    self.current_castling_rights.bks = False
+        if move.piece_captured != "--":
+            captured_square = move.start_row*8 + move.end_col if move.is_enpassant_move else end
+            if undo:
+                piece_squares[move.piece_captured].add(captured_square)
+            else:
+                piece_squares[move.piece_captured].remove(captured_square)
 
+        if move.is_castle_move:
+            rook_squares = piece_squares[move.piece_moved[0] + "R"]
+            if move.end_col - move.start_col == 2: #king side
+                rook_start, rook_end = end + 1, end - 1
+            else: #queen side
+                rook_start, rook_end = end - 2, end + 1
+            if undo:
+                rook_squares.remove(rook_end)
+                rook_squares.add(rook_start)
+            else:
+                rook_squares.remove(rook_start)
+                rook_squares.add(rook_end)
+
+    #add (sign 1) or take back (sign -1) the evaluation change of a move
+    def update_evaluation(self, move, sign):
+        middlegame_scores = evaluation.MIDDLEGAME_SCORES
+        endgame_scores = evaluation.ENDGAME_SCORES
+        start = move.start_row*8 + move.start_col
+        end = move.end_row*8 + move.end_col
+        piece = move.piece_moved
+        end_piece = piece[0] + move.promotion_piece if move.is_pawn_promotion else piece
+        captured = move.piece_captured
+        captured_square = move.start_row*8 + move.end_col if move.is_enpassant_move else end
+
+        middlegame = (middlegame_scores[end_piece][end] - middlegame_scores[piece][start]
+                      - middlegame_scores[captured][captured_square])
+        endgame = endgame_scores[end_piece][end] - endgame_scores[piece][start] - endgame_scores[captured][captured_square]
+        phase = evaluation.PHASES[end_piece] - evaluation.PHASES[piece] - evaluation.PHASES[captured]
+
+        if move.is_castle_move:
+            rook = piece[0] + "R"
+            if move.end_col - move.start_col == 2: #king side
+                rook_start, rook_end = end + 1, end - 1
+            else: #queen side
+                rook_start, rook_end = end - 2, end + 1
+            middlegame += middlegame_scores[rook][rook_end] - middlegame_scores[rook][rook_start]
+            endgame += endgame_scores[rook][rook_end] - endgame_scores[rook][rook_start]
+
+        self.middlegame_score += sign * middlegame
+        self.endgame_score += sign * endgame
+        self.phase += sign * phase
+
+    #a king or rook leaving its start square, or a rook captured on it, loses those rights
+    def update_castling_rights(self, move):
+        self.castling_bits &= (castleRights.CASTLING_MASK[move.start_row*8 + move.start_col]
+                               & castleRights.CASTLING_MASK[move.end_row*8 + move.end_col])
 
     #undo last move
     def undo_move(self):
         if len(self.move_log) != 0: #make sure theres a move to undo
             move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            state = self.state_log.pop()
+            board = self.board
+            start_row, start_col, end_row, end_col = move.start_row, move.start_col, move.end_row, move.end_col
+            captured = PIECE_CODES[(state >> CAPTURED_SHIFT) & 0xF]
+            board[start_row][start_col] = move.piece_moved
+            board[end_row][end_col] = captured
 
             #undo king's location (for checking valid moves)
             if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
+                self.white_king_location = SQUARE_COORDS[start_row*8 + start_col]
             elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+                self.black_king_location = SQUARE_COORDS[start_row*8 + start_col]
 
             #undo en passant move
             if move.is_enpassant_move:
-                self.board[move.end_row][move.end_col] = "--"
-                self.board[move.start_row][move.end_col] = move.piece_captured
-                self.enpassant_possible = (move.end_row, move.end_col) #make sure enpassant_possible is set back
-
-            #undo 2 square pawn advance
-            if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) ==2:
-                self.enpassant_possible = ()
-
-            #undo castling rights
-            self.castling_rights_log.pop() #remove last castling rights
-            new_rights = self.castling_rights_log[-1]
-            self.current_castling_rights = CastleRights(new_rights.wks, new_rights.bks, new_rights.wqs, new_rights.bqs) #set current_castling_rights to last castling rights
+                board[end_row][end_col] = "--"
+                board[start_row][end_col] = captured
 
             #undo castle moves
             if move.is_castle_move:
-                if move.end_col - move.start_col == 2: #kingside
-                    self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 1] #moves rook back
-                    self.board[move.end_row][move.end_col -1] = "--"
+                if end_col - start_col == 2: #kingside
+                    board[end_row][end_col + 1] = board[end_row][end_col - 1] #moves rook back
+                    board[end_row][end_col -1] = "--"
                 else: #queenside
-                    self.board[move.end_row][move.end_col -2] = self.board[move.end_row][move.end_col + 1] #moves rook back
-                    self.board[move.end_row][move.end_col +1] = "--"
+                    board[end_row][end_col -2] = board[end_row][end_col + 1] #moves rook back
+                    board[end_row][end_col +1] = "--"
+
+            self.update_piece_squares(move, True)
+            self.update_evaluation(move, -1)
 
+            position_counts = self.position_counts
+            count = position_counts[self.zobrist_key]
+            if count == 1:
+                del position_counts[self.zobrist_key]
+            else:
+                position_counts[self.zobrist_key] = count - 1
+
+            #restore the irreversible state saved by make_move
+            self.castling_bits = state & castleRights.ALL_CASTLING
+            enpassant = (state >> ENPASSANT_SHIFT) & 0x7F
+            self.enpassant_possible = SQUARE_COORDS[enpassant - 1] if enpassant else ()
+            self.halfmove_clock = (state >> HALFMOVE_SHIFT) & 0xFFFF
+            self.zobrist_key = state >> KEY_SHIFT
 
             self.white_to_move = not self.white_to_move
 
 
 
-    #All moves considering checks (valid moves)
+    #memoize get_valid_moves by position, pass a MoveCache to share it between game states of the same game
+    def enable_move_cache(self, move_cache=None):
+        self.move_cache = move_cache if move_cache is not None else MoveCache()
+        return self.move_cache
+
+    def disable_move_cache(self):
+        self.move_cache = None
+
+    #All moves considering checks (valid moves), from the move cache if one is enabled
+    #sets the checkmate/stalemate and draw flags
     def get_valid_moves(self):
-        #Debugging castling_rights_log
-        # for log in self.castling_rights_log:
-        #     print(log.wks, log.wqs, log.bks, log.bqs, end=", ")
-        # print()
-        temp_enpassant_possible = self.enpassant_possible #save value when generating all possible moves
-        temp_castling_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                            self.current_castling_rights.wqs, self.current_castling_rights.bqs)
-        #generate all possible moves
-        moves = self.get_all_possible_moves()
+        move_cache = self.move_cache
+        if move_cache is None:
+            moves = self.generate_valid_moves()
+        else:
+            entry = move_cache.get(self.zobrist_key)
+            if entry is not None:
+                cached_moves, self.checkmate, self.stalemate = entry
+                moves = list(cached_moves)
+            else:
+                moves = self.generate_valid_moves()
+                move_cache.put(self.zobrist_key, moves, self.checkmate, self.stalemate)
+        self.update_draw_flags() #depend on the game history, so they are not cached
+        return moves
 
+    #threefold repetition, fifty-move rule and insufficient material, checkmate on the last move still wins
+    def update_draw_flags(self):
+        self.threefold_repetition = self.position_counts[self.zobrist_key] >= 3
+        self.fifty_move_rule = self.halfmove_clock >= FIFTY_MOVE_PLIES and not self.checkmate
+        self.insufficient_material = self.has_insufficient_material()
+
+    #checkmate, stalemate and the draw flags, get_valid_moves sets them for the position it is called on
+    #code looking at child positions (search, SAN, book and tablebase probes) keeps the root flags with these two
+    def get_game_over_flags(self):
+        return self.checkmate, self.stalemate, self.threefold_repetition, self.fifty_move_rule, self.insufficient_material
+
+    def set_game_over_flags(self, flags):
+        self.checkmate, self.stalemate, self.threefold_repetition, self.fifty_move_rule, self.insufficient_material = flags
+
+    #True if the position occurred at least times times in this game, O(1)
+    def is_repetition(self, times=2):
+        return self.position_counts[self.zobrist_key] >= times
+
+    #True if the game is drawn by any rule
+    def is_draw(self):
+        return self.stalemate or self.threefold_repetition or self.fifty_move_rule or self.insufficient_material
+
+    #no side can mate: bare kings, a single minor piece, or only bishops all on squares of one colour
+    def has_insufficient_material(self):
+        if self.phase > 2: #more than two minor pieces or any queen
+            return False
+        piece_squares = self.piece_squares
+        for piece in ("wp", "bp", "wR", "bR", "wQ", "bQ"):
+            if piece_squares[piece]:
+                return False
+        knights = len(piece_squares["wN"]) + len(piece_squares["bN"])
+        bishops = piece_squares["wB"] | piece_squares["bB"]
+        if knights + len(bishops) <= 1:
+            return True
+        return knights == 0 and len({(square // 8 + square % 8) % 2 for square in bishops}) == 1
+
+    #generate the valid moves and set the checkmate/stalemate flags
+    def generate_valid_moves(self):
         if self.white_to_move:
-            self.get_castling_moves(self.white_king_location[0], self.white_king_location[1], moves)
+            king_row, king_col = self.white_king_location
         else:
-            self.get_castling_moves(self.black_king_location[0], self.black_king_location[1], moves)
-
-        #for each move, make that move
-        for idx in range(len(moves)-1,-1,-1): #backwards to reduce bugs
-            self.make_move(moves[idx])
-            self.white_to_move = not self.white_to_move #swap turns because self.make_move switch turns
-            #generate oponent's move
-            #for each opp moves, see if king is attacked
-            if self.in_check():
-                moves.remove(moves[idx])
-            self.white_to_move = not self.white_to_move
-            self.undo_move()
+            king_row, king_col = self.black_king_location
+
+        in_check, pins, checks = self.check_for_pins_and_checks()
 
-            #if king attacked, not a valid move, remove from moves
+        if len(checks) > 1: #double check, king has to move
+            moves = []
+            self.get_king_moves(king_row, king_col, moves)
+        else:
+            #generate all possible moves
+            moves = self.get_all_possible_moves()
+            if not in_check:
+                self.get_castling_moves(king_row, king_col, moves)
 
+        #filter out moves that leave the king attacked
+        moves = self.filter_legal_moves(moves, king_row, king_col, pins, checks)
 
         #check if checkmate/stalemate
         if len(moves) == 0:
-            if self.in_check():
+            if in_check:
                 self.checkmate = True
-                print("CHECKMATE")
             else:
                 self.stalemate = True
-                print("STALEMATE")
-        else: #undo move
+        else:
             self.checkmate = False
             self.stalemate = False
 
-        self.enpassant_possible = temp_enpassant_possible
-        self.current_castling_rights = temp_castling_rights
+        return moves
 
-        #Debugging
-        # for move in moves:
-        #     print(move.piece_moved, move.piece_captured, move.move_id)
+    #keep only the pseudo legal moves that respect pins and resolve checks
+    def filter_legal_moves(self, moves, king_row, king_col, pins, checks):
+        #squares a non king piece can move to in order to block/capture a single checker
+        check_squares = None
+        if checks:
+            check_row, check_col, dir_row, dir_col = checks[0]
+            check_squares = {(check_row, check_col)}
+            if self.board[check_row][check_col][1] != "N": #knight checks cannot be blocked
+                for end_row, end_col in RAYS[king_row][king_col][DIRECTIONS.index((dir_row, dir_col))]:
+                    if end_row == check_row and end_col == check_col:
+                        break
+                    check_squares.add((end_row, end_col))
+
+        #remove the king so it cant shelter behind itself when stepping along a checking ray
+        king_piece = self.board[king_row][king_col]
+        self.board[king_row][king_col] = "--"
+        legal_moves = []
+        enpassant_moves = []
+        for move in moves:
+            if move.piece_moved == king_piece:
+                if not self.square_under_attacked(move.end_row, move.end_col):
+                    legal_moves.append(move)
+                continue
+
+            pin_direction = pins.get((move.start_row, move.start_col))
+            if pin_direction is not None:
+                #pinned piece can only move along the pin line
+                if pin_direction[0] * (move.end_col - move.start_col) != pin_direction[1] * (move.end_row - move.start_row):
+                    continue
+
+            if check_squares is not None and (move.end_row, move.end_col) not in check_squares:
+                #en passant can also resolve a check by capturing the checking pawn
+                if not (move.is_enpassant_move and (move.start_row, move.end_col) in check_squares):
+                    continue
 
-        return moves
+            if move.is_enpassant_move:
+                enpassant_moves.append(move)
+            else:
+                legal_moves.append(move)
+        self.board[king_row][king_col] = king_piece
+
+        #en passant removes 2 pawns from the same rank, so test it by making the move (rare)
+        for move in enpassant_moves:
+            self.make_move(move)
+            self.white_to_move = not self.white_to_move #make_move switches turns, check the moving side
+            if not self.in_check():
+                legal_moves.append(move)
+            self.white_to_move = not self.white_to_move
+            self.undo_move()
+
+        return legal_moves
+
+    #find pinned allies and checking enemies from the enemy piece lists: a slider on a line with the king
+    #checks it with no piece between them and pins a lone allied piece between them
+    #pins: {(row, col): (dir_row, dir_col)}, checks: [(row, col, dir_row, dir_col)]
+    def check_for_pins_and_checks(self):
+        pins = {}
+        checks = []
+        if self.white_to_move:
+            ally_color, enemy_color = "w", "b"
+            king_row, king_col = self.white_king_location
+        else:
+            ally_color, enemy_color = "b", "w"
+            king_row, king_col = self.black_king_location
+        king_square = king_row*8 + king_col
+
+        board = self.board
+        piece_squares = self.piece_squares
+        square_line = SQUARE_LINE[king_square]
+        between_squares = BETWEEN_SQUARES[king_square]
+        for piece_type in ("R", "B", "Q"):
+            for square in piece_squares[enemy_color + piece_type]:
+                direction = square_line[square]
+                if direction < 0 or (piece_type == "R" and direction >= 4) or (piece_type == "B" and direction < 4):
+                    continue
+                blocker = None
+                for row, col in between_squares[square]:
+                    if board[row][col] != "--":
+                        if blocker is not None or board[row][col][0] != ally_color:
+                            break #2 pieces or an enemy piece in between, no pin or check
+                        blocker = (row, col)
+                else:
+                    if blocker is None:
+                        checks.append((*SQUARE_COORDS[square], *DIRECTIONS[direction]))
+                    else:
+                        pins[blocker] = DIRECTIONS[direction]
+
+        #pawns and knights next to the king
+        pawn_row = king_row - 1 if self.white_to_move else king_row + 1 #row of an enemy pawn attacking the king
+        enemy_pawn = enemy_color + "p"
+        if 0 <= pawn_row < 8:
+            for pawn_col in (king_col - 1, king_col + 1):
+                if 0 <= pawn_col < 8 and board[pawn_row][pawn_col] == enemy_pawn:
+                    checks.append((pawn_row, pawn_col, pawn_row - king_row, pawn_col - king_col))
+
+        knight_targets = KNIGHT_TARGETS[king_square]
+        for square in piece_squares[enemy_color + "N"]:
+            if square in knight_targets:
+                end_row, end_col = SQUARE_COORDS[square]
+                checks.append((end_row, end_col, end_row - king_row, end_col - king_col))
+
+        return len(checks) > 0, pins, checks
 
     #All moves that dont consider checks
     def get_all_possible_moves(self):
         possible_moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                turn = self.board[row][col][0] #checking whose turn it is
-                if (turn == "w" and self.white_to_move) or (turn == "b" and not self.white_to_move):
-                    piece = self.board[row][col][1]
-
-                    self.move_functions[piece](row, col, possible_moves) #call moves for all pieces
+        piece_squares = self.piece_squares
+        for piece in COLOR_PIECES["w" if self.white_to_move else "b"]: #only the squares of the side to move
+            move_function = self.move_functions[piece[1]]
+            for square in piece_squares[piece]:
+                row, col = SQUARE_COORDS[square]
+                move_function(row, col, possible_moves) #call moves for all pieces
 
         return possible_moves
 
+    #legal moves one stage at a time: priority moves (hash move, ...), captures by MVV-LVA, promotions,
+    #killer moves, then quiet moves sorted by quiet_order(move) if given
+    #a stage is only generated once the consumer has used up the one before, so a cutoff on an early move
+    #skips the rest; the board must be back in this position (moves undone) whenever the generator resumes
+    def generate_staged_moves(self, priority_move_ids=(), killers=(), quiet_order=None):
+        in_check, pins, checks = self.check_for_pins_and_checks()
+        king_row, king_col = self.white_king_location if self.white_to_move else self.black_king_location
+        king_only = len(checks) > 1 #double check, king has to move
+        yielded = set()
+
+        for move_id in priority_move_ids:
+            if move_id and move_id not in yielded:
+                move = self.find_legal_move(move_id, king_row, king_col, pins, checks, in_check)
+                if move is not None:
+                    yielded.add(move_id)
+                    yield move
+
+        captures = self.filter_legal_moves(self.get_stage_moves(CAPTURES, king_only), king_row, king_col, pins, checks)
+        captures.sort(key=mvv_lva_score, reverse=True)
+        for move in captures:
+            if move.move_id not in yielded:
+                yield move
+
+        if not king_only:
+            promotions = self.filter_legal_moves(self.get_stage_moves(PROMOTIONS, False), king_row, king_col, pins, checks)
+            for move in promotions:
+                if move.move_id not in yielded:
+                    yield move
+
+        for killer in killers:
+            if killer is not None and killer.move_id not in yielded and killer.piece_captured == "--":
+                move = self.find_legal_move(killer.move_id, king_row, king_col, pins, checks, in_check)
+                if move is not None and move.piece_captured == "--" and not move.is_pawn_promotion:
+                    yielded.add(move.move_id)
+                    yield move
+
+        quiets = self.get_stage_moves(QUIETS, king_only)
+        if not in_check:
+            self.get_castling_moves(king_row, king_col, quiets)
+        quiets = self.filter_legal_moves(quiets, king_row, king_col, pins, checks)
+        if quiet_order is not None:
+            quiets.sort(key=quiet_order, reverse=True)
+        for move in quiets:
+            if move.move_id not in yielded:
+                yield move
+
+    #legal captures (en passant and capture promotions included) sorted by MVV-LVA, for quiescence search
+    def generate_captures(self):
+        in_check, pins, checks = self.check_for_pins_and_checks()
+        king_row, king_col = self.white_king_location if self.white_to_move else self.black_king_location
+        captures = self.filter_legal_moves(self.get_stage_moves(CAPTURES, len(checks) > 1), king_row, king_col, pins, checks)
+        captures.sort(key=mvv_lva_score, reverse=True)
+        return captures
+
+    #the legal move with this move_id in the current position, None if there is none (ex: a stale hash move)
+    def find_legal_move(self, move_id, king_row, king_col, pins, checks, in_check):
+        start_row, start_col = SQUARE_COORDS[move_id & 63]
+        piece = self.board[start_row][start_col]
+        if piece[0] != ("w" if self.white_to_move else "b"):
+            return None
+        if len(checks) > 1 and piece[1] != "K":
+            return None
+        moves = []
+        self.move_functions[piece[1]](start_row, start_col, moves)
+        if piece[1] == "K" and not in_check:
+            self.get_castling_moves(start_row, start_col, moves)
+        moves = [move for move in moves if move.move_id == move_id]
+        if not moves:
+            return None
+        moves = self.filter_legal_moves(moves, king_row, king_col, pins, checks)
+        return moves[0] if moves else None
+
+    #pseudo legal moves of one stage (CAPTURES, PROMOTIONS or QUIETS), castling is left to the caller
+    def get_stage_moves(self, stage, king_only):
+        board = self.board
+        ally_color, enemy_color = ("w", "b") if self.white_to_move else ("b", "w")
+        moves = []
+        for piece in COLOR_PIECES[ally_color]:
+            piece_type = piece[1]
+            if (king_only and piece_type != "K") or (stage == PROMOTIONS and piece_type != "p"):
+                continue
+            for square in self.piece_squares[piece]:
+                row, col = SQUARE_COORDS[square]
+                if piece_type == "p":
+                    self.get_pawn_stage_moves(row, col, stage, enemy_color, moves)
+                elif piece_type == "N" or piece_type == "K":
+                    for end_row, end_col in (KNIGHT_SQUARES if piece_type == "N" else KING_SQUARES)[row][col]:
+                        end_piece = board[end_row][end_col]
+                        if (end_piece[0] == enemy_color) if stage == CAPTURES else (end_piece == "--"):
+                            moves.append(Move((row, col), (end_row, end_col), board))
+                else:
+                    rays = RAYS[row][col]
+                    for direction in SLIDER_DIRECTIONS[piece_type]:
+                        for end_row, end_col in rays[direction]:
+                            end_piece = board[end_row][end_col]
+                            if end_piece == "--":
+                                if stage == QUIETS:
+                                    moves.append(Move((row, col), (end_row, end_col), board))
+                                continue
+                            if end_piece[0] == enemy_color and stage == CAPTURES:
+                                moves.append(Move((row, col), (end_row, end_col), board))
+                            break
+        return moves
+
+    def get_pawn_stage_moves(self, row, col, stage, enemy_color, moves):
+        board = self.board
+        end_row = row - 1 if self.white_to_move else row + 1
+        promotion = end_row == 0 or end_row == 7
+        if stage == CAPTURES:
+            for end_col in (col - 1, col + 1):
+                if 0 <= end_col < 8:
+                    if board[end_row][end_col][0] == enemy_color:
+                        moves.append(Move((row, col), (end_row, end_col), board))
+                    elif (end_row, end_col) == self.enpassant_possible:
+                        moves.append(Move((row, col), (end_row, end_col), board, is_enpassant_move=True))
+        elif board[end_row][col] == "--" and promotion == (stage == PROMOTIONS):
+            moves.append(Move((row, col), (end_row, col), board))
+            if stage == QUIETS and row == (6 if self.white_to_move else 1) and board[2*end_row - row][col] == "--":
+                moves.append(Move((row, col), (2*end_row - row, col), board)) #2 square pawn move
+
     #Pieces moves
     def get_pawn_moves(self, row, col, moves):
         if self.white_to_move: #white
@@ -346,10 +807,10 @@ class GameState():
         if self.square_under_attacked(row, col):
             return #cant castle if in check
         #king side
-        if (self.white_to_move and self.current_castling_rights.wks) or (not self.white_to_move and self.current_castling_rights.bks):
+        if self.castling_bits & (castleRights.WHITE_KING_SIDE if self.white_to_move else castleRights.BLACK_KING_SIDE):
             self.get_kingside_castling_moves(row, col, moves)
         #queen side
-        if (self.white_to_move and self.current_castling_rights.wqs) or (not self.white_to_move and self.current_castling_rights.bqs):
+        if self.castling_bits & (castleRights.WHITE_QUEEN_SIDE if self.white_to_move else castleRights.BLACK_QUEEN_SIDE):
             self.get_queenside_castling_moves(row, col, moves)
 
 
@@ -375,13 +836,61 @@ class GameState():
             return self.square_under_attacked(self.black_king_location[0], self.black_king_location[1])
 
     #determine if the enemy can attack the square (row, col)
+    #only the enemy pieces are tested, from the piece lists, instead of scanning every line from the square
     def square_under_attacked(self, row, col):
-        self.white_to_move = not self.white_to_move #switch to opponent
-        opp_moves = self.get_all_possible_moves()
-        for move in opp_moves:
-            if move.end_row == row and move.end_col == col:
-                self.white_to_move = not self.white_to_move #switch back
-                return True #square is under attack
-
-        self.white_to_move = not self.white_to_move
+        board = self.board
+        piece_squares = self.piece_squares
+        enemy_color = "b" if self.white_to_move else "w"
+        square = row*8 + col
+
+        pawn_row = row - 1 if self.white_to_move else row + 1 #row of an enemy pawn attacking the square
+        if 0 <= pawn_row < 8:
+            enemy_pawn = enemy_color + "p"
+            if (col > 0 and board[pawn_row][col - 1] == enemy_pawn) or (col < 7 and board[pawn_row][col + 1] == enemy_pawn):
+                return True
+
+        if not piece_squares[enemy_color + "K"].isdisjoint(KING_TARGETS[square]):
+            return True
+        if not piece_squares[enemy_color + "N"].isdisjoint(KNIGHT_TARGETS[square]):
+            return True
+
+        square_line = SQUARE_LINE[square]
+        between_squares = BETWEEN_SQUARES[square]
+        for piece_type in ("Q", "R", "B"):
+            for attacker in piece_squares[enemy_color + piece_type]:
+                direction = square_line[attacker]
+                if direction < 0 or (piece_type == "R" and direction >= 4) or (piece_type == "B" and direction < 4):
+                    continue
+                for between_row, between_col in between_squares[attacker]:
+                    if board[between_row][between_col] != "--":
+                        break
+                else:
+                    return True
+
         return False
+
+
+#piece -> set of squares (row*8 + col) it stands on
+def build_piece_squares(board):
+    piece_squares = {piece: set() for piece in PIECE_CODES[1:]}
+    for row in range(8):
+        for col in range(8):
+            if board[row][col] != "--":
+                piece_squares[board[row][col]].add(row*8 + col)
+    return piece_squares
+
+
+#capture ordering, most valuable victim first, then least valuable attacker
+def mvv_lva_score(move):
+    return MVV_LVA_VALUES[move.piece_captured[1]] * 10 - MVV_LVA_VALUES[move.piece_moved[1]]
+
+
+#choose the position backend: "mailbox" (list of lists of strings) or "bitboard" (64 bit integers)
+#both backends share the make_move/undo_move/get_valid_moves API
+def create_game_state(backend="mailbox"):
+    if backend == "bitboard":
+        from bitboardState import BitboardGameState
+        return BitboardGameState()
+    elif backend == "mailbox":
+        return GameState()
+    raise ValueError("Unknown backend: " + backend)
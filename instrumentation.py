@@ -0,0 +1,277 @@
+#Opt-in instrumentation of the engine hot paths and the main loop
+#enable() wraps the functions in ENGINE_FUNCTIONS (and any others given) with counting wrappers and disable()
+#puts the originals back, so until it is enabled nothing is wrapped and nothing costs anything
+#per function: calls, cumulative time, latency percentiles from a sample of the calls, and the Move objects
+#created during a call (nested calls included); frame times come from the main loop through record_frame
+#
+#usage: python instrumentation.py                        replay a scripted game and print the stats
+#       python instrumentation.py --pgn games.pgn        replay the games of a PGN file instead
+#       python instrumentation.py --profile replay.prof  replay under cProfile, dumped for pstats / snakeviz
+import argparse
+import cProfile
+import functools
+import importlib
+import pstats
+import random
+import time
+
+import notation
+import pgn
+from move import Move
+from search import Searcher
+
+SAMPLE_SIZE = 10000 #latencies kept per function for the percentiles
+PERCENTILES = (50, 90, 99)
+LOG_SECONDS = 5.0 #interval of the periodic log line
+PANEL_SECONDS = 0.5 #interval between updates of the on-screen panel
+PANEL_FUNCTIONS = 5 #functions shown on the panel
+#(module, class, method) wrapped by enable(), a method is only wrapped in the class that defines it
+ENGINE_FUNCTIONS = (
+    ("gameState", "GameState", "get_valid_moves"),
+    ("gameState", "GameState", "generate_valid_moves"),
+    ("gameState", "GameState", "generate_captures"),
+    ("gameState", "GameState", "square_under_attacked"),
+    ("gameState", "GameState", "make_move"),
+    ("gameState", "GameState", "undo_move"),
+    ("bitboardState", "BitboardGameState", "generate_valid_moves"),
+    ("bitboardState", "BitboardGameState", "generate_captures"),
+    ("bitboardState", "BitboardGameState", "square_under_attacked"),
+    ("bitboardState", "BitboardGameState", "make_move"),
+    ("bitboardState", "BitboardGameState", "undo_move"),
+)
+RENDER_FUNCTIONS = (
+    ("renderer", "BoardRenderer", "draw"),
+    ("renderer", "BoardRenderer", "draw_animation_frame"),
+)
+#a scripted game for the replay (Morphy - Duke of Brunswick and Count Isouard, Paris 1858)
+SCRIPTED_GAME = ("e4 e5 Nf3 d6 d4 Bg4 dxe5 Bxf3 Qxf3 dxe5 Bc4 Nf6 Qb3 Qe7 Nc3 c6 Bg5 b5 Nxb5 cxb5 Bxb5+ Nbd7 "
+                 "O-O-O Rd8 Rxd7 Rxd7 Rd1 Qe6 Bxd7+ Nxd7 Qb8+ Nxb8 Rd8#").split()
+
+
+#count, total and a random sample of durations (reservoir sampling) for percentiles without keeping every call
+class Timings():
+    def __init__(self, rng):
+        self.rng = rng
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.samples = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        if len(self.samples) < SAMPLE_SIZE:
+            self.samples.append(seconds)
+        else:
+            slot = self.rng.randrange(self.count)
+            if slot < SAMPLE_SIZE:
+                self.samples[slot] = seconds
+
+    #percentile -> seconds
+    def percentiles(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {percentile: 0.0 for percentile in PERCENTILES}
+        return {percentile: samples[min(len(samples) - 1, len(samples) * percentile // 100)] for percentile in PERCENTILES}
+
+
+class Instrumentation():
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.originals = [] #(owner, name, original function) of the wrapped functions
+        self.moves_created = 0
+        self.functions = {} #"Class.method" -> [Timings, moves created]
+        self.reset()
+
+    #start counting again, the wrapped functions stay wrapped
+    def reset(self):
+        for entry in self.functions.values():
+            entry[:] = [Timings(self.rng), 0]
+        self.frames = Timings(self.rng)
+        self.started = time.perf_counter()
+        self.last_log = self.started
+        self.panel = None #lines of the on-screen panel
+        self.last_panel = self.started
+
+    def is_enabled(self):
+        return len(self.originals) != 0
+
+    #wrap the functions, functions: (module, class, method) names, modules are imported on demand
+    def enable(self, functions=ENGINE_FUNCTIONS):
+        for module_name, class_name, method_name in functions:
+            owner = getattr(importlib.import_module(module_name), class_name)
+            original = owner.__dict__[method_name]
+            self.originals.append((owner, method_name, original))
+            setattr(owner, method_name, self.wrap(class_name + "." + method_name, original))
+        if not any(owner is Move for owner, _, _ in self.originals):
+            self.originals.append((Move, "__init__", Move.__init__))
+            Move.__init__ = self.wrap_move_init(Move.__init__)
+
+    def disable(self):
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+    def wrap(self, name, function):
+        entry = self.functions.setdefault(name, [Timings(self.rng), 0])
+        perf_counter = time.perf_counter
+        instrumentation = self
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            moves_before = instrumentation.moves_created
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                entry[0].add(perf_counter() - start)
+                entry[1] += instrumentation.moves_created - moves_before
+        return wrapper
+
+    def wrap_move_init(self, init):
+        instrumentation = self
+
+        @functools.wraps(init)
+        def counting_init(move, *args, **kwargs):
+            instrumentation.moves_created += 1
+            init(move, *args, **kwargs)
+        return counting_init
+
+    #time of one main loop frame, without the wait for the next frame
+    def record_frame(self, seconds):
+        self.frames.add(seconds)
+
+    #{"functions": {name: {...}}, "frames": {...}}, times in microseconds (frames in milliseconds)
+    def stats(self):
+        functions = {}
+        for name, (timings, moves) in self.functions.items():
+            if timings.count == 0:
+                continue
+            entry = {"calls": timings.count, "total_ms": timings.total * 1e3, "mean_us": timings.total / timings.count * 1e6,
+                     "max_us": timings.maximum * 1e6, "moves_per_call": moves / timings.count}
+            for percentile, seconds in timings.percentiles().items():
+                entry["p%d_us" % percentile] = seconds * 1e6
+            functions[name] = entry
+        frames = {"frames": self.frames.count, "fps": self.frames.count / max(time.perf_counter() - self.started, 1e-9),
+                  "mean_ms": self.frames.total / self.frames.count * 1e3 if self.frames.count else 0.0,
+                  "max_ms": self.frames.maximum * 1e3}
+        for percentile, seconds in self.frames.percentiles().items():
+            frames["p%d_ms" % percentile] = seconds * 1e3
+        return {"functions": functions, "frames": frames}
+
+    #one line per function and one for the frames
+    def summary_lines(self, stats=None):
+        stats = stats or self.stats()
+        lines = []
+        for name, entry in sorted(stats["functions"].items(), key=lambda item: -item[1]["total_ms"]):
+            lines.append("%-38s %8d calls %9.1f ms  p50 %7.1f  p99 %8.1f us  %5.1f moves/call" % (
+                name, entry["calls"], entry["total_ms"], entry["p50_us"], entry["p99_us"], entry["moves_per_call"]))
+        frames = stats["frames"]
+        if frames["frames"]:
+            lines.append("frames %d  %.1f fps  mean %.2f ms  p99 %.2f ms  max %.2f ms" % (
+                frames["frames"], frames["fps"], frames["mean_ms"], frames["p99_ms"], frames["max_ms"]))
+        return lines
+
+    #print a summary line at most every interval seconds, call it every frame; returns True if it printed
+    #extra: more stats dicts (ex: from the engine process) merged into the line
+    def log_periodically(self, interval=LOG_SECONDS, extra=None):
+        now = time.perf_counter()
+        if now - self.last_log < interval:
+            return False
+        self.last_log = now
+        print("[stats] " + log_line(self.stats(), extra))
+        return True
+
+
+    #short lines for the on-screen panel (see BoardRenderer.draw), made again at most every interval seconds
+    def panel_lines(self, interval=PANEL_SECONDS, extra=None):
+        now = time.perf_counter()
+        if self.panel is not None and now - self.last_panel < interval:
+            return self.panel
+        self.last_panel = now
+        stats = self.stats()
+        entries = dict(stats["functions"])
+        if extra is not None:
+            entries.update(extra["functions"])
+        frames = stats["frames"]
+        lines = ["%.1f fps  frame p50 %.1f  p99 %.1f ms" % (frames["fps"], frames["p50_ms"], frames["p99_ms"])]
+        for name, entry in sorted(entries.items(), key=lambda item: -item[1]["total_ms"])[:PANEL_FUNCTIONS]:
+            lines.append("%s %d x %.0f us  p99 %.0f" % (name.split(".")[-1], entry["calls"], entry["mean_us"], entry["p99_us"]))
+        self.panel = tuple(lines)
+        return self.panel
+
+
+#compact one line summary: frames and the most expensive functions
+def log_line(stats, extra=None, functions=4):
+    entries = dict(stats["functions"])
+    if extra is not None:
+        entries.update(extra["functions"])
+    frames = stats["frames"]
+    parts = ["%.1f fps p99 %.1f ms" % (frames["fps"], frames["p99_ms"])] if frames["frames"] else []
+    for name, entry in sorted(entries.items(), key=lambda item: -item[1]["total_ms"])[:functions]:
+        parts.append("%s %d x %.0f us" % (name.split(".")[-1], entry["calls"], entry["mean_us"]))
+    return "  ".join(parts)
+
+
+#play games move by move the way the UI and the engine do: legal moves, a shallow search, then the move
+#games: lists of SAN moves from the start position
+def replay(games, search_depth=2, backend="mailbox"):
+    searcher = Searcher()
+    plies = 0
+    for moves in games:
+        game_state = notation.parse_fen(notation.START_FEN, backend)
+        for san in moves:
+            game_state.get_valid_moves()
+            if search_depth:
+                searcher.search(game_state, None, search_depth)
+            game_state.make_move(notation.parse_san(game_state, san))
+            plies += 1
+        game_state.get_valid_moves()
+        while game_state.move_log: #take the game back as the undo key does
+            game_state.undo_move()
+    return plies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a scripted game with instrumentation or under cProfile")
+    parser.add_argument("--pgn", help="replay the games of this PGN file instead of the scripted game")
+    parser.add_argument("--games", type=int, default=10, help="games to read from --pgn")
+    parser.add_argument("--depth", type=int, default=2, help="search depth at every ply, 0 for no search")
+    parser.add_argument("--backend", choices=("mailbox", "bitboard"), default="mailbox")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and dump the profile to FILE (.prof)")
+    args = parser.parse_args()
+
+    games = [SCRIPTED_GAME]
+    if args.pgn:
+        games = [game.moves for _, game in zip(range(args.games), pgn.read_games(args.pgn))]
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        plies = replay(games, args.depth, args.backend)
+        profiler.disable()
+        print("%d plies in %.2fs" % (plies, time.perf_counter() - start))
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+        print("profile written to " + args.profile)
+        return
+
+    start = time.perf_counter()
+    replay(games, args.depth, args.backend)
+    plain = time.perf_counter() - start
+    instrumentation = Instrumentation()
+    instrumentation.enable()
+    start = time.perf_counter()
+    plies = replay(games, args.depth, args.backend)
+    instrumented = time.perf_counter() - start
+    instrumentation.disable()
+    for line in instrumentation.summary_lines():
+        print(line)
+    print("%d plies  %.2fs plain  %.2fs instrumented" % (plies, plain, instrumented))
+
+
+if __name__ == "__main__":
+    main()
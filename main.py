@@ -1,140 +1,97 @@
 #main driver file, handling user input and displaying current game state
 
+import time
+
+STARTED = time.perf_counter() #before pygame is imported, for the time to first frame
 import pygame as p
+import assets
 import gameState
+import engineWorker
+from renderer import BoardRenderer
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8 #8x8
 SQUARE_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15 #for animations
+MAX_FPS = 15 #frames checked per second when idle, only changed squares are drawn
 IMAGES = {}
+BACKEND = "mailbox" #position backend, "mailbox" or "bitboard"
+ANIMATION_FPS = 60
+#True if a human is playing that side, False if the engine plays it
+PLAYER_ONE = True #white
+PLAYER_TWO = True #black
+ENGINE_TIME_MS = 1000 #engine thinking time per move
+BOOK_PATH = None #opening book the engine plays from, ex: "book.bin" built with openingBook.py, None for no book
+#measure the engine and drawing functions and the frame times, logged every few seconds (see instrumentation)
+INSTRUMENT = False
+SHOW_STATS = True #with INSTRUMENT, show the stats in a panel over the board
+
+MOVE_SOUND = "./Sound Effects/move.mp3"
+CAPTURE_SOUND = "./Sound Effects/capture.mp3"
 
 #loading images is very slow, so initialize a global dictionary once in the main
+#the images come scaled to SQUARE_SIZE from the atlas cache (see assets)
 def load_images():
-    pieces = ["wp", "wR", "wN", "wB", "wK", "wQ", "bp", "bR", "bN", "bB", "bK", "bQ"]
-    for piece in pieces:
-        #scale the images, then load it into dictionary
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQUARE_SIZE, SQUARE_SIZE))
-
-#Graphics on a game state
-def draw_game_state(screen, game_state, valid_moves, square_selected):
-    draw_board(screen) #draw squares on board
-    highlight_squares(screen, game_state, valid_moves, square_selected)
-    draw_pieces(screen, game_state.board) #draw pieces (after drawing board to make it on top)
-
-
-#draw the squares on the board (top left square is always light)
-#light squares = even, dark square = odd
-def draw_board(screen):
-    global colors
-    colors = [p.Color((188,210,232)), p.Color((115, 165, 198))]
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            color = colors[((row+col)%2)]
-            #draw column by row
-            p.draw.rect(screen, color, p.Rect(col*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-
-#draw pieces
-def draw_pieces(screen, board):
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            piece = board[row][col]
-            if piece != "--": #not empty
-                screen.blit(IMAGES[piece], p.Rect(col*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-
-#graphics
-#higlights squares selected and valid moves from the square
-def highlight_squares(screen, game_state, valid_moves, square_selected):
-    if square_selected != ():
-        row, col = square_selected
-        if game_state.board[row][col][0] == ("w" if game_state.white_to_move else "b"): #make sure the square selected is the same color as the current player
-            #highlight selected square
-            surface = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            surface.set_alpha(100) #transparency value, 0 : transparent, 255: opaque
-            surface.fill(p.Color("orange"))
-            screen.blit(surface, (col*SQUARE_SIZE, row*SQUARE_SIZE))
-
-            #highlight moves from that square
-            surface.fill(p.Color("yellow"))
-            for move in valid_moves:
-                if move.start_row == row and move.start_col == col:
-                    screen.blit(surface, (move.end_col*SQUARE_SIZE, move.end_row*SQUARE_SIZE))
-
-    #highlight last move
-    if game_state.move_log != []:
-        last_move = game_state.move_log[-1]
-        surface = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-        surface.set_alpha(100)
-        surface.fill(p.Color("orange"))
-        screen.blit(surface, (last_move.end_col*SQUARE_SIZE, last_move.end_row*SQUARE_SIZE))
-        screen.blit(surface, (last_move.start_col*SQUARE_SIZE, last_move.start_row*SQUARE_SIZE))
-
-
-#animating moves
-def animate_moves(screen, board, move, clock):
-    global colors
-    delta_row = move.end_row - move.start_row
-    delta_col = move.end_col - move.start_col
-    frames_per_sqaure = 5 #no of frames for 1 square of animation, higher -> slower animation, lower -> faster animation
-    frame_count = (abs(delta_row) + abs(delta_col)) * frames_per_sqaure
-    for frame in range(frame_count + 1):
-        row, col = (move.start_row + delta_row * frame/frame_count, move.start_col + delta_col * frame/frame_count)
-        draw_board(screen)
-        draw_pieces(screen, board)
-
-        #erase piece moved from its ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = p.Rect(move.end_col*SQUARE_SIZE, move.end_row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        p.draw.rect(screen, color, end_square)
-
-        #draw captured piece onto rectangle
-        if move.piece_captured != "--":
-            screen.blit(IMAGES[move.piece_captured], end_square)
-
-        #draw moving piece
-        screen.blit(IMAGES[move.piece_moved], p.Rect(col*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        p.display.flip()
-        clock.tick(60)
-
-def draw_text(screen, text):
-    #create pygame font obj, parameters: font type, size, bold, italic
-    font = p.font.SysFont("Helvitca", 38, True, False)
-    #parameters: text, antialias, color, background = True
-    text_object = font.render(text, 0, p.Color("Gray"))
-    text_location = p.Rect(0,0, WIDTH, HEIGHT).move(WIDTH/2 - text_object.get_width()/2, HEIGHT/2 - text_object.get_height()/2) #center text
-    screen.blit(text_object, text_location)
-    text_object = font.render(text, 0, p.Color("Black"))
-    screen.blit(text_object, text_location.move(2,2))
+    IMAGES.update(assets.load_piece_images(SQUARE_SIZE))
+
+#animating moves, one frame per call so the main loop keeps handling events
+#no of frames for 1 square of animation, higher -> slower animation, lower -> faster animation
+FRAMES_PER_SQUARE = 5
+
+def animation_frame_count(move):
+    return (abs(move.end_row - move.start_row) + abs(move.end_col - move.start_col)) * FRAMES_PER_SQUARE
+
+#True if a human plays the side to move, False if the engine does
+def is_human_turn(game_state):
+    return (game_state.white_to_move and PLAYER_ONE) or (not game_state.white_to_move and PLAYER_TWO)
 
 #main driver
 def main():
+    engine = engineWorker.EngineWorker(BOOK_PATH, INSTRUMENT) #start before pygame so the engine process doesnt inherit the window
+    instrumentation = None
+    if INSTRUMENT:
+        from instrumentation import Instrumentation, ENGINE_FUNCTIONS, RENDER_FUNCTIONS
+        instrumentation = Instrumentation()
+        instrumentation.enable(ENGINE_FUNCTIONS + RENDER_FUNCTIONS)
+    panel = None
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT)) #screen
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    game_state = gameState.GameState()
+    game_state = gameState.create_game_state(BACKEND)
     load_images()
+    renderer = BoardRenderer(screen, IMAGES, SQUARE_SIZE)
     running = True
     square_selected = () #initalize that no square is selected. Shld be tuple (row,col)
     player_clicks = [] #keep track on the player clicks. Shld be two tuples: [(6,1),(4,1)] <- moving pawn [(initial_row, initial_col), (final_row, final_col)]
 
-
-    valid_moves = game_state.get_valid_moves()
+    #legal moves are generated by the engine process, no moves can be made until they arrive
+    valid_moves = []
+    engine.request_valid_moves(game_state)
     move_made = False #flag variable for when a move is made
     animate = False #flag variable for animating a move (undo doesnt animate the move)
+    animation = None #[move, frame, frame_count] while a move is being animated
     game_over = False #flag variable for when
 
-    #sound effects
-    move_sound = p.mixer.Sound("./Sound Effects/move.mp3")
-    capture_sound = p.mixer.Sound("./Sound Effects/capture.mp3")
+    #sound effects, decoded when first played
+    move_sound = assets.LazySound(MOVE_SOUND)
+    capture_sound = assets.LazySound(CAPTURE_SOUND)
+    first_frame = True
 
     while running:
+        if instrumentation is not None:
+            frame_start = time.perf_counter()
+            instrumentation.log_periodically(extra=engine.engine_stats())
+            if SHOW_STATS:
+                panel = instrumentation.panel_lines(extra=engine.engine_stats())
+        human_turn = is_human_turn(game_state)
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED): #window contents were lost, draw everything again
+                renderer.invalidate()
             #mouse handler
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not game_over:
+                if not game_over and human_turn and animation is None:
                     location = p.mouse.get_pos() #returns (x,y) location of mouse
                     col = location[0] // SQUARE_SIZE #column of square picked
                     row = location[1] // SQUARE_SIZE #row of square picked
@@ -167,45 +124,110 @@ def main():
             #key handlers
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: #undo when z is pressed
+                    engine.cancel() #drop any pending search
                     game_state.undo_move()
+                    if not is_human_turn(game_state) and (PLAYER_ONE or PLAYER_TWO):
+                        game_state.undo_move() #take back the engine's reply as well
+                    game_state.checkmate = False #until the engine sends the new flags
+                    game_state.stalemate = False
+                    game_state.update_draw_flags()
                     print("Move undoed")
+                    square_selected = ()
+                    player_clicks = []
                     move_made = False
                     animate = False
+                    animation = None
                     game_over = False
-                    valid_moves = game_state.get_valid_moves()
+                    valid_moves = []
+                    engine.request_valid_moves(game_state)
 
                 elif e.key == p.K_r: #reset the board when r is pressed
-                    game_state = gameState.GameState()
-                    valid_moves = game_state.get_valid_moves()
+                    engine.cancel() #drop any pending search
+                    game_state = gameState.create_game_state(BACKEND)
+                    valid_moves = []
+                    engine.request_valid_moves(game_state)
                     square_selected = ()
                     player_clicks = []
                     move_made = False
                     animate = False
+                    animation = None
                     game_over = False
                     print("Game restarted.")
 
         if move_made:
             if animate:
-                animate_moves(screen, game_state.board, game_state.move_log[-1], clock)
-            valid_moves = game_state.get_valid_moves()
+                move = game_state.move_log[-1]
+                animation = [move, 0, animation_frame_count(move)]
+            valid_moves = []
+            engine.request_valid_moves(game_state)
             move_made = False
             animate = False
 
-        draw_game_state(screen, game_state, valid_moves, square_selected)
-
+        #engine answers are applied once the current animation is done
+        response = engine.poll() if animation is None else None
+        if response is not None:
+            kind, payload = response
+            if kind == engineWorker.VALID_MOVES:
+                valid_moves, game_state.checkmate, game_state.stalemate = payload
+                game_state.update_draw_flags() #they depend on the moves played, which only this process knows
+                if not is_human_turn(game_state) and len(valid_moves) != 0 and not game_state.is_draw():
+                    engine.request_search(game_state, ENGINE_TIME_MS)
+            elif kind == engineWorker.SEARCH and payload is not None:
+                for move in valid_moves:
+                    if move == payload.best_move:
+                        game_state.make_move(move)
+                        if move.piece_captured == "--":
+                            move_sound.play()
+                        else:
+                            capture_sound.play()
+                        move_made = True
+                        animate = True
+                        break
+
+        if animation is not None:
+            move, frame, frame_count = animation
+            renderer.draw_animation_frame(game_state.board, move, frame, frame_count, panel)
+            animation[1] += 1
+            if animation[1] > frame_count:
+                animation = None
+            if instrumentation is not None:
+                instrumentation.record_frame(time.perf_counter() - frame_start)
+            clock.tick(ANIMATION_FPS)
+            continue
+
+        text = None
         if game_state.checkmate:
             game_over = True
             if game_state.white_to_move: #black wins
-                draw_text(screen, "Black wins by checkmate")
+                text = "Black wins by checkmate"
             else:
-                draw_text(screen, "White wins by checkmate")
+                text = "White wins by checkmate"
         elif game_state.stalemate:
             game_over = True
-            draw_text(screen, "Stalemate")
+            text = "Stalemate"
+        elif game_state.threefold_repetition:
+            game_over = True
+            text = "Draw by threefold repetition"
+        elif game_state.fifty_move_rule:
+            game_over = True
+            text = "Draw by fifty-move rule"
+        elif game_state.insufficient_material:
+            game_over = True
+            text = "Draw by insufficient material"
+        #only the squares that changed are drawn and updated on the display
+        renderer.draw(game_state, valid_moves, square_selected, text, panel)
+        if instrumentation is not None:
+            instrumentation.record_frame(time.perf_counter() - frame_start)
+            if first_frame:
+                print("first frame after %.0f ms" % ((time.perf_counter() - STARTED) * 1000))
+        first_frame = False
         #update clock
         clock.tick(MAX_FPS)
-        #update screen display
-        p.display.flip()
+
+    engine.close()
+    if instrumentation is not None:
+        for line in instrumentation.summary_lines():
+            print(line)
 
 if __name__ == "__main__":
     main()
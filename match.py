@@ -0,0 +1,284 @@
+#Self-play matches: two engine settings play each other from a list of opening positions, every opening
+#twice with the colours swapped, the games running concurrently on a process pool
+#games end by checkmate, stalemate, threefold repetition, the fifty-move rule or insufficient material
+#(the GameState flags), or as a draw at the ply limit; they are written as PGN and summed up as an Elo
+#difference with its error margin, an SPRT test and the nodes per second and games per hour of the match
+#
+#usage: python match.py --games 100 --engine1 depth=3 --engine2 depth=2
+#       python match.py --openings openings.txt --engine1 movetime=100 --engine2 movetime=100,staged=0 --pgn games.pgn
+#       python match.py --engine1 depth=3 --engine2 depth=3,hash=1 --sprt -5 5     stop when the SPRT decides
+#engine settings: depth, movetime (ms), hash (MB), staged (0 or 1), book (file), tablebase (directory), name
+import argparse
+import concurrent.futures
+import math
+import os
+import time
+
+import batch
+import notation
+from openingBook import OpeningBook
+from search import Searcher, MAX_PLY
+from tablebase import Tablebase
+from transpositionTable import TranspositionTable
+
+DEFAULT_MAX_PLIES = 300 #games still going are adjudicated as draws
+DEFAULT_ENGINE = {"depth": None, "movetime": None, "hash": 16, "staged": 1, "book": None, "tablebase": None, "name": None}
+#balanced openings played when no openings file is given, as SAN from the start position
+DEFAULT_OPENINGS = ("e4 e5 Nf3 Nc6", "e4 c5 Nf3 d6", "e4 e6 d4 d5", "e4 c6 d4 d5", "d4 d5 c4 e6", "d4 Nf6 c4 g6",
+                    "d4 Nf6 c4 e6", "c4 e5 Nc3 Nf6", "Nf3 d5 g3 Nf6", "e4 e5 Nf3 Nf6")
+SPRT_ALPHA = 0.05 #chance of accepting elo1 when elo0 is true
+SPRT_BETA = 0.05 #chance of accepting elo0 when elo1 is true
+PROGRESS_GAMES = 10 #print the standing every this many games
+
+_engines = None #(settings, searcher, table) per engine, one set per worker process, made by init_worker
+
+
+#engine settings from "key=value,key=value", ex: "depth=3,hash=8"
+def parse_engine(text, index):
+    settings = dict(DEFAULT_ENGINE)
+    for item in filter(None, (text or "").split(",")):
+        key, separator, value = item.partition("=")
+        if not separator or key not in settings:
+            raise ValueError("unknown engine setting: " + item)
+        settings[key] = value if key in ("book", "tablebase", "name") else int(value)
+    if settings["depth"] is None and settings["movetime"] is None:
+        settings["depth"] = 3
+    if settings["name"] is None:
+        settings["name"] = "engine%d %s" % (index, " ".join("%s=%s" % (key, settings[key]) for key in ("depth", "movetime")
+                                                            if settings[key] is not None))
+    return settings
+
+
+def init_worker(engine_settings):
+    global _engines
+    _engines = []
+    for settings in engine_settings:
+        opening_book = OpeningBook(settings["book"]) if settings["book"] else None
+        tablebase = Tablebase(settings["tablebase"]) if settings["tablebase"] else None
+        table = TranspositionTable(settings["hash"])
+        _engines.append((settings, Searcher(table, bool(settings["staged"]), opening_book, tablebase), table))
+
+
+#result and reason of a finished game, None while it goes on
+def adjudicate(game_state, plies, max_plies):
+    if game_state.checkmate:
+        return ("0-1" if game_state.white_to_move else "1-0"), "checkmate"
+    if game_state.stalemate:
+        return "1/2-1/2", "stalemate"
+    if game_state.threefold_repetition:
+        return "1/2-1/2", "threefold repetition"
+    if game_state.fifty_move_rule:
+        return "1/2-1/2", "fifty-move rule"
+    if game_state.insufficient_material:
+        return "1/2-1/2", "insufficient material"
+    if plies >= max_plies:
+        return "1/2-1/2", "ply limit"
+    return None
+
+
+#worker task: play one game, white and black are engine indexes, returns a dict with the moves (SAN),
+#result, reason, and the nodes and search time of each engine
+def play_game(game_index, fen, white, black, max_plies):
+    game_state = notation.parse_fen(fen)
+    nodes = [0, 0]
+    search_time = [0.0, 0.0]
+    moves = []
+    for _, _, table in _engines: #every game starts with clean tables
+        table.clear()
+    while True:
+        valid_moves = game_state.get_valid_moves()
+        finished = adjudicate(game_state, len(moves), max_plies)
+        if finished is not None:
+            break
+        engine = white if game_state.white_to_move else black
+        settings, searcher, _ = _engines[engine]
+        result = searcher.search(game_state, settings["movetime"], settings["depth"] or MAX_PLY - 1)
+        nodes[engine] += result.nodes
+        search_time[engine] += result.elapsed
+        move = next(move for move in valid_moves if move == result.best_move)
+        moves.append(notation.to_san(game_state, move, valid_moves))
+        game_state.make_move(move)
+    return {"index": game_index, "fen": fen, "white": white, "black": black, "moves": moves, "result": finished[0],
+            "reason": finished[1], "nodes": nodes, "time": search_time}
+
+
+#0 win, 1 draw, 2 loss of the first engine
+def outcome(game):
+    if game["result"] == "1/2-1/2":
+        return 1
+    return 0 if (game["result"] == "1-0") == (game["white"] == 0) else 2
+
+
+#PGN text of a played game
+def format_pgn(game, names, event="Self-play match"):
+    headers = [("Event", event), ("Site", "?"), ("Date", time.strftime("%Y.%m.%d")), ("Round", str(game["index"] + 1)),
+               ("White", names[game["white"]]), ("Black", names[game["black"]]), ("Result", game["result"])]
+    if game["fen"] != notation.START_FEN:
+        headers += [("SetUp", "1"), ("FEN", game["fen"])]
+    headers += [("Termination", game["reason"]), ("PlyCount", str(len(game["moves"])))]
+    lines = ['[%s "%s"]' % (key, value.replace('"', '\\"')) for key, value in headers]
+
+    game_state = notation.parse_fen(game["fen"])
+    move_number = game_state.fullmove_number
+    white_to_move = game_state.white_to_move
+    tokens = []
+    for ply, san in enumerate(game["moves"]):
+        if white_to_move:
+            tokens.append("%d." % move_number)
+        elif ply == 0:
+            tokens.append("%d..." % move_number)
+        tokens.append(san)
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+    tokens.append(game["result"])
+
+    text_lines = [""]
+    for token in tokens: #lines of at most 80 characters
+        if text_lines[-1] and len(text_lines[-1]) + 1 + len(token) > 80:
+            text_lines.append("")
+        text_lines[-1] += (" " if text_lines[-1] else "") + token
+    return "\n".join(lines) + "\n\n" + "\n".join(text_lines) + "\n\n"
+
+
+#score of a logistic Elo difference, and back
+def elo_to_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def score_to_elo(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+#Elo difference of engine1 over engine2 from its wins, draws and losses: (elo, 95% margin, likelihood of superiority)
+def elo_difference(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, 0.0, 0.5
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    elo = score_to_elo(score)
+    error = (score_to_elo(score + margin) - score_to_elo(score - margin)) / 2
+    likelihood = 0.5 * (1 + math.erf((wins - losses) / math.sqrt(2 * (wins + losses)))) if wins + losses else 0.5
+    return elo, error, likelihood
+
+
+#log likelihood ratio of elo1 against elo0 (normal approximation of the game scores) and the SPRT bounds
+#returns (llr, lower bound, upper bound), the test accepts elo0 below the lower bound and elo1 above the upper
+def sprt(wins, draws, losses, elo0, elo1, alpha=SPRT_ALPHA, beta=SPRT_BETA):
+    lower, upper = math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+    games = wins + draws + losses
+    if games == 0 or wins + losses == 0:
+        return 0.0, lower, upper
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance <= 0:
+        return 0.0, lower, upper
+    score0, score1 = elo_to_score(elo0), elo_to_score(elo1)
+    llr = games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+    return llr, lower, upper
+
+
+#opening FENs from a file (one per line, see batch.read_fens) or the default openings
+def load_openings(path=None):
+    if path is not None:
+        with open(path) as openings_file:
+            return list(batch.read_fens(openings_file))
+    fens = []
+    for line in DEFAULT_OPENINGS:
+        game_state = notation.parse_fen(notation.START_FEN)
+        for san in line.split():
+            game_state.make_move(notation.parse_san(game_state, san))
+        fens.append(notation.to_fen(game_state))
+    return fens
+
+
+#play games between the two engine settings, openings in turn, each one with both colour assignments
+#yields every finished game (as play_game), stops early once the SPRT decides when sprt_bounds = (elo0, elo1)
+def run_match(engines, openings, games, workers=None, max_plies=DEFAULT_MAX_PLIES, sprt_bounds=None):
+    workers = workers or os.cpu_count() or 1
+    tally = [0, 0, 0] #wins, draws, losses of engine 0
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(engines,)) as executor:
+        futures = [executor.submit(play_game, index, openings[index // 2 % len(openings)], index % 2, 1 - index % 2, max_plies)
+                   for index in range(games)]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                game = future.result()
+                yield game
+                if sprt_bounds is not None:
+                    tally[outcome(game)] += 1
+                    llr, lower, upper = sprt(*tally, *sprt_bounds)
+                    if not lower < llr < upper:
+                        break
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play engine against engine matches and report Elo, SPRT and speed")
+    parser.add_argument("--engine1", default="", help="settings of the first engine, ex: depth=3,hash=8")
+    parser.add_argument("--engine2", default="", help="settings of the second engine")
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--openings", help="file with one opening FEN per line (default: built in openings)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: cpu count)")
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES, help="games longer than this are drawn")
+    parser.add_argument("--pgn", help="write the games to this PGN file")
+    parser.add_argument("--sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"), help="stop when the SPRT accepts elo0 or elo1")
+    args = parser.parse_args()
+
+    try:
+        engines = [parse_engine(args.engine1, 1), parse_engine(args.engine2, 2)]
+    except ValueError as error:
+        parser.error(str(error))
+    names = [engine["name"] for engine in engines]
+    openings = load_openings(args.openings)
+    print("%s vs %s, %d games from %d openings" % (names[0], names[1], args.games, len(openings)))
+
+    pgn_file = open(args.pgn, "w") if args.pgn else None
+    tally = [0, 0, 0] #wins, draws, losses of the first engine
+    reasons = {}
+    nodes = [0, 0]
+    search_time = [0.0, 0.0]
+    played = 0
+    start = time.perf_counter()
+    try:
+        for game in run_match(engines, openings, args.games, args.workers, args.max_plies, args.sprt):
+            played += 1
+            tally[outcome(game)] += 1
+            reasons[game["reason"]] = reasons.get(game["reason"], 0) + 1
+            for engine in range(2):
+                nodes[engine] += game["nodes"][engine]
+                search_time[engine] += game["time"][engine]
+            if pgn_file is not None:
+                pgn_file.write(format_pgn(game, names))
+            if played % PROGRESS_GAMES == 0:
+                elo, error, _ = elo_difference(*tally)
+                print("%4d games  +%d =%d -%d  elo %+.1f +/- %.1f" % (played, *tally, elo, error))
+    finally:
+        if pgn_file is not None:
+            pgn_file.close()
+    elapsed = time.perf_counter() - start
+
+    wins, draws, losses = tally
+    elo, error, likelihood = elo_difference(wins, draws, losses)
+    print("%d games  %s: +%d =%d -%d  score %.1f%%" % (played, names[0], wins, draws, losses,
+                                                       (wins + draws / 2) / played * 100 if played else 0))
+    print("elo difference %+.1f +/- %.1f  likelihood of superiority %.1f%%" % (elo, error, likelihood * 100))
+    if args.sprt:
+        llr, lower, upper = sprt(wins, draws, losses, *args.sprt)
+        verdict = "H1 accepted (elo >= %g)" % args.sprt[1] if llr >= upper else (
+            "H0 accepted (elo <= %g)" % args.sprt[0] if llr <= lower else "inconclusive")
+        print("sprt [%g, %g]  llr %.2f  bounds [%.2f, %.2f]  %s" % (args.sprt[0], args.sprt[1], llr, lower, upper, verdict))
+    print("endings " + ", ".join("%s %d" % (reason, count) for reason, count in sorted(reasons.items())))
+    for engine in range(2):
+        print("%-24s %10d nodes  %7.1fs  %7.0f nps" % (names[engine], nodes[engine], search_time[engine],
+                                                       nodes[engine] / search_time[engine] if search_time[engine] else 0))
+    print("%.1fs  %.0f games/hour  %.0f nps overall" % (elapsed, played / elapsed * 3600 if elapsed else 0,
+                                                        sum(nodes) / sum(search_time) if sum(search_time) else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,28 +6,46 @@ class Move():
     files_to_cols = {"a": 0, "b": 1, "c": 2, "d": 3,
                     "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v:k for k,v in files_to_cols.items()}
+    #promotion piece in the move_id, 0 for a move that is not a promotion
+    promotion_codes = {"N": 1, "B": 2, "R": 3, "Q": 4}
 
+    #thousands of moves are created per get_valid_moves, slots avoid a __dict__ per move
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "piece_moved", "piece_captured",
+                 "is_pawn_promotion", "promotion_piece", "is_enpassant_move", "is_castle_move", "move_id")
 
     def __init__(self, start_square, end_square, board, is_enpassant_move = False, is_castle_move = False):
-        self.start_row = start_square[0]
-        self.start_col = start_square[1]
-        self.end_row = end_square[0]
-        self.end_col = end_square[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
+        start_row, start_col = start_square
+        end_row, end_col = end_square
+        self.start_row = start_row
+        self.start_col = start_col
+        self.end_row = end_row
+        self.end_col = end_col
+        piece_moved = self.piece_moved = board[start_row][start_col]
 
         #pawn promotion
-        self.is_pawn_promotion = ((self.piece_moved == "wp" and self.end_row == 0) or (self.piece_moved == "bp" and self.end_row == 7))
+        self.is_pawn_promotion = piece_moved[1] == "p" and (end_row == 0 or end_row == 7)
+        self.promotion_piece = "Q" #the engine always promotes to a queen
 
         #en passant
         self.is_enpassant_move = is_enpassant_move
-        if self.is_enpassant_move:
-            self.piece_captured = "wp" if self.piece_moved == "bp" else "bp"
+        if is_enpassant_move:
+            self.piece_captured = "wp" if piece_moved == "bp" else "bp"
+        else:
+            self.piece_captured = board[end_row][end_col]
 
         #castle moves
         self.is_castle_move = is_castle_move
 
-        self.move_id = self.start_row * 1000 + self.start_col*100 + self.end_row*10 + self.end_col #for comparing if both moves are equal
+        #start square in the low 6 bits, end square in the next 6 (square = row*8 + col), then the promotion piece
+        #in 3 bits so a promotion and its underpromotions differ, for comparing if both moves are equal
+        self.move_id = start_row*8 + start_col | (end_row*8 + end_col) << 6
+        if self.is_pawn_promotion:
+            self.move_id |= self.promotion_codes["Q"] << 12
+
+    #promote to another piece ("N", "B", "R" or "Q"), keeping the move_id in step
+    def set_promotion_piece(self, piece):
+        self.promotion_piece = piece
+        self.move_id = self.move_id & 0xFFF | self.promotion_codes[piece] << 12
 
 
     def get_chess_notation(self):
@@ -42,3 +60,6 @@ class Move():
         if isinstance(other, Move):
             return self.move_id == other.move_id
         return False
+
+    def __hash__(self):
+        return self.move_id
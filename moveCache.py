@@ -0,0 +1,46 @@
+#Bounded LRU cache of legal moves keyed by the zobrist key of the position
+#the key covers pieces, side to move, castling rights and en passant, everything the legal moves depend on,
+#so make_move/undo_move never have to invalidate it: a changed position is a different key
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class MoveCache():
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict() #zobrist key -> (moves, checkmate, stalemate), oldest first
+        self.hits = 0
+        self.misses = 0
+
+    #(moves, checkmate, stalemate) of the position or None
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, moves, checkmate, stalemate):
+        self.entries[key] = (tuple(moves), checkmate, stalemate) #a tuple, so callers cant change the cached moves
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,202 @@
+#Reading and writing positions (FEN) and moves (SAN) in chess notation
+import copy
+import re
+
+from castleRights import CastleRights
+from move import Move
+import gameState
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+#FEN piece letter -> board string, ex: "K" -> "wK", "p" -> "bp"
+def fen_char_to_piece(char):
+    color = "w" if char.isupper() else "b"
+    piece_type = char.upper()
+    if piece_type not in "PNBRQK":
+        raise ValueError("Invalid FEN piece: " + char)
+    return color + ("p" if piece_type == "P" else piece_type)
+
+
+#create a new game state from a FEN string
+def parse_fen(fen, backend="mailbox"):
+    game_state = gameState.create_game_state(backend)
+    load_fen(game_state, fen)
+    return game_state
+
+
+#set up an existing game state from a FEN string
+def load_fen(game_state, fen):
+    fields = fen.split()
+    if len(fields) < 4:
+        raise ValueError("Invalid FEN: " + fen)
+
+    board = []
+    for rank in fields[0].split("/"):
+        row = []
+        for char in rank:
+            if char.isdigit():
+                row.extend(["--"] * int(char))
+            else:
+                row.append(fen_char_to_piece(char))
+        if len(row) != 8:
+            raise ValueError("Invalid FEN rank: " + rank)
+        board.append(row)
+    if len(board) != 8:
+        raise ValueError("Invalid FEN board: " + fields[0])
+    for king in ("wK", "bK"):
+        if sum(row.count(king) for row in board) != 1:
+            raise ValueError("Invalid FEN board, needs one king per side: " + fields[0])
+
+    castling = fields[2]
+    castling_rights = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+
+    enpassant_possible = ()
+    if fields[3] != "-":
+        enpassant_possible = (Move.ranks_to_rows[fields[3][1]], Move.files_to_cols[fields[3][0]])
+
+    #the move counters are optional, EPD style positions leave them out
+    halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+    fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+
+    game_state.load_position(board, fields[1] == "w", castling_rights, enpassant_possible, halfmove_clock, fullmove_number)
+
+
+#board string -> FEN piece letter, ex: "wK" -> "K", "bp" -> "p"
+def piece_to_fen_char(piece):
+    char = "P" if piece[1] == "p" else piece[1]
+    return char if piece[0] == "w" else char.lower()
+
+
+#FEN string of the current position, load_fen(to_fen(game_state)) gives back the same position
+def to_fen(game_state):
+    ranks = []
+    for row in game_state.board:
+        rank = ""
+        empty = 0
+        for piece in row:
+            if piece == "--":
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += piece_to_fen_char(piece)
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+
+    castling_rights = game_state.current_castling_rights
+    castling = (("K" if castling_rights.wks else "") + ("Q" if castling_rights.wqs else "")
+                + ("k" if castling_rights.bks else "") + ("q" if castling_rights.bqs else ""))
+
+    enpassant = "-"
+    if game_state.enpassant_possible != ():
+        row, col = game_state.enpassant_possible
+        enpassant = Move.cols_to_files[col] + Move.rows_to_ranks[row]
+
+    return "%s %s %s %s %d %d" % ("/".join(ranks), "w" if game_state.white_to_move else "b", castling or "-",
+                                  enpassant, game_state.halfmove_clock, game_state.fullmove_number)
+
+
+#SAN without the check/mate suffix and annotations: piece, from file, from rank, destination, promotion
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+SAN_SUFFIXES = "+#!?"
+
+
+#find the valid move written in SAN (ex: "Nf3", "exd6", "O-O", "e8=N+"), raises ValueError if there is none
+#valid_moves can be passed when the caller already generated them for this position
+def parse_san(game_state, san, valid_moves=None):
+    if valid_moves is None:
+        valid_moves = game_state.get_valid_moves()
+    text = san.rstrip(SAN_SUFFIXES).replace("0", "O")
+
+    if text in ("O-O", "O-O-O"):
+        for move in valid_moves:
+            if move.is_castle_move and (move.end_col == 6) == (text == "O-O"):
+                return move
+        raise ValueError("Illegal move: " + san)
+
+    match = SAN_PATTERN.match(text)
+    if match is None:
+        raise ValueError("Invalid SAN: " + san)
+    piece, from_file, from_rank, destination, promotion = match.groups()
+    piece = piece or "p"
+    end_row, end_col = Move.ranks_to_rows[destination[1]], Move.files_to_cols[destination[0]]
+
+    candidates = [move for move in valid_moves
+                  if move.end_row == end_row and move.end_col == end_col and move.piece_moved[1] == piece
+                  and (from_file is None or move.start_col == Move.files_to_cols[from_file])
+                  and (from_rank is None or move.start_row == Move.ranks_to_rows[from_rank])]
+    if len(candidates) != 1:
+        raise ValueError(("Ambiguous move: " if candidates else "Illegal move: ") + san)
+
+    move = candidates[0]
+    if move.is_pawn_promotion and promotion is not None and promotion != move.promotion_piece:
+        #the generator only makes queen promotions, the underpromotion is the same move with another piece
+        move = copy.copy(move)
+        move.set_promotion_piece(promotion)
+    return move
+
+
+#SAN of a valid move in the current position, ex: "Nbd7", "exd5", "O-O-O", "e8=Q#"
+def to_san(game_state, move, valid_moves=None):
+    if valid_moves is None:
+        valid_moves = game_state.get_valid_moves()
+
+    if move.is_castle_move:
+        san = "O-O" if move.end_col - move.start_col == 2 else "O-O-O"
+    else:
+        piece_type = move.piece_moved[1]
+        destination = move.get_rank_file(move.end_row, move.end_col)
+        capture = "x" if move.piece_captured != "--" else ""
+        if piece_type == "p":
+            san = (Move.cols_to_files[move.start_col] + capture if capture else "") + destination
+            if move.is_pawn_promotion:
+                san += "=" + move.promotion_piece
+        else:
+            #other pieces of the same type that can reach the destination
+            others = [other for other in valid_moves if other.piece_moved == move.piece_moved
+                      and other.end_row == move.end_row and other.end_col == move.end_col and other != move]
+            disambiguation = ""
+            if others:
+                if all(other.start_col != move.start_col for other in others):
+                    disambiguation = Move.cols_to_files[move.start_col]
+                elif all(other.start_row != move.start_row for other in others):
+                    disambiguation = Move.rows_to_ranks[move.start_row]
+                else:
+                    disambiguation = move.get_rank_file(move.start_row, move.start_col)
+            san = piece_type + disambiguation + capture + destination
+
+    #check or mate, the flags belong to the current position so keep them
+    flags = game_state.get_game_over_flags()
+    game_state.make_move(move)
+    if game_state.in_check():
+        san += "#" if len(game_state.get_valid_moves()) == 0 else "+"
+    game_state.undo_move()
+    game_state.set_game_over_flags(flags)
+    return san
+
+
+#long algebraic move as used by UCI, ex: "e2e4", "e7e8q"
+def to_uci(move):
+    text = move.get_chess_notation()
+    if move.is_pawn_promotion:
+        text += move.promotion_piece.lower()
+    return text
+
+
+#find the valid move written in UCI notation, raises ValueError if there is none
+def parse_uci(game_state, text, valid_moves=None):
+    if valid_moves is None:
+        valid_moves = game_state.get_valid_moves()
+    for move in valid_moves:
+        if move.get_chess_notation() == text[:4]:
+            promotion = text[4:].upper()
+            if move.is_pawn_promotion and promotion not in ("", move.promotion_piece):
+                if promotion not in ("N", "B", "R"):
+                    raise ValueError("Invalid promotion: " + text)
+                move = copy.copy(move)
+                move.set_promotion_piece(promotion)
+            return move
+    raise ValueError("Illegal move: " + text)
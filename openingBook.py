@@ -0,0 +1,181 @@
+#Opening book in the Polyglot .bin layout: 16 byte big endian entries (key u64, move u16, weight u16, learn u32)
+#sorted by key, the file is memory mapped and searched with binary search so big books open instantly
+#and the pages are shared by every process that opens the same file
+#the keys are the standard Polyglot keys (see polyglotKeys), so Polyglot books made by other tools work here
+#and books built by build_book work in other tools
+#
+#usage: python openingBook.py build games.pgn --out book.bin --plies 20
+#       python openingBook.py probe book.bin --fen "<FEN>"
+import argparse
+import copy
+import mmap
+import os
+import random
+import struct
+
+import notation
+import pgn
+import polyglotKeys
+
+ENTRY = struct.Struct(">QHHI")
+ENTRY_SIZE = ENTRY.size #16 bytes
+MAX_WEIGHT = 0xFFFF
+DEFAULT_BOOK_PLIES = 20
+#promotion field of a book move
+PROMOTION_CODES = {"N": 1, "B": 2, "R": 3, "Q": 4}
+PROMOTION_PIECES = {code: piece for piece, code in PROMOTION_CODES.items()}
+
+
+#Polyglot move: to file | to rank << 3 | from file << 6 | from rank << 9 | promotion << 12, ranks counted from white's side
+#castling is written as the king taking its own rook
+def encode_move(move):
+    end_col = move.end_col
+    if move.is_castle_move:
+        end_col = 7 if move.end_col > move.start_col else 0
+    code = end_col | (7 - move.end_row) << 3 | move.start_col << 6 | (7 - move.start_row) << 9
+    if move.is_pawn_promotion:
+        code |= PROMOTION_CODES[move.promotion_piece] << 12
+    return code
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % ENTRY_SIZE != 0:
+            self.file.close()
+            raise ValueError("Not a book file (size is not a multiple of %d): %s" % (ENTRY_SIZE, path))
+        self.count = size // ENTRY_SIZE
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    #a book sent to another process reopens (and maps) the same file there
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def close(self):
+        if self.count:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def key_at(self, index):
+        return struct.unpack_from(">Q", self.data, index * ENTRY_SIZE)[0]
+
+    #(move code, weight, learn) of every entry with this key
+    def entries(self, key):
+        low, high = 0, self.count
+        while low < high: #first entry with a key >= key
+            middle = (low + high) // 2
+            if self.key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < self.count:
+            entry_key, move_code, weight, learn = ENTRY.unpack_from(self.data, low * ENTRY_SIZE)
+            if entry_key != key:
+                break
+            found.append((move_code, weight, learn))
+            low += 1
+        return found
+
+    #[(Move, weight)] of the book moves in this position, book moves that are not legal here are skipped
+    def get_moves(self, game_state):
+        entries = self.entries(polyglotKeys.compute_key(game_state))
+        if not entries:
+            return []
+        flags = game_state.get_game_over_flags()
+        valid_moves = {encode_move(move) & 0xFFF: move for move in game_state.get_valid_moves()}
+        game_state.set_game_over_flags(flags)
+        moves = []
+        for move_code, weight, _ in entries:
+            move = valid_moves.get(move_code & 0xFFF)
+            if move is None:
+                continue
+            promotion = PROMOTION_PIECES.get(move_code >> 12)
+            if move.is_pawn_promotion and promotion is not None and promotion != move.promotion_piece:
+                move = copy.copy(move)
+                move.set_promotion_piece(promotion)
+            moves.append((move, weight))
+        return moves
+
+    #a book move picked at random in proportion to its weight, None when the position is not in the book
+    def choose_move(self, game_state, rng=random):
+        moves = [(move, weight) for move, weight in self.get_moves(game_state) if weight > 0]
+        if not moves:
+            return None
+        return rng.choices([move for move, _ in moves], weights=[weight for _, weight in moves])[0]
+
+
+#build a book from PGN files: every position in the first max_plies plies of each game gets the move played,
+#weighted 2 for a win, 1 for a draw and 0 for a loss of the side that played it
+#returns the number of entries written
+def build_book(pgn_paths, out_path, max_plies=DEFAULT_BOOK_PLIES, min_weight=1):
+    points = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+    weights = {} #(key, move code) -> weight
+    for path in pgn_paths:
+        for game in pgn.read_games(path):
+            if game.result not in points:
+                continue
+            white_points, black_points = points[game.result]
+            try:
+                game_state = notation.parse_fen(game.headers.get("FEN", notation.START_FEN))
+                for san in game.moves[:max_plies]:
+                    move = notation.parse_san(game_state, san)
+                    entry = (polyglotKeys.compute_key(game_state), encode_move(move))
+                    weights[entry] = weights.get(entry, 0) + (white_points if game_state.white_to_move else black_points)
+                    game_state.make_move(move)
+            except ValueError:
+                continue #keep the moves up to the illegal one
+
+    #scale down so the heaviest move fits in 16 bits
+    largest = max(weights.values(), default=0)
+    scale = MAX_WEIGHT / largest if largest > MAX_WEIGHT else 1
+    entries = sorted(((key, move_code, int(weight * scale)) for (key, move_code), weight in weights.items()
+                      if weight * scale >= min_weight), key=lambda entry: (entry[0], -entry[2]))
+    with open(out_path, "wb") as file:
+        for key, move_code, weight in entries:
+            file.write(ENTRY.pack(key, move_code, weight, 0))
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or probe an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("pgn", nargs="+", help="PGN files")
+    build.add_argument("--out", required=True, help="book file to write")
+    build.add_argument("--plies", type=int, default=DEFAULT_BOOK_PLIES, help="plies of each game to add")
+    build.add_argument("--min-weight", type=int, default=1, help="leave out moves below this weight")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book", help="book file")
+    probe.add_argument("--fen", default=notation.START_FEN)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print("%d entries written to %s" % (build_book(args.pgn, args.out, args.plies, args.min_weight), args.out))
+    else:
+        game_state = notation.parse_fen(args.fen)
+        with OpeningBook(args.book) as book:
+            moves = book.get_moves(game_state)
+            total = sum(weight for _, weight in moves)
+            for move, weight in sorted(moves, key=lambda entry: -entry[1]):
+                print("%-8s %5d  %5.1f%%" % (notation.to_san(game_state, move), weight, 100 * weight / total if total else 0))
+            if not moves:
+                print("position not in book")
+
+
+if __name__ == "__main__":
+    main()
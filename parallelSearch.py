@@ -0,0 +1,180 @@
+#Parallel search (lazy SMP): worker processes search the same root position at staggered depths
+#and share one transposition table in shared memory (see SharedTranspositionTable), what one worker
+#stores the others find, so together they get deeper than one process; the deepest completed result is played
+#ParallelSearcher.search takes the same arguments and returns the same SearchResult as Searcher.search
+#
+#usage: python parallelSearch.py --fen "<FEN>" --depth 6 --workers 1 2 4     time to depth and nps per worker count
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+
+from engineWorker import CancelFlag
+import notation
+from search import Searcher, MAX_PLY, DEFAULT_TABLE_MB
+from transpositionTable import SharedTranspositionTable
+
+NO_REQUEST = 0
+ITERATION = "iteration" #a worker completed a depth
+DONE = "done" #a worker finished its search, with its final result
+POLL_SECONDS = 0.01 #how often the main process checks its stop event while waiting for results
+GRACE_SECONDS = 2.0 #past the time limit, workers that still have not answered are given up on
+
+
+#worker process: search every request until None is received
+#odd workers start one ply deeper so the workers spread over two depths, and every worker but the first orders
+#its quiet moves with its own random history (see Searcher order_seed) so no two workers repeat each other
+def worker_loop(worker_index, requests, results, active_request, transposition_table, opening_book, tablebase):
+    searcher = Searcher(transposition_table, opening_book=opening_book, tablebase=tablebase,
+                        order_seed=worker_index if worker_index else None)
+    start_depth = 1 + worker_index % 2
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, game_state, time_limit_ms, max_depth = request
+        if active_request.value != request_id: #cancelled before it started
+            results.put((request_id, worker_index, DONE, None))
+            continue
+
+        def report(result):
+            results.put((request_id, worker_index, ITERATION, result))
+
+        result = searcher.search(game_state, time_limit_ms, max_depth, CancelFlag(active_request, request_id), report,
+                                 start_depth)
+        results.put((request_id, worker_index, DONE, result))
+    transposition_table.close()
+
+
+class ParallelSearcher():
+    #workers: number of worker processes (default: cpu count), started once and kept between searches
+    #opening_book and tablebase are given to every worker (see Searcher)
+    def __init__(self, workers=None, table_mb=DEFAULT_TABLE_MB, opening_book=None, tablebase=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.transposition_table = SharedTranspositionTable(table_mb)
+        self.opening_book = opening_book
+        self.tablebase = tablebase
+        self.active_request = multiprocessing.Value("q", NO_REQUEST, lock=False)
+        self.last_request_id = NO_REQUEST
+        self.results = multiprocessing.Queue()
+        self.requests = [multiprocessing.Queue() for _ in range(self.workers)]
+        self.processes = [multiprocessing.Process(target=worker_loop, daemon=True,
+                                                  args=(index, self.requests[index], self.results, self.active_request,
+                                                        self.transposition_table, opening_book, tablebase))
+                          for index in range(self.workers)]
+        for process in self.processes:
+            process.start()
+        self.depth_times = {} #depth -> seconds until a worker completed it, of the last search
+        self.worker_nodes = [] #nodes searched by each worker in the last search
+
+    #search on all workers until max_depth, the time budget or stop_event runs out, or a worker finishes
+    #on_iteration(result) is called each time a worker completes a depth no worker completed before
+    #a worker that dies (or hangs past the time limit) is given up on and its last completed depth counts as its
+    #result, when no worker is left the search runs in this process
+    def search(self, game_state, time_limit_ms=1000, max_depth=MAX_PLY - 1, stop_event=None, on_iteration=None):
+        start = time.perf_counter()
+        self.last_request_id += 1
+        request_id = self.last_request_id
+        self.active_request.value = request_id
+        pending = {index for index, process in enumerate(self.processes) if process.is_alive()}
+        for index in pending:
+            self.requests[index].put((request_id, game_state, time_limit_ms, max_depth))
+
+        self.depth_times = {}
+        final_results = [None] * self.workers
+        deepest = 0
+        give_up_at = None if time_limit_ms is None else start + time_limit_ms / 1000 + GRACE_SECONDS
+        while pending:
+            if stop_event is not None and stop_event.is_set():
+                self.active_request.value = NO_REQUEST
+            try:
+                message_request, worker_index, kind, result = self.results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                given_up = give_up_at is not None and time.perf_counter() > give_up_at
+                for index in list(pending):
+                    if given_up or not self.processes[index].is_alive():
+                        pending.discard(index)
+                if given_up:
+                    self.active_request.value = NO_REQUEST
+                continue
+            if message_request != request_id: #left over from an earlier search
+                continue
+            if kind == ITERATION:
+                final_results[worker_index] = result #kept in case the worker dies before it is done
+                if result.depth > deepest:
+                    deepest = result.depth
+                    self.depth_times[deepest] = time.perf_counter() - start
+                    if on_iteration is not None:
+                        on_iteration(result)
+            elif worker_index in pending:
+                if result is not None:
+                    final_results[worker_index] = result
+                pending.discard(worker_index)
+                self.active_request.value = NO_REQUEST #the first worker to finish ends the search
+
+        self.worker_nodes = [result.nodes if result is not None else 0 for result in final_results]
+        finished = [(index, result) for index, result in enumerate(final_results) if result is not None]
+        if not finished:
+            return self.search_here(game_state, time_limit_ms, max_depth, stop_event, on_iteration, start)
+        #book and tablebase answers first, then the deepest search, the lowest worker on a tie
+        _, best = max(finished, key=lambda entry: (entry[1].from_book or entry[1].from_tablebase, entry[1].depth, -entry[0]))
+        best.nodes = sum(self.worker_nodes)
+        best.elapsed = time.perf_counter() - start
+        best.nps = int(best.nodes / best.elapsed) if best.elapsed > 0 else 0
+        return best
+
+    #no worker answered (all of them died): search in this process on the shared table with the time that is left
+    def search_here(self, game_state, time_limit_ms, max_depth, stop_event, on_iteration, start):
+        if time_limit_ms is not None:
+            time_limit_ms = max(1, time_limit_ms - int((time.perf_counter() - start) * 1000))
+        searcher = Searcher(self.transposition_table, opening_book=self.opening_book, tablebase=self.tablebase)
+        return searcher.search(game_state, time_limit_ms, max_depth, stop_event, on_iteration)
+
+    def close(self):
+        self.active_request.value = NO_REQUEST
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+        self.transposition_table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+#time to each depth and nps of one search per worker count, the first count is the baseline for the speedup
+def benchmark(fen, depth, worker_counts, table_mb):
+    game_state = notation.parse_fen(fen)
+    baseline = None
+    for workers in worker_counts:
+        with ParallelSearcher(workers, table_mb) as searcher:
+            result = searcher.search(game_state, None, depth)
+            depth_times = searcher.depth_times
+            worker_nodes = searcher.worker_nodes
+        reached = max(depth_times)
+        if baseline is None:
+            baseline = depth_times
+        speedup = baseline[reached] / depth_times[reached] if reached in baseline else 0
+        print("workers %2d  depth %d in %7.2fs  speedup %.2fx  nodes %8d  nps %7d  bestmove %s" % (
+            workers, reached, depth_times[reached], speedup, result.nodes, result.nps, result.best_move.get_chess_notation()))
+        print("    time to depth  " + "  ".join("%d: %.2fs" % (level, seconds) for level, seconds in sorted(depth_times.items())))
+        print("    nodes per worker " + " ".join(str(nodes) for nodes in worker_nodes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lazy SMP search: time to depth and nps per worker count")
+    parser.add_argument("--fen", default=notation.START_FEN)
+    parser.add_argument("--depth", type=int, default=5, help="depth to search to")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to compare")
+    parser.add_argument("--hash", type=float, default=DEFAULT_TABLE_MB, help="shared transposition table size in MB")
+    args = parser.parse_args()
+    print("%d cpus" % (os.cpu_count() or 1))
+    benchmark(args.fen, args.depth, args.workers, args.hash)
+
+
+if __name__ == "__main__":
+    main()
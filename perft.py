@@ -0,0 +1,314 @@
+#Perft: count the leaf nodes of the move tree to a given depth
+#used to validate GameState.get_valid_moves and to time the move generator
+#
+#usage:
+#   python perft.py                                 run the suite of known positions
+#   python perft.py --position kiwipete --depth 3   time one position depth by depth
+#   python perft.py --fen "<FEN>" --depth 2 --divide
+#   python perft.py --compare                       check both backends generate identical moves
+#   python perft.py --check-hash                    check the incremental zobrist key at every node
+#   python perft.py --fuzz 100                      make/undo round trips on 100 random games
+#   python perft.py --check-flags                   check SAN, search, book and tablebase probes keep the game over flags
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import evaluation
+import gameState
+import notation
+import openingBook
+import tablebase
+import zobrist
+from search import Searcher
+
+#name: (FEN, expected node counts for depth 1, 2, 3, ...)
+#promotion is always to a queen in this engine, so the depths stop before any promotion can occur
+PERFT_SUITE = {
+    "startpos": (notation.START_FEN, [20, 400, 8902, 197281, 4865609]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862]),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    #en passant edge cases
+    "illegal_ep_white": ("3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", [18, 92, 1670, 10138, 185429]),
+    "illegal_ep_black": ("8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", [13, 102, 1266, 10276, 135655]),
+    "ep_gives_check": ("8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", [15, 126, 1928, 13931]),
+    #castling edge cases
+    "short_castle_check": ("5k2/8/8/8/8/8/8/4K2R w K - 0 1", [15, 66, 1198, 6399, 120330, 661072]),
+    "long_castle_check": ("3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", [16, 71, 1286, 7418, 141077, 803711]),
+    "castle_rights": ("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", [26, 1141, 27826, 1274206]),
+    "castle_prevented": ("r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", [44, 1494, 50509, 1720476]),
+    #check evasions
+    "discovered_check": ("8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", [29, 165, 5160]),
+    "double_check": ("8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", [37, 183, 6559, 23527]),
+}
+
+#name: (FEN, UCI moves played from it), live positions with a move into a draw, for --check-flags
+FLAG_POSITIONS = {
+    "insufficient_material": ("4k3/3p4/8/8/B7/8/8/4K3 w - - 0 1", []), #Bxd7 leaves bare bishop
+    "fifty_move_rule": ("8/8/8/4k3/8/8/4K3/4Q3 w - - 99 80", []), #any quiet move reaches 100 plies
+    "threefold_repetition": (notation.START_FEN, "g1f3 g8f6 f3g1 f6g8 g1f3 g8f6 f3g1".split()), #Ng8 repeats
+    "checkmate": ("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1", []), #Ra8#
+}
+FLAG_BOOK_GAME = "1. Nf3 Nf6 2. Ng1 Ng8 3. Nf3 Nf6 4. Ng1 Ng8 1/2-1/2"
+
+
+#count leaf nodes, the last ply is counted without making the moves
+def perft(game_state, depth):
+    moves = game_state.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        game_state.make_move(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undo_move()
+    return nodes
+
+
+#node counts per root move, ex: [("e2e4", 600), ...]
+def divide(game_state, depth):
+    results = []
+    for move in game_state.get_valid_moves():
+        if depth == 1:
+            nodes = 1
+        else:
+            game_state.make_move(move)
+            nodes = perft(game_state, depth - 1)
+            game_state.undo_move()
+        results.append((move.get_chess_notation(), nodes))
+    return sorted(results)
+
+
+#time perft for every depth up to max_depth, returns [(depth, nodes, seconds)]
+def run_perft(game_state, max_depth, show=True):
+    results = []
+    for depth in range(1, max_depth + 1):
+        start = time.perf_counter()
+        nodes = perft(game_state, depth)
+        elapsed = time.perf_counter() - start
+        results.append((depth, nodes, elapsed))
+        if show:
+            print(format_result(depth, nodes, elapsed))
+    return results
+
+
+def format_result(depth, nodes, elapsed):
+    nps = nodes / elapsed if elapsed > 0 else 0
+    return "depth %d  nodes %10d  time %8.3fs  nps %9.0f" % (depth, nodes, elapsed, nps)
+
+
+#run every suite position up to max_depth, returns True if all node counts match
+def run_suite(max_depth, backend="mailbox", names=None):
+    all_passed = True
+    total_nodes = 0
+    total_time = 0.0
+    for name in names or PERFT_SUITE:
+        fen, expected = PERFT_SUITE[name]
+        print(name, "-", fen)
+        game_state = notation.parse_fen(fen, backend)
+        for depth, nodes, elapsed in run_perft(game_state, min(max_depth, len(expected)), show=False):
+            passed = nodes == expected[depth - 1]
+            all_passed = all_passed and passed
+            total_nodes += nodes
+            total_time += elapsed
+            print("  " + format_result(depth, nodes, elapsed), "ok" if passed else "FAILED, expected %d" % expected[depth - 1])
+    print("total nodes %d  time %.3fs  nps %.0f" % (total_nodes, total_time, total_nodes / total_time if total_time > 0 else 0))
+    print("all passed" if all_passed else "FAILURES")
+    return all_passed
+
+
+#walk the move tree on both backends at once, returns the first position (as a move path) where they disagree
+def compare_backends(fen, depth):
+    mailbox = notation.parse_fen(fen, "mailbox")
+    bitboard = notation.parse_fen(fen, "bitboard")
+
+    def walk(depth, path):
+        mailbox_moves = {move.get_chess_notation(): move for move in mailbox.get_valid_moves()}
+        bitboard_moves = {move.get_chess_notation(): move for move in bitboard.get_valid_moves()}
+        if mailbox_moves.keys() != bitboard_moves.keys():
+            return path
+        if depth == 1:
+            return None
+        for notation_key in sorted(mailbox_moves):
+            mailbox.make_move(mailbox_moves[notation_key])
+            bitboard.make_move(bitboard_moves[notation_key])
+            mismatch = walk(depth - 1, path + [notation_key])
+            mailbox.undo_move()
+            bitboard.undo_move()
+            if mismatch is not None:
+                return mismatch
+        return None
+
+    return walk(depth, [])
+
+
+#walk the move tree checking the incremental zobrist key against a full recompute
+#returns the first move path where they differ, None if every node matched
+def check_hash(game_state, depth, path=()):
+    if game_state.zobrist_key != zobrist.compute_key(game_state):
+        return list(path)
+    if depth == 0:
+        return None
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        mismatch = check_hash(game_state, depth - 1, path + (move.get_chess_notation(),))
+        game_state.undo_move()
+        if mismatch is not None:
+            return mismatch
+    return None
+
+
+#everything make_move/undo_move must restore
+def snapshot(game_state):
+    return (tuple(tuple(row) for row in game_state.board), game_state.white_to_move, game_state.castling_bits,
+            game_state.enpassant_possible, game_state.halfmove_clock, game_state.zobrist_key,
+            game_state.white_king_location, game_state.black_king_location, len(game_state.move_log),
+            tuple(sorted((piece, tuple(sorted(squares))) for piece, squares in game_state.piece_squares.items())),
+            game_state.middlegame_score, game_state.endgame_score, game_state.phase,
+            tuple(sorted(getattr(game_state, "bitboards", {}).items())), tuple(sorted(game_state.position_counts.items())))
+
+
+#play random games, at every ply make and undo each legal move and check the state is restored exactly
+#returns a description of the first failure, None if every round trip matched
+def fuzz_make_undo(games, max_plies=200, seed=0, backend="mailbox"):
+    rng = random.Random(seed)
+    for game in range(games):
+        game_state = notation.parse_fen(notation.START_FEN, backend)
+        start = snapshot(game_state)
+        for ply in range(max_plies):
+            moves = game_state.get_valid_moves()
+            if len(moves) == 0:
+                break
+            before = snapshot(game_state)
+            for move in moves:
+                game_state.make_move(move)
+                if game_state.zobrist_key != zobrist.compute_key(game_state):
+                    return "game %d ply %d: hash mismatch after %s" % (game, ply, move.get_chess_notation())
+                if game_state.piece_squares != gameState.build_piece_squares(game_state.board):
+                    return "game %d ply %d: piece lists wrong after %s" % (game, ply, move.get_chess_notation())
+                try:
+                    evaluation.check_incremental(game_state)
+                except AssertionError as error:
+                    return "game %d ply %d: %s after %s" % (game, ply, error, move.get_chess_notation())
+                game_state.undo_move()
+                if snapshot(game_state) != before:
+                    return "game %d ply %d: state not restored after %s" % (game, ply, move.get_chess_notation())
+            game_state.make_move(rng.choice(moves))
+        while len(game_state.move_log) != 0:
+            game_state.undo_move()
+        if snapshot(game_state) != start:
+            return "game %d: start position not restored after undoing the game" % game
+    return None
+
+
+#SAN of every move, searches (eager and staged) and book and tablebase probes look at child positions,
+#each must leave the checkmate, stalemate and draw flags of the root as get_valid_moves set them
+#tablebase_directory: tables to probe, None generates KQK in a temporary directory
+#returns a description of the first failure, None if the flags were kept everywhere
+def check_game_over_flags(tablebase_directory=None):
+    with tempfile.TemporaryDirectory() as directory:
+        pgn_path = os.path.join(directory, "flags.pgn")
+        with open(pgn_path, "w") as pgn_file:
+            pgn_file.write(FLAG_BOOK_GAME + "\n")
+        book_path = os.path.join(directory, "flags.bin")
+        openingBook.build_book([pgn_path], book_path)
+        if tablebase_directory is None:
+            tablebase_directory = directory
+            tablebase.generate_all(directory, ("KQK",), workers=1)
+        with openingBook.OpeningBook(book_path) as book:
+            tables = tablebase.Tablebase(tablebase_directory)
+            probes = [("search", lambda game_state: Searcher(staged_moves=False).search(game_state, None, 3)),
+                      ("staged search", lambda game_state: Searcher().search(game_state, None, 3)),
+                      ("book", book.get_moves),
+                      ("book search", lambda game_state: Searcher(opening_book=book).search(game_state, None, 3)),
+                      ("tablebase", tables.best_move),
+                      ("tablebase search", lambda game_state: Searcher(tablebase=tables).search(game_state, None, 3))]
+            for name, (fen, moves) in FLAG_POSITIONS.items():
+                game_state = notation.parse_fen(fen)
+                for text in moves:
+                    game_state.make_move(notation.parse_uci(game_state, text))
+                valid_moves = game_state.get_valid_moves()
+                flags = game_state.get_game_over_flags()
+                for move in valid_moves:
+                    san = notation.to_san(game_state, move, valid_moves)
+                    if game_state.get_game_over_flags() != flags:
+                        return "%s: flags changed by the SAN of %s" % (name, san)
+                for probe_name, probe in probes:
+                    probe(game_state)
+                    if game_state.get_game_over_flags() != flags:
+                        return "%s: flags changed by the %s" % (name, probe_name)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft node counts and timing for GameState.get_valid_moves")
+    parser.add_argument("--depth", type=int, default=None, help="maximum depth (suite default: 4)")
+    parser.add_argument("--fen", help="position to search instead of the suite")
+    parser.add_argument("--position", choices=sorted(PERFT_SUITE), help="suite position to search")
+    parser.add_argument("--divide", action="store_true", help="break down node counts per root move")
+    parser.add_argument("--backend", choices=("mailbox", "bitboard"), default="mailbox")
+    parser.add_argument("--compare", action="store_true", help="check both backends generate identical moves")
+    parser.add_argument("--check-hash", action="store_true", help="check the incremental zobrist key at every node")
+    parser.add_argument("--fuzz", type=int, metavar="GAMES", help="make/undo round trips on random games")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for --fuzz")
+    parser.add_argument("--check-flags", action="store_true",
+                        help="check SAN, search, book and tablebase probes keep the game over flags of the position")
+    parser.add_argument("--tablebase", metavar="DIR", help="tables for --check-flags instead of generating KQK")
+    args = parser.parse_args()
+
+    fen = args.fen
+    if args.position:
+        fen = PERFT_SUITE[args.position][0]
+
+    #--fen, --position or the whole suite
+    if args.fen:
+        positions = [("fen", args.fen)]
+    else:
+        positions = [(name, PERFT_SUITE[name][0]) for name in ([args.position] if args.position else PERFT_SUITE)]
+
+    if args.compare:
+        identical = True
+        for name, position in positions:
+            mismatch = compare_backends(position, args.depth or 3)
+            identical = identical and mismatch is None
+            print(name, "identical" if mismatch is None else "MISMATCH after " + " ".join(mismatch))
+        raise SystemExit(0 if identical else 1)
+
+    if args.fuzz:
+        failure = fuzz_make_undo(args.fuzz, seed=args.seed, backend=args.backend)
+        print("%d random games, make/undo %s" % (args.fuzz, "ok" if failure is None else "FAILED: " + failure))
+        raise SystemExit(0 if failure is None else 1)
+
+    if args.check_flags:
+        failure = check_game_over_flags(args.tablebase)
+        print("game over flags %s" % ("kept" if failure is None else "CHANGED: " + failure))
+        raise SystemExit(0 if failure is None else 1)
+
+    if args.check_hash:
+        matched = True
+        for name, position in positions:
+            mismatch = check_hash(notation.parse_fen(position, args.backend), args.depth or 3)
+            matched = matched and mismatch is None
+            print(name, "hash ok" if mismatch is None else "HASH MISMATCH after " + " ".join(mismatch))
+        raise SystemExit(0 if matched else 1)
+
+    if fen is None:
+        raise SystemExit(0 if run_suite(args.depth or 4, args.backend) else 1)
+
+    game_state = notation.parse_fen(fen, args.backend)
+    depth = args.depth or 3
+    if args.divide:
+        start = time.perf_counter()
+        results = divide(game_state, depth)
+        elapsed = time.perf_counter() - start
+        for move_notation, nodes in results:
+            print("%s: %d" % (move_notation, nodes))
+        print("moves %d" % len(results))
+        print(format_result(depth, sum(nodes for _, nodes in results), elapsed))
+    else:
+        run_perft(game_state, depth)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#Streaming PGN reader, games are read one at a time so memory does not grow with the file size
+#
+#usage: python pgn.py games.pgn                 replay every game and report the illegal ones
+#       python pgn.py games.pgn --index         print the byte offset and players of every game
+import argparse
+import re
+import time
+
+import notation
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+HEADER_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+#braces, parentheses and ; are tokens on their own, anything else up to whitespace is a word
+TOKEN_PATTERN = re.compile(r"[{}();]|[^\s{}();]+")
+MOVE_NUMBER_PATTERN = re.compile(r"^\d+\.+")
+
+
+class PgnGame():
+    def __init__(self, offset):
+        self.offset = offset #byte offset of the game in the file, for indexing
+        self.headers = {}
+        self.moves = [] #SAN of the main line
+        self.result = "*"
+
+    def __repr__(self):
+        return "PgnGame(%s vs %s, %d plies, %s)" % (self.headers.get("White", "?"), self.headers.get("Black", "?"),
+                                                   len(self.moves), self.result)
+
+
+#yield the games of a PGN file one by one, only the current game is kept in memory
+#comments, variations and NAGs are skipped, only the main line moves are kept
+def read_games(path):
+    game = None
+    in_comment = False
+    variation_depth = 0
+    offset = 0
+    with open(path, "rb") as file:
+        for raw_line in file:
+            line_offset = offset
+            offset += len(raw_line)
+            line = raw_line.decode("utf-8", "replace").strip()
+            if not in_comment:
+                if line == "" or line[0] == "%": #blank or escaped line
+                    continue
+                if line[0] == "[":
+                    match = HEADER_PATTERN.match(line)
+                    if match is not None:
+                        if game is not None and (game.moves or game.result != "*"):
+                            yield game #a header after move text starts the next game
+                            game = None
+                        if game is None:
+                            game = PgnGame(line_offset)
+                        game.headers[match.group(1)] = match.group(2).replace('\\"', '"')
+                        continue
+
+            if game is None:
+                game = PgnGame(line_offset)
+            for token in TOKEN_PATTERN.findall(line):
+                if in_comment:
+                    in_comment = token != "}"
+                elif token == "{":
+                    in_comment = True
+                elif token == ";": #comment until the end of the line
+                    break
+                elif token == "(":
+                    variation_depth += 1
+                elif token == ")":
+                    variation_depth -= 1
+                elif variation_depth == 0 and token[0] != "$":
+                    if token in RESULTS:
+                        game.result = token
+                        yield game
+                        game = None
+                        break
+                    token = MOVE_NUMBER_PATTERN.sub("", token)
+                    if token != "":
+                        game.moves.append(token)
+
+    if game is not None and (game.moves or game.headers):
+        yield game
+
+
+#replay a game through make_move, yields (game_state, move) after each move
+#raises ValueError at the first illegal or unreadable move
+def replay(game, backend="mailbox"):
+    game_state = notation.parse_fen(game.headers.get("FEN", notation.START_FEN), backend)
+    for ply, san in enumerate(game.moves):
+        try:
+            move = notation.parse_san(game_state, san)
+        except ValueError as error:
+            raise ValueError("ply %d: %s" % (ply + 1, error))
+        game_state.make_move(move)
+        yield game_state, move
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate or index a PGN file")
+    parser.add_argument("path", help="PGN file")
+    parser.add_argument("--index", action="store_true", help="print offset, players and result of every game")
+    parser.add_argument("--backend", choices=("mailbox", "bitboard"), default="mailbox", help="move generator to replay with")
+    args = parser.parse_args()
+
+    games = plies = illegal = 0
+    start = time.perf_counter()
+    for game in read_games(args.path):
+        games += 1
+        if args.index:
+            print("%d\t%s\t%s\t%s\t%d" % (game.offset, game.headers.get("White", "?"), game.headers.get("Black", "?"),
+                                        game.result, len(game.moves)))
+            continue
+        try:
+            for _ in replay(game, args.backend):
+                plies += 1
+        except ValueError as error:
+            illegal += 1
+            print("game %d (offset %d): %s" % (games, game.offset, error))
+    elapsed = time.perf_counter() - start
+
+    if not args.index:
+        print("%d games  %d plies  %d illegal  %.1fs  %.0f plies/s" % (games, plies, illegal, elapsed,
+                                                                        plies / elapsed if elapsed else 0))
+
+
+if __name__ == "__main__":
+    main()
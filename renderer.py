@@ -0,0 +1,220 @@
+#Board rendering that only redraws what changed
+#the board background, highlight surfaces, fonts and text are made once, every square remembers what
+#is drawn on it and a frame only redraws the squares whose content changed, then updates just those
+#rectangles on the display; a frame where nothing changed draws nothing
+#
+#usage: python renderer.py      compare frame time and CPU against redrawing everything (no window needed)
+import os
+import time
+
+import pygame as p
+
+LIGHT_COLOR = (188, 210, 232)
+DARK_COLOR = (115, 165, 198)
+HIGHLIGHT_ALPHA = 100 #transparency value, 0 : transparent, 255: opaque
+#highlight layers of a square, drawn in this order
+SELECTED = "selected"
+MOVE_TARGET = "move_target"
+LAST_MOVE = "last_move"
+HIGHLIGHT_COLORS = {SELECTED: "orange", MOVE_TARGET: "yellow", LAST_MOVE: "orange"}
+FONT_NAME = "Helvitca"
+FONT_SIZE = 38
+#stats panel in the top left corner (see instrumentation)
+PANEL_FONT_SIZE = 14
+PANEL_ALPHA = 180
+PANEL_MARGIN = 4
+
+
+class BoardRenderer():
+    #full_redraw draws every square and flips the whole display each frame, the way the board used to be drawn
+    def __init__(self, screen, images, square_size, full_redraw=False):
+        self.screen = screen
+        self.images = images
+        self.square_size = square_size
+        self.full_redraw = full_redraw
+        self.width, self.height = screen.get_size()
+
+        #pre-rendered board and highlights
+        self.background = p.Surface((square_size * 8, square_size * 8))
+        for row in range(8):
+            for col in range(8):
+                color = LIGHT_COLOR if (row + col) % 2 == 0 else DARK_COLOR
+                self.background.fill(color, self.square_rect(row, col))
+        self.highlights = {}
+        for layer, color in HIGHLIGHT_COLORS.items():
+            surface = p.Surface((square_size, square_size))
+            surface.set_alpha(HIGHLIGHT_ALPHA)
+            surface.fill(p.Color(color))
+            self.highlights[layer] = surface
+        self.font = p.font.SysFont(FONT_NAME, FONT_SIZE, True, False)
+        self.text_surfaces = {} #text -> (shadow, front, rect)
+        self.panel_font = p.font.SysFont(FONT_NAME, PANEL_FONT_SIZE)
+        self.panel = None #(lines, surface, rect) of the last rendered stats panel
+
+        self.invalidate()
+
+    #forget what is on screen, the next frame redraws everything (new window, exposed window, ...)
+    def invalidate(self):
+        self.square_contents = [None] * 64 #(piece, highlight layers) drawn on each square
+        self.shown_text = None
+        self.shown_panel = None
+
+    def square_rect(self, row, col):
+        return p.Rect(col * self.square_size, row * self.square_size, self.square_size, self.square_size)
+
+    #squares (row*8 + col) a rectangle overlaps
+    def squares_under(self, rect):
+        first_row, first_col = max(rect.top // self.square_size, 0), max(rect.left // self.square_size, 0)
+        last_row = min((rect.bottom - 1) // self.square_size, 7)
+        last_col = min((rect.right - 1) // self.square_size, 7)
+        return [row*8 + col for row in range(first_row, last_row + 1) for col in range(first_col, last_col + 1)]
+
+    #what each square should show: (piece, highlight layers)
+    def square_layers(self, game_state, valid_moves, square_selected):
+        board = game_state.board
+        layers = [[] for _ in range(64)]
+        if square_selected != ():
+            row, col = square_selected
+            if board[row][col][0] == ("w" if game_state.white_to_move else "b"): #only the current player's pieces
+                layers[row*8 + col].append(SELECTED)
+                for move in valid_moves:
+                    if move.start_row == row and move.start_col == col:
+                        layers[move.end_row*8 + move.end_col].append(MOVE_TARGET)
+        if game_state.move_log:
+            last_move = game_state.move_log[-1]
+            layers[last_move.end_row*8 + last_move.end_col].append(LAST_MOVE)
+            layers[last_move.start_row*8 + last_move.start_col].append(LAST_MOVE)
+        return [(board[square // 8][square % 8], tuple(layers[square])) for square in range(64)]
+
+    #draw one square from the cached surfaces, returns its rectangle
+    def draw_square(self, square, content):
+        row, col = square // 8, square % 8
+        rect = self.square_rect(row, col)
+        piece, layers = content
+        self.screen.blit(self.background, rect, rect)
+        for layer in layers:
+            self.screen.blit(self.highlights[layer], rect)
+        if piece != "--":
+            self.screen.blit(self.images[piece], rect)
+        self.square_contents[square] = content
+        return rect
+
+    #(shadow surface, text surface, rect) of a centered message, rendered once per text
+    def text_surface(self, text):
+        if text not in self.text_surfaces:
+            shadow = self.font.render(text, 0, p.Color("Gray"))
+            front = self.font.render(text, 0, p.Color("Black"))
+            rect = p.Rect(self.width // 2 - shadow.get_width() // 2, self.height // 2 - shadow.get_height() // 2,
+                          shadow.get_width() + 2, shadow.get_height() + 2)
+            self.text_surfaces[text] = (shadow, front, rect)
+        return self.text_surfaces[text]
+
+    #(surface, rect) of the stats panel, rendered again only when its lines change
+    def panel_surface(self, lines):
+        if self.panel is None or self.panel[0] != lines:
+            rendered = [self.panel_font.render(line, True, p.Color("white")) for line in lines]
+            width = max(surface.get_width() for surface in rendered) + 2 * PANEL_MARGIN
+            height = sum(surface.get_height() for surface in rendered) + 2 * PANEL_MARGIN
+            surface = p.Surface((width, height))
+            surface.set_alpha(PANEL_ALPHA)
+            y = PANEL_MARGIN
+            for line_surface in rendered:
+                surface.blit(line_surface, (PANEL_MARGIN, y))
+                y += line_surface.get_height()
+            self.panel = (lines, surface, p.Rect(0, 0, width, height))
+        return self.panel[1], self.panel[2]
+
+    #draw the squares in contents that differ from the screen, the text and the stats panel (a tuple of lines)
+    #on top, and update those rectangles; returns the updated rectangles, empty when nothing changed
+    def draw_contents(self, contents, text=None, overlay=None, panel=None):
+        if self.full_redraw:
+            self.invalidate()
+        dirty = [square for square in range(64) if contents[square] != self.square_contents[square]]
+        if text != self.shown_text:
+            #squares under the old or the new text have to be redrawn
+            for shown in (self.shown_text, text):
+                if shown is not None:
+                    dirty.extend(self.squares_under(self.text_surface(shown)[2]))
+            dirty = sorted(set(dirty))
+        if panel != self.shown_panel:
+            for shown in (self.shown_panel, panel):
+                if shown is not None:
+                    dirty.extend(self.squares_under(self.panel_surface(shown)[1]))
+            dirty = sorted(set(dirty))
+        if overlay is not None: #moving piece of an animation, drawn over the squares
+            image, overlay_rect = overlay
+            dirty = sorted(set(dirty).union(self.squares_under(overlay_rect)))
+
+        rects = [self.draw_square(square, contents[square]) for square in dirty]
+        if overlay is not None:
+            self.screen.blit(image, overlay_rect)
+            for square in self.squares_under(overlay_rect):
+                self.square_contents[square] = None #covered by the moving piece, redraw next frame
+        if text is not None and (rects or text != self.shown_text):
+            shadow, front, text_rect = self.text_surface(text)
+            self.screen.blit(shadow, text_rect)
+            self.screen.blit(front, text_rect.move(2, 2))
+            rects.append(text_rect)
+        self.shown_text = text
+        if panel is not None and (rects or panel != self.shown_panel):
+            panel_surface, panel_rect = self.panel_surface(panel)
+            self.screen.blit(panel_surface, panel_rect)
+            rects.append(panel_rect)
+        self.shown_panel = panel
+
+        if self.full_redraw:
+            p.display.flip()
+        elif rects:
+            p.display.update(rects)
+        return rects
+
+    #board, highlights, an optional centered message (ex: "Stalemate") and an optional stats panel
+    def draw(self, game_state, valid_moves, square_selected, text=None, panel=None):
+        return self.draw_contents(self.square_layers(game_state, valid_moves, square_selected), text, None, panel)
+
+    #one frame of a move sliding from its start to its end square, the board is already in the position after the move
+    def draw_animation_frame(self, board, move, frame, frame_count, panel=None):
+        contents = [(board[square // 8][square % 8], ()) for square in range(64)]
+        contents[move.end_row*8 + move.end_col] = (move.piece_captured, ()) #captured piece stays until the mover arrives
+        row = move.start_row + (move.end_row - move.start_row) * frame / frame_count
+        col = move.start_col + (move.end_col - move.start_col) * frame / frame_count
+        overlay_rect = p.Rect(round(col * self.square_size), round(row * self.square_size), self.square_size, self.square_size)
+        return self.draw_contents(contents, None, (self.images[move.piece_moved], overlay_rect), panel)
+
+
+#frame time and CPU time of the dirty rectangle renderer against full redraws, on idle frames,
+#selection changes and a move animation
+def benchmark(frames=300):
+    import gameState
+    import main as game
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    p.init()
+    screen = p.display.set_mode((game.WIDTH, game.HEIGHT))
+    game.load_images()
+    game_state = gameState.create_game_state()
+    valid_moves = game_state.get_valid_moves()
+    selections = [(6, col) for col in range(8)] + [()]
+    move = valid_moves[0]
+
+    for full_redraw in (True, False):
+        renderer = BoardRenderer(screen, game.IMAGES, game.SQUARE_SIZE, full_redraw)
+        scenarios = {
+            "idle": lambda frame: renderer.draw(game_state, valid_moves, ()),
+            "selection": lambda frame: renderer.draw(game_state, valid_moves, selections[frame % len(selections)]),
+            "animation": lambda frame: renderer.draw_animation_frame(game_state.board, move, frame % 20, 20),
+        }
+        for name, draw_frame in scenarios.items():
+            renderer.invalidate()
+            draw_frame(0)
+            wall, cpu = time.perf_counter(), time.process_time()
+            for frame in range(frames):
+                draw_frame(frame)
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            print("%-12s %-10s %8.3f ms/frame  cpu %8.3f ms/frame" % ("full redraw" if full_redraw else "dirty rects",
+                                                                    name, wall / frames * 1000, cpu / frames * 1000))
+    p.quit()
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,356 @@
+#Search for the best move in a GameState
+#negamax with alpha-beta pruning, iterative deepening under a time budget,
+#quiescence search on captures and move ordering (MVV-LVA, killer moves, history heuristic)
+#
+#usage: python search.py --fen "<FEN>" --movetime 1000
+import argparse
+import random
+import time
+
+import evaluation
+from evaluation import evaluate
+from gameState import FIFTY_MOVE_PLIES, PIECE_CODES, mvv_lva_score
+import notation
+from openingBook import OpeningBook
+from tablebase import Tablebase, WIN, LOSS
+from transpositionTable import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+CHECKMATE_SCORE = 100000 #mate in n plies scores CHECKMATE_SCORE - n
+MAX_PLY = 64
+MAX_MATE_PLIES = 256 #scores this close to CHECKMATE_SCORE are mates, tablebase mates are longer than MAX_PLY
+CHECK_EVERY_NODES = 1024 #how often the clock and stop flag are polled
+DEFAULT_TABLE_MB = 16
+
+#move ordering scores, higher is searched first
+HASH_MOVE_ORDER = 20000000
+PV_MOVE_ORDER = 10000000
+CAPTURE_ORDER = 1000000
+PROMOTION_ORDER = 900000
+KILLER_ORDER = 800000
+HISTORY_NOISE = 16 #largest random start value of a history entry with an order_seed, a few cutoffs outweigh it
+
+
+#mate scores are stored relative to the node so they stay correct when reached at another ply
+def score_to_table(score, ply):
+    if score >= CHECKMATE_SCORE - MAX_MATE_PLIES:
+        return score + ply
+    if score <= -CHECKMATE_SCORE + MAX_MATE_PLIES:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= CHECKMATE_SCORE - MAX_MATE_PLIES:
+        return score - ply
+    if score <= -CHECKMATE_SCORE + MAX_MATE_PLIES:
+        return score + ply
+    return score
+
+
+class SearchStopped(Exception):
+    pass
+
+
+#result of a search call
+class SearchResult():
+    def __init__(self, best_move, score, depth, principal_variation, nodes, elapsed, from_book=False, from_tablebase=False):
+        self.best_move = best_move
+        self.score = score #centipawns for the side to move
+        self.depth = depth #last fully searched depth
+        self.principal_variation = principal_variation #list of moves, starting with best_move
+        self.nodes = nodes
+        self.elapsed = elapsed #seconds
+        self.nps = int(nodes / elapsed) if elapsed > 0 else 0
+        self.from_book = from_book #played from the opening book, without searching
+        self.from_tablebase = from_tablebase #exact result from the endgame tablebase, without searching
+
+    def is_mate_score(self):
+        return abs(self.score) >= CHECKMATE_SCORE - MAX_MATE_PLIES
+
+    def __repr__(self):
+        if self.from_book:
+            return "book move " + self.best_move.get_chess_notation()
+        if self.from_tablebase:
+            return "tablebase move %s score %d" % (self.best_move.get_chess_notation(), self.score)
+        return "depth %d score %d nodes %d time %.3fs nps %d pv %s" % (
+            self.depth, self.score, self.nodes, self.elapsed, self.nps,
+            " ".join(move.get_chess_notation() for move in self.principal_variation))
+
+
+class Searcher():
+    #the transposition table is kept between searches, pass one in to share or size it
+    #staged_moves generates moves stage by stage (see GameState.generate_staged_moves) instead of all at once
+    #with an opening_book (see openingBook) positions in the book are answered with a book move instead of a search
+    #with a tablebase (see tablebase) positions in its tables get their exact score, at the root and inside the tree
+    #with an order_seed the history starts with small random values, so searchers with different seeds try the
+    #quiet moves in different orders (the workers of a parallel search, see parallelSearch)
+    def __init__(self, transposition_table=None, staged_moves=True, opening_book=None, tablebase=None, order_seed=None):
+        if transposition_table is None:
+            transposition_table = TranspositionTable(DEFAULT_TABLE_MB)
+        self.transposition_table = transposition_table
+        self.killer_moves = [[None, None] for _ in range(MAX_PLY)] #quiet moves that caused a cutoff, per ply
+        self.history = {} #(piece_moved, end_row, end_col) -> score of quiet moves that caused a cutoff
+        if order_seed is not None:
+            rng = random.Random(order_seed)
+            self.history = {(piece, row, col): rng.randrange(HISTORY_NOISE)
+                            for piece in PIECE_CODES[1:] for row in range(8) for col in range(8)}
+        self.nodes = 0
+        self.staged_moves = staged_moves
+        self.opening_book = opening_book
+        self.tablebase = tablebase
+
+    #iterative deepening until max_depth, the time budget or stop_event (anything with is_set()) runs out
+    #on_iteration(result) is called after each completed depth, start_depth skips the shallower iterations
+    def search(self, game_state, time_limit_ms=1000, max_depth=MAX_PLY - 1, stop_event=None, on_iteration=None, start_depth=1):
+        self.game_state = game_state
+        self.stop_event = stop_event
+        self.nodes = 0
+        self.start_time = time.perf_counter()
+        self.deadline = self.start_time + time_limit_ms / 1000 if time_limit_ms is not None else None
+        self.can_stop = False #always finish depth 1 so there is a move to return
+        self.killer_moves = [[None, None] for _ in range(MAX_PLY)]
+        self.previous_pv = []
+        #no side can mate from here on: every position below is a draw, one iteration finds a legal move
+        self.dead_root = game_state.has_insufficient_material()
+
+        if self.opening_book is not None:
+            book_move = self.opening_book.choose_move(game_state)
+            if book_move is not None:
+                return SearchResult(book_move, 0, 0, [book_move], 0, time.perf_counter() - self.start_time, from_book=True)
+
+        if self.tablebase is not None:
+            found = self.tablebase.best_move(game_state)
+            if found is not None:
+                move, tablebase_result = found
+                result = SearchResult(move, tablebase_score(tablebase_result, 0), 1, [move], 0,
+                                      time.perf_counter() - self.start_time, from_tablebase=True)
+                if on_iteration is not None:
+                    on_iteration(result)
+                return result
+
+        #searching sets the game over flags on inner nodes, keep the flags of the root position
+        flags = game_state.get_game_over_flags()
+        root_moves_made = len(game_state.move_log)
+        result = None
+        try:
+            for depth in range(min(start_depth, max_depth), max_depth + 1):
+                try:
+                    score, principal_variation = self.negamax(depth, -CHECKMATE_SCORE - 1, CHECKMATE_SCORE + 1, 0)
+                except SearchStopped:
+                    #unwind the moves made by the interrupted iteration
+                    while len(game_state.move_log) > root_moves_made:
+                        game_state.undo_move()
+                    break
+                self.can_stop = True
+                self.previous_pv = principal_variation
+                result = SearchResult(principal_variation[0] if principal_variation else None, score, depth,
+                                      principal_variation, self.nodes, time.perf_counter() - self.start_time)
+                if on_iteration is not None:
+                    on_iteration(result)
+                if not principal_variation or result.is_mate_score() or self.dead_root:
+                    break
+                #the next depth takes several times longer, dont start it without enough time left
+                if self.deadline is not None and time.perf_counter() - self.start_time > (self.deadline - self.start_time) / 2:
+                    break
+        finally:
+            game_state.set_game_over_flags(flags)
+
+        if result is not None:
+            result.nodes = self.nodes
+            result.elapsed = time.perf_counter() - self.start_time
+            result.nps = int(result.nodes / result.elapsed) if result.elapsed > 0 else 0
+        return result
+
+    def check_stop(self):
+        if not self.can_stop:
+            return
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchStopped()
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchStopped()
+
+    #returns (score, principal variation) for the side to move
+    def negamax(self, depth, alpha, beta, ply):
+        if self.tablebase is not None and ply > 0:
+            tablebase_result = self.tablebase.probe(self.game_state)
+            if tablebase_result is not None:
+                self.nodes += 1
+                return tablebase_score(tablebase_result, ply), []
+
+        #dead position, no side can mate: material only changes on a capture (or a pawn move), which resets the clock
+        game_state = self.game_state
+        if ply > 0 and (self.dead_root or (game_state.halfmove_clock == 0 and game_state.has_insufficient_material())):
+            self.nodes += 1
+            return 0, []
+
+        if depth <= 0:
+            return self.quiescence(alpha, beta, ply), []
+
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY_NODES == 0:
+            self.check_stop()
+
+        key = game_state.zobrist_key
+        #a repeated position can be repeated again, score it as the draw it leads to
+        if ply > 0 and (game_state.position_counts[key] > 1 or game_state.halfmove_clock >= FIFTY_MOVE_PLIES):
+            return 0, []
+        hash_move_id = 0
+        entry = self.transposition_table.probe(key)
+        if entry is not None:
+            entry_depth, entry_score, bound, hash_move_id = entry
+            if ply > 0 and entry_depth >= depth:
+                entry_score = score_from_table(entry_score, ply)
+                if (bound == EXACT or (bound == LOWER_BOUND and entry_score >= beta)
+                        or (bound == UPPER_BOUND and entry_score <= alpha)):
+                    return entry_score, []
+
+        pv_move = self.previous_pv[ply] if ply < len(self.previous_pv) else None
+        if self.staged_moves:
+            moves = game_state.generate_staged_moves((hash_move_id, pv_move.move_id if pv_move is not None else 0),
+                                                     self.killer_moves[ply], self.history_score)
+        else:
+            moves = game_state.get_valid_moves()
+            self.order_moves(moves, ply, pv_move, hash_move_id)
+        original_alpha = alpha
+
+        best_score = -CHECKMATE_SCORE - 1
+        best_line = []
+        for move in moves:
+            game_state.make_move(move)
+            score, line = self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            score = -score
+            game_state.undo_move()
+
+            if score > best_score:
+                best_score = score
+                best_line = [move] + line
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if move.piece_captured == "--":
+                            self.store_killer(move, ply)
+                            history_key = (move.piece_moved, move.end_row, move.end_col)
+                            self.history[history_key] = self.history.get(history_key, 0) + depth * depth
+                        break
+
+        if not best_line: #no legal moves
+            if game_state.in_check():
+                return -CHECKMATE_SCORE + ply, []
+            return 0, [] #stalemate
+
+        if best_score <= original_alpha:
+            bound = UPPER_BOUND
+        elif best_score >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.transposition_table.store(key, depth, score_to_table(best_score, ply), bound, best_line[0].move_id)
+        return best_score, best_line
+
+    #only search captures at the horizon so the evaluation isnt taken in the middle of an exchange
+    def quiescence(self, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY_NODES == 0:
+            self.check_stop()
+
+        if self.game_state.halfmove_clock == 0 and self.game_state.has_insufficient_material(): #captured down to a dead position
+            return 0
+
+        stand_pat = evaluate(self.game_state)
+        if stand_pat >= beta or ply >= MAX_PLY - 1:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        game_state = self.game_state
+        if self.staged_moves:
+            captures = game_state.generate_captures()
+        else:
+            captures = [move for move in game_state.get_valid_moves() if move.piece_captured != "--"]
+            captures.sort(key=mvv_lva_score, reverse=True)
+        for move in captures:
+            game_state.make_move(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            game_state.undo_move()
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+        return alpha
+
+    #sort moves best first: hash move, previous principal variation, captures by MVV-LVA, promotions, killers, history
+    def order_moves(self, moves, ply, pv_move, hash_move_id=0):
+        killers = self.killer_moves[ply]
+        history = self.history
+
+        def order(move):
+            if move.move_id == hash_move_id:
+                return HASH_MOVE_ORDER
+            if pv_move is not None and move == pv_move:
+                return PV_MOVE_ORDER
+            if move.piece_captured != "--":
+                return CAPTURE_ORDER + mvv_lva_score(move)
+            if move.is_pawn_promotion:
+                return PROMOTION_ORDER
+            if move == killers[0]:
+                return KILLER_ORDER + 1
+            if move == killers[1]:
+                return KILLER_ORDER
+            return history.get((move.piece_moved, move.end_row, move.end_col), 0)
+
+        moves.sort(key=order, reverse=True)
+
+    #quiet move ordering by the history heuristic
+    def history_score(self, move):
+        return self.history.get((move.piece_moved, move.end_row, move.end_col), 0)
+
+    def store_killer(self, move, ply):
+        killers = self.killer_moves[ply]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+
+
+#search score of a tablebase (result, plies to mate) found ply plies from the root
+def tablebase_score(tablebase_result, ply):
+    wdl, plies = tablebase_result
+    if wdl == WIN:
+        return CHECKMATE_SCORE - ply - plies
+    if wdl == LOSS:
+        return -CHECKMATE_SCORE + ply + plies
+    return 0
+
+
+#search a position with a fresh Searcher, returns a SearchResult (None if there are no legal moves)
+def find_best_move(game_state, time_limit_ms=1000, max_depth=MAX_PLY - 1, stop_event=None):
+    return Searcher().search(game_state, time_limit_ms, max_depth, stop_event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a position and report the best move")
+    parser.add_argument("--fen", default=notation.START_FEN)
+    parser.add_argument("--movetime", type=int, default=1000, help="time budget in milliseconds")
+    parser.add_argument("--depth", type=int, default=MAX_PLY - 1, help="maximum depth")
+    parser.add_argument("--backend", choices=("mailbox", "bitboard"), default="mailbox")
+    parser.add_argument("--hash", type=float, default=DEFAULT_TABLE_MB, help="transposition table size in MB")
+    parser.add_argument("--debug-eval", action="store_true", help="check the incremental evaluation at every leaf")
+    parser.add_argument("--book", help="opening book file (see openingBook.py)")
+    parser.add_argument("--tablebase", help="directory of the endgame tables (see tablebase.py)")
+    args = parser.parse_args()
+    evaluation.DEBUG_EVALUATION = args.debug_eval
+
+    game_state = notation.parse_fen(args.fen, args.backend)
+    searcher = Searcher(TranspositionTable(args.hash), opening_book=OpeningBook(args.book) if args.book else None,
+                        tablebase=Tablebase(args.tablebase) if args.tablebase else None)
+    result = searcher.search(game_state, args.movetime, args.depth, on_iteration=print)
+    if result is None:
+        print("no legal moves")
+    elif result.from_book:
+        print(result)
+    else:
+        print("bestmove", result.best_move.get_chess_notation(), "nodes", result.nodes, "nps", result.nps)
+        print("transposition table", searcher.transposition_table.stats())
+
+
+if __name__ == "__main__":
+    main()
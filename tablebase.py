@@ -0,0 +1,425 @@
+#Endgame tablebases for KQK, KRK and KPK made by retrograde analysis
+#every placement of the pieces is enumerated, its legal moves come from GameState, and the results are worked
+#backwards from the checkmates: a position where some move reaches a lost position is won, a position where
+#every move reaches a won position is lost, what is never reached is a draw
+#a table is one byte per position: the plies to mate (odd: the side to move mates, even: it gets mated),
+#DRAW or ILLEGAL, indexed by a position index that uses the board symmetries (see position_index)
+#tables are stored with white as the side with the extra piece, black's are probed on the mirrored board
+#
+#usage: python tablebase.py generate --dir tablebases --workers 4
+#       python tablebase.py probe --dir tablebases --fen "<FEN>"
+#       python tablebase.py verify --dir tablebases --positions 1000
+import argparse
+import array
+import concurrent.futures
+import os
+import random
+import time
+
+from castleRights import CastleRights
+import gameState
+import notation
+
+SIGNATURES = ("KQK", "KRK", "KPK") #in build order, KPK needs KQK and KRK for its promotions
+DRAW = 255
+ILLEGAL = 254
+WIN = 1
+LOSS = -1
+DEFAULT_CHUNK_SIZE = 4096
+#the white piece next to the kings
+TABLE_PIECES = {"KQK": "wQ", "KRK": "wR", "KPK": "wp"}
+
+#squares of the a1-d1-d4 triangle, where the white king is moved by the 8 symmetries of a pawnless board
+TRIANGLE = [row*8 + col for row in range(4, 8) for col in range(4) if col >= 7 - row]
+TRIANGLE_INDEX = {square: index for index, square in enumerate(TRIANGLE)}
+#pawn squares on files a-d, ranks 2-7, pawn endings are only mirrored left to right
+PAWN_SQUARES = [row*8 + col for row in range(1, 7) for col in range(4)]
+PAWN_INDEX = {square: index for index, square in enumerate(PAWN_SQUARES)}
+
+TABLE_SIZES = {"KQK": len(TRIANGLE) * 64 * 64 * 2, "KRK": len(TRIANGLE) * 64 * 64 * 2, "KPK": len(PAWN_SQUARES) * 64 * 64 * 2}
+
+
+def mirror_col(square):
+    return square ^ 7
+
+
+def mirror_row(square):
+    return square ^ 56
+
+
+def transpose(square):
+    return (7 - square % 8) * 8 + 7 - square // 8 #swaps files and ranks, a1 and h8 stay in place
+
+
+#index of a position (white king, black king, white piece squares, side to move) in a table
+#pawnless: the symmetry putting the white king in TRIANGLE is applied to every piece
+#pawn: the board is mirrored left to right when the pawn is on files e-h
+def position_index(signature, white_king, black_king, piece, white_to_move):
+    side = 0 if white_to_move else 1
+    if signature == "KPK":
+        if piece % 8 > 3:
+            white_king, black_king, piece = mirror_col(white_king), mirror_col(black_king), mirror_col(piece)
+        return ((PAWN_INDEX[piece] * 64 + white_king) * 64 + black_king) * 2 + side
+    squares = [white_king, black_king, piece]
+    if white_king % 8 > 3:
+        squares = [mirror_col(square) for square in squares]
+    if squares[0] // 8 < 4:
+        squares = [mirror_row(square) for square in squares]
+    if squares[0] not in TRIANGLE_INDEX:
+        squares = [transpose(square) for square in squares]
+    white_king, black_king, piece = squares
+    return ((TRIANGLE_INDEX[white_king] * 64 + black_king) * 64 + piece) * 2 + side
+
+
+#(white king, black king, white piece, white to move) of a table index
+def decode_index(signature, index):
+    index, side = divmod(index, 2)
+    if signature == "KPK":
+        index, black_king = divmod(index, 64)
+        pawn, white_king = divmod(index, 64)
+        return white_king, black_king, PAWN_SQUARES[pawn], side == 0
+    index, piece = divmod(index, 64)
+    king, black_king = divmod(index, 64)
+    return TRIANGLE[king], black_king, piece, side == 0
+
+
+_tables = {} #tables of the finished signatures in each worker process, set by init_worker
+
+
+def init_worker(tables):
+    _tables.update(tables)
+
+
+#value of a position reached by leaving the table: a promotion looked up in its table, or a bare king draw
+def converted_value(signature, white_king, black_king, piece, white_to_move):
+    if signature not in _tables:
+        return DRAW
+    return _tables[signature][position_index(signature, white_king, black_king, piece, white_to_move)]
+
+
+#worker task: the legal moves of the positions first..last-1
+#returns (status, offsets, children, converted_positions, converted_values): status is ILLEGAL, 0 for checkmate
+#or DRAW (stalemate, or not solved yet), children[offsets[i]:offsets[i+1]] are the table indexes reached from
+#position first+i and the moves leaving the table are (position, value) pairs in converted_positions/values
+def generate_moves(signature, first, last):
+    piece_name = TABLE_PIECES[signature]
+    status = bytearray([DRAW]) * (last - first)
+    offsets = array.array("I", [0])
+    children = array.array("I")
+    converted_positions = array.array("I")
+    converted_values = bytearray()
+    game_state = gameState.GameState()
+    board = [["--"] * 8 for _ in range(8)]
+    no_castling = CastleRights(False, False, False, False)
+
+    for index in range(first, last):
+        white_king, black_king, piece, white_to_move = decode_index(signature, index)
+        if (len({white_king, black_king, piece}) < 3 or black_king in gameState.KING_TARGETS[white_king]
+                or (piece_name == "wp" and piece // 8 in (0, 7))):
+            status[index - first] = ILLEGAL
+            offsets.append(len(children))
+            continue
+        for square, name in ((white_king, "wK"), (black_king, "bK"), (piece, piece_name)):
+            board[square // 8][square % 8] = name
+        game_state.load_position(board, white_to_move, no_castling)
+        #the side that just moved cant be left in check
+        game_state.white_to_move = not white_to_move
+        illegal = game_state.in_check()
+        game_state.white_to_move = white_to_move
+
+        if illegal:
+            status[index - first] = ILLEGAL
+        else:
+            valid_moves = game_state.get_valid_moves()
+            if not valid_moves:
+                status[index - first] = 0 if game_state.in_check() else DRAW
+            for move in valid_moves:
+                start, end = move.start_row*8 + move.start_col, move.end_row*8 + move.end_col
+                if move.piece_captured != "--": #the black king takes the piece, bare kings
+                    converted_positions.append(index)
+                    converted_values.append(DRAW)
+                elif move.is_pawn_promotion:
+                    #knight and bishop promotions are dead draws, they never change a result
+                    for promotion in ("KQK", "KRK"):
+                        converted_positions.append(index)
+                        converted_values.append(converted_value(promotion, white_king, black_king, end, False))
+                elif start == white_king:
+                    children.append(position_index(signature, end, black_king, piece, False))
+                elif start == black_king:
+                    children.append(position_index(signature, white_king, end, piece, True))
+                else:
+                    children.append(position_index(signature, white_king, black_king, end, False))
+        offsets.append(len(children))
+        for square in (white_king, black_king, piece):
+            board[square // 8][square % 8] = "--"
+    return status, offsets, children, converted_positions, converted_values
+
+
+#build the table of a signature, tables holds the finished tables it converts into
+#the move generation is split over a process pool, the retrograde pass runs here
+def generate_table(signature, tables=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    tables = tables or {}
+    if signature == "KPK" and not ("KQK" in tables and "KRK" in tables):
+        raise ValueError("KPK needs the KQK and KRK tables for its promotions")
+    size = TABLE_SIZES[signature]
+    workers = workers or os.cpu_count() or 1
+    values = bytearray(size)
+    offsets = array.array("I", [0])
+    children = array.array("I")
+    converted = [] #(position, value) of the moves leaving the table
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(tables,)) as executor:
+        futures = [executor.submit(generate_moves, signature, first, min(first + chunk_size, size))
+                   for first in range(0, size, chunk_size)]
+        for first, future in zip(range(0, size, chunk_size), futures):
+            status, chunk_offsets, chunk_children, converted_positions, converted_values = future.result()
+            values[first:first + len(status)] = status
+            base = len(children)
+            offsets.extend(base + offset for offset in chunk_offsets[1:])
+            children.extend(chunk_children)
+            converted.extend(zip(converted_positions, converted_values))
+
+    #moves into each position, counting sort of the children
+    parent_offsets = array.array("I", bytes(4 * (size + 1)))
+    for child in children:
+        parent_offsets[child + 1] += 1
+    for index in range(size):
+        parent_offsets[index + 1] += parent_offsets[index]
+    parents = array.array("I", bytes(4 * len(children)))
+    fill = parent_offsets[:-1]
+    for index in range(size):
+        for child in children[offsets[index]:offsets[index + 1]]:
+            parents[fill[child]] = index
+            fill[child] += 1
+
+    #moves left to refute before a position is lost, positions are solved ply by ply from the checkmates
+    remaining = array.array("H", (offsets[index + 1] - offsets[index] for index in range(size)))
+    events = {} #plies -> positions with a move leaving the table into a position solved at that many plies
+    for position, value in converted:
+        remaining[position] += 1
+        if value < ILLEGAL:
+            events.setdefault(value, []).append(position)
+    unsolved = bytearray(size) #1 for positions with moves and no result yet
+    for index in range(size):
+        if values[index] == DRAW and remaining[index]:
+            unsolved[index] = 1
+    solved = {0: [index for index in range(size) if values[index] == 0]}
+
+    plies = 0
+    while solved.get(plies) or any(level >= plies for level in events):
+        movers = list(events.pop(plies, ()))
+        for child in solved.get(plies, ()):
+            movers.extend(parents[parent_offsets[child]:parent_offsets[child + 1]])
+        next_solved = []
+        for position in movers:
+            if not unsolved[position]:
+                continue
+            if plies % 2 == 0: #a move into a lost position wins
+                unsolved[position] = 0
+                values[position] = plies + 1
+                next_solved.append(position)
+            else:
+                remaining[position] -= 1
+                if remaining[position] == 0: #every move lets the opponent win
+                    unsolved[position] = 0
+                    values[position] = plies + 1
+                    next_solved.append(position)
+        solved[plies + 1] = next_solved
+        plies += 1
+    return values
+
+
+def table_path(directory, signature):
+    return os.path.join(directory, signature + ".tb")
+
+
+#generate the tables in build order and write them to directory, returns {signature: seconds}
+def generate_all(directory, signatures=SIGNATURES, workers=None):
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    timings = {}
+    for signature in SIGNATURES:
+        path = table_path(directory, signature)
+        if signature not in signatures:
+            if os.path.exists(path):
+                tables[signature] = load_table(path, signature)
+            continue
+        start = time.perf_counter()
+        tables[signature] = generate_table(signature, tables, workers)
+        with open(path, "wb") as file:
+            file.write(tables[signature])
+        timings[signature] = time.perf_counter() - start
+    return timings
+
+
+def load_table(path, signature):
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) != TABLE_SIZES[signature]:
+        raise ValueError("%s has %d bytes, a %s table has %d" % (path, len(data), signature, TABLE_SIZES[signature]))
+    return data
+
+
+class Tablebase():
+    #loads the tables found in directory
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        for signature in SIGNATURES:
+            path = table_path(directory, signature)
+            if os.path.exists(path):
+                self.tables[signature] = load_table(path, signature)
+
+    #a tablebase sent to another process loads the same files there
+    def __getstate__(self):
+        return {"directory": self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"])
+
+    #(result, plies to mate) for the side to move, result is WIN, LOSS or 0 for a draw
+    #None when the position is not in the tables (other material, castling rights)
+    def probe(self, game_state):
+        if game_state.phase > 4 or game_state.castling_bits:
+            return None
+        pieces = [(piece, square) for piece, squares in game_state.piece_squares.items() for square in squares]
+        if len(pieces) != 3:
+            return None
+        kings = {piece: square for piece, square in pieces if piece[1] == "K"}
+        if len(kings) != 2:
+            return None
+        piece, square = next((piece, square) for piece, square in pieces if piece[1] != "K")
+        signature = next((signature for signature, name in TABLE_PIECES.items() if name[1] == piece[1]), None)
+        if signature not in self.tables:
+            return None
+        white_king, black_king, white_to_move = kings["wK"], kings["bK"], game_state.white_to_move
+        if piece[0] == "b": #mirror the board so the extra piece is white
+            white_king, black_king, square = mirror_row(black_king), mirror_row(white_king), mirror_row(square)
+            white_to_move = not white_to_move
+        value = self.tables[signature][position_index(signature, white_king, black_king, square, white_to_move)]
+        if value == DRAW:
+            return 0, 0
+        if value == ILLEGAL:
+            return None
+        return (WIN if value % 2 else LOSS), value
+
+    #the move keeping the best result: the fastest mate when winning, the longest defence when losing
+    #returns (move, (result, plies to mate)) or None when the position is not in the tables
+    def best_move(self, game_state):
+        result = self.probe(game_state)
+        if result is None:
+            return None
+        flags = game_state.get_game_over_flags()
+        best = None
+        for move in game_state.get_valid_moves():
+            game_state.make_move(move)
+            child = self.probe(game_state)
+            if child is None and move.is_pawn_promotion:
+                #the table of the promoted piece is not loaded: a queen that cannot be taken at once wins,
+                #and no faster than the mate the table of this position counts
+                queen_taken = any(reply.end_row == move.end_row and reply.end_col == move.end_col
+                                  for reply in game_state.get_valid_moves())
+                if move.promotion_piece == "Q" and not queen_taken and result[0] == WIN:
+                    child = (LOSS, result[1] - 1)
+            game_state.undo_move()
+            if child is None: #left the tables: a capture to bare kings, a promotion that loses the piece
+                child = (0, 0)
+            wdl, plies = -child[0], child[1] + 1
+            #higher is better: wins by fewest plies, then draws, then losses by most plies
+            order = (wdl, -plies if wdl == WIN else plies)
+            if best is None or order > best[0]:
+                best = (order, move, (wdl, plies if wdl else 0))
+        game_state.set_game_over_flags(flags)
+        if best is None:
+            return None
+        return best[1], best[2]
+
+
+#play random table positions out with best_move and check that the mates come in the announced number of plies
+#returns the number of positions checked
+def verify(tablebase, positions, seed=0):
+    rng = random.Random(seed)
+    checked = 0
+    signatures = list(tablebase.tables)
+    while checked < positions:
+        signature = rng.choice(signatures)
+        index = rng.randrange(TABLE_SIZES[signature])
+        value = tablebase.tables[signature][index]
+        if value in (ILLEGAL, DRAW):
+            continue
+        white_king, black_king, piece, white_to_move = decode_index(signature, index)
+        board = [["--"] * 8 for _ in range(8)]
+        for square, name in ((white_king, "wK"), (black_king, "bK"), (piece, TABLE_PIECES[signature])):
+            board[square // 8][square % 8] = name
+        game_state = gameState.GameState()
+        game_state.load_position(board, white_to_move, CastleRights(False, False, False, False))
+        fen = notation.to_fen(game_state)
+        for ply in range(value):
+            found = tablebase.best_move(game_state)
+            if found is None:
+                break
+            game_state.make_move(found[0])
+        valid_moves = game_state.get_valid_moves()
+        assert not valid_moves and game_state.in_check(), "%s: no mate after %d plies" % (fen, value)
+        checked += 1
+    return checked
+
+
+def describe(result):
+    wdl, plies = result
+    if wdl == WIN:
+        return "win, mate in %d (%d plies)" % ((plies + 1) // 2, plies)
+    if wdl == LOSS:
+        return "loss, mated in %d (%d plies)" % (plies // 2, plies)
+    return "draw"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate, probe or verify the KQK/KRK/KPK tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="generate the tables")
+    generate.add_argument("signatures", nargs="*", help="tables to build: KQK KRK KPK (default: all)")
+    generate.add_argument("--dir", default="tablebases", help="directory of the table files")
+    generate.add_argument("--workers", type=int, help="worker processes (default: cpu count)")
+    probe = commands.add_parser("probe", help="probe a position")
+    probe.add_argument("--dir", default="tablebases")
+    probe.add_argument("--fen", required=True)
+    check = commands.add_parser("verify", help="play out random won positions and check their distance to mate")
+    check.add_argument("--dir", default="tablebases")
+    check.add_argument("--positions", type=int, default=1000)
+    check.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        unknown = set(args.signatures) - set(SIGNATURES)
+        if unknown:
+            parser.error("unknown tables: " + " ".join(sorted(unknown)))
+        for signature, seconds in generate_all(args.dir, args.signatures or SIGNATURES, args.workers).items():
+            table = load_table(table_path(args.dir, signature), signature)
+            counts = {"win": 0, "loss": 0, "draw": 0}
+            for value in table:
+                if value == DRAW:
+                    counts["draw"] += 1
+                elif value != ILLEGAL:
+                    counts["win" if value % 2 else "loss"] += 1
+            longest = max(value for value in table if value < ILLEGAL)
+            print("%s  %6.1fs  %7d bytes  %d wins  %d losses  %d draws  longest mate %d plies" % (
+                signature, seconds, len(table), counts["win"], counts["loss"], counts["draw"], longest))
+    elif args.command == "probe":
+        game_state = notation.parse_fen(args.fen)
+        tablebase = Tablebase(args.dir)
+        result = tablebase.probe(game_state)
+        found = tablebase.best_move(game_state)
+        if result is None:
+            print("position not in the tables")
+        else:
+            print(describe(result))
+        if found is not None:
+            print("best move", notation.to_san(game_state, found[0]), "-", describe(found[1]))
+    else:
+        start = time.perf_counter()
+        checked = verify(Tablebase(args.dir), args.positions, args.seed)
+        print("%d positions mate in the announced number of plies  %.1fs" % (checked, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
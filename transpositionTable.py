@@ -0,0 +1,191 @@
+#Transposition table: remembers searched positions by zobrist key
+#entries live in one flat array of unsigned 64 bit ints (key, data) so the memory use is fixed,
+#every bucket has 2 entries: slot 0 keeps the deepest search, slot 1 is always replaced
+from array import array
+from multiprocessing import shared_memory
+import os
+
+ENTRY_BYTES = 16 #key + packed data
+BUCKET_SIZE = 2
+
+#bound types
+EXACT = 0
+LOWER_BOUND = 1 #score >= stored score (fail high)
+UPPER_BOUND = 2 #score <= stored score (fail low)
+
+#data layout: move_id (16 bits) | depth (8 bits) | bound (2 bits) | score + SCORE_OFFSET (22 bits)
+SCORE_OFFSET = 1 << 21
+SCORE_BITS = 22
+BOUND_SHIFT = SCORE_BITS
+DEPTH_SHIFT = BOUND_SHIFT + 2
+MOVE_SHIFT = DEPTH_SHIFT + 8
+
+
+def pack_entry(depth, score, bound, move_id):
+    return move_id << MOVE_SHIFT | depth << DEPTH_SHIFT | bound << BOUND_SHIFT | (score + SCORE_OFFSET)
+
+
+#(depth, score, bound, move_id), move_id 0 means no move
+def unpack_entry(data):
+    return ((data >> DEPTH_SHIFT) & 0xFF, (data & ((1 << SCORE_BITS) - 1)) - SCORE_OFFSET,
+            (data >> BOUND_SHIFT) & 0x3, data >> MOVE_SHIFT)
+
+
+#number of buckets fitting in memory_mb, a power of 2 so the bucket index is key & mask
+def bucket_count(memory_mb):
+    buckets = max(1, int(memory_mb * 1024 * 1024) // (ENTRY_BYTES * BUCKET_SIZE))
+    return 1 << (buckets.bit_length() - 1)
+
+
+class TranspositionTable():
+    def __init__(self, memory_mb=16):
+        buckets = bucket_count(memory_mb)
+        self.bucket_mask = buckets - 1
+        self.entries = array("Q", bytes(buckets * BUCKET_SIZE * ENTRY_BYTES)) #key 0 is an empty slot
+        self.reset_stats()
+
+    def memory_bytes(self):
+        return len(self.entries) * self.entries.itemsize
+
+    def clear(self):
+        self.entries = array("Q", bytes(len(self.entries) * self.entries.itemsize))
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0 #probe found the bucket filled by other positions
+        self.stores = 0
+        self.overwrites = 0 #store replaced a different position
+
+    #returns (depth, score, bound, move_id) or None
+    def probe(self, key):
+        self.probes += 1
+        entries = self.entries
+        index = (key & self.bucket_mask) * 4
+        if entries[index] == key:
+            self.hits += 1
+            return unpack_entry(entries[index + 1])
+        if entries[index + 2] == key:
+            self.hits += 1
+            return unpack_entry(entries[index + 3])
+        if entries[index] or entries[index + 2]:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, score, bound, move_id):
+        self.stores += 1
+        entries = self.entries
+        index = (key & self.bucket_mask) * 4
+        data = pack_entry(depth, score, bound, move_id)
+        if entries[index] == key or depth >= (entries[index + 1] >> DEPTH_SHIFT) & 0xFF or entries[index] == 0:
+            #depth preferred slot, same position or at least as deep
+            if entries[index] != key and entries[index] != 0:
+                self.overwrites += 1
+                #keep the old deep entry around in the always replace slot
+                entries[index + 2], entries[index + 3] = entries[index], entries[index + 1]
+            if entries[index] == key and move_id == 0:
+                data = pack_entry(depth, score, bound, entries[index + 1] >> MOVE_SHIFT) #keep the known best move
+            entries[index] = key
+            entries[index + 1] = data
+        else:
+            #always replace slot
+            if entries[index + 2] != key and entries[index + 2] != 0:
+                self.overwrites += 1
+            entries[index + 2] = key
+            entries[index + 3] = data
+
+    #permille of slots in use, sampled from the first 1000 slots
+    def hashfull(self):
+        sample = min(1000, len(self.entries) // 2)
+        return sum(1 for slot in range(sample) if self.entries[slot * 2]) * 1000 // sample
+
+    def stats(self):
+        return {
+            "memory_mb": self.memory_bytes() / (1024 * 1024),
+            "entries": len(self.entries) // 2,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.probes if self.probes else 0.0,
+            "collisions": self.collisions,
+            "collision_rate": self.collisions / self.probes if self.probes else 0.0,
+            "stores": self.stores,
+            "overwrites": self.overwrites,
+            "overwrite_rate": self.overwrites / self.stores if self.stores else 0.0,
+            "hashfull": self.hashfull(),
+        }
+
+
+#Transposition table in shared memory, for searches running in several processes (see parallelSearch)
+#processes read and write it without locks: the key slot holds key ^ data, so an entry torn by two processes
+#writing at the same time no longer matches its key and is treated as a miss
+#the creating process owns the memory, a table sent to another process attaches to it by name
+#(a forked process inherits the mapping as it is)
+class SharedTranspositionTable(TranspositionTable):
+    def __init__(self, memory_mb=16, name=None):
+        buckets = bucket_count(memory_mb)
+        self.memory_mb = memory_mb
+        size = buckets * BUCKET_SIZE * ENTRY_BYTES
+        self.owner_pid = os.getpid() if name is None else None
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size) #starts zeroed, all slots empty
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.bucket_mask = buckets - 1
+        self.entries = self.memory.buf[:size].cast("Q")
+        self.reset_stats()
+
+    def __getstate__(self):
+        return {"memory_mb": self.memory_mb, "name": self.memory.name}
+
+    def __setstate__(self, state):
+        self.__init__(state["memory_mb"], state["name"])
+
+    #detach, the owner also frees the memory
+    def close(self):
+        self.entries.release()
+        self.memory.close()
+        if self.owner_pid == os.getpid():
+            self.memory.unlink()
+
+    def clear(self):
+        self.memory.buf[:self.memory_bytes()] = bytes(self.memory_bytes())
+        self.reset_stats()
+
+    def probe(self, key):
+        self.probes += 1
+        entries = self.entries
+        index = (key & self.bucket_mask) * 4
+        data = entries[index + 1]
+        if entries[index] ^ data == key:
+            self.hits += 1
+            return unpack_entry(data)
+        data = entries[index + 3]
+        if entries[index + 2] ^ data == key:
+            self.hits += 1
+            return unpack_entry(data)
+        if entries[index] or entries[index + 2]:
+            self.collisions += 1
+        return None
+
+    #same replacement as TranspositionTable.store, on verified keys
+    def store(self, key, depth, score, bound, move_id):
+        self.stores += 1
+        entries = self.entries
+        index = (key & self.bucket_mask) * 4
+        data = pack_entry(depth, score, bound, move_id)
+        first_data = entries[index + 1]
+        first_key = entries[index] ^ first_data
+        if first_key == key or depth >= (first_data >> DEPTH_SHIFT) & 0xFF or entries[index] == 0:
+            if first_key != key and entries[index] != 0:
+                self.overwrites += 1
+                entries[index + 2], entries[index + 3] = entries[index], first_data
+            if first_key == key and move_id == 0:
+                data = pack_entry(depth, score, bound, first_data >> MOVE_SHIFT)
+            entries[index] = key ^ data
+            entries[index + 1] = data
+        else:
+            if entries[index + 2] ^ entries[index + 3] != key and entries[index + 2] != 0:
+                self.overwrites += 1
+            entries[index + 2] = key ^ data
+            entries[index + 3] = data
@@ -0,0 +1,228 @@
+#Headless engine speaking UCI (Universal Chess Interface) on stdin/stdout, for chess GUIs and tournament managers
+#the search runs in a thread so "stop" and "isready" are answered while it thinks
+#
+#usage: python uci.py
+import sys
+import threading
+
+import notation
+from openingBook import OpeningBook
+from parallelSearch import ParallelSearcher
+from search import Searcher, CHECKMATE_SCORE, MAX_PLY, MAX_MATE_PLIES, DEFAULT_TABLE_MB
+from tablebase import Tablebase
+from transpositionTable import TranspositionTable
+
+ENGINE_NAME = "chessengine-with-pygame"
+ENGINE_AUTHOR = "LimIvan336"
+DEFAULT_MOVES_TO_GO = 30 #moves the remaining clock time is shared between when the GUI doesnt say
+MOVE_OVERHEAD_MS = 50 #kept on the clock for communication delays
+MAX_THREADS = 64
+
+
+#UCI score: "cp <centipawns>" or "mate <moves>", negative when the side to move gets mated
+def format_score(score):
+    if score >= CHECKMATE_SCORE - MAX_MATE_PLIES:
+        return "mate %d" % ((CHECKMATE_SCORE - score + 1)//2)
+    if score <= -CHECKMATE_SCORE + MAX_MATE_PLIES:
+        return "mate %d" % -((CHECKMATE_SCORE + score)//2)
+    return "cp %d" % score
+
+
+#time budget in milliseconds for a "go" with a clock, None without a time limit
+def allocate_time(options, white_to_move):
+    if "movetime" in options:
+        return options["movetime"]
+    remaining = options.get("wtime" if white_to_move else "btime")
+    if remaining is None:
+        return None
+    increment = options.get("winc" if white_to_move else "binc", 0)
+    moves_to_go = options.get("movestogo", DEFAULT_MOVES_TO_GO)
+    budget = remaining // max(moves_to_go, 1) + increment * 3 // 4
+    return max(1, min(budget, remaining - MOVE_OVERHEAD_MS))
+
+
+class UciEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock() #info lines come from the search thread
+        self.backend = "mailbox"
+        self.table_mb = DEFAULT_TABLE_MB
+        self.threads = 1
+        self.opening_book = None
+        self.tablebase = None
+        self.searcher = None
+        self.rebuild_searcher()
+        self.game_state = notation.parse_fen(notation.START_FEN, self.backend)
+        self.search_thread = None
+        self.stop_event = threading.Event()
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    #handle one command line, returns False on "quit"
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 1024" % DEFAULT_TABLE_MB)
+            self.send("option name Threads type spin default 1 min 1 max %d" % MAX_THREADS)
+            self.send("option name Backend type combo default mailbox var mailbox var bitboard")
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.set_option(arguments)
+        elif command == "ucinewgame":
+            self.stop()
+            self.searcher.transposition_table.clear()
+        elif command == "position":
+            self.stop()
+            self.set_position(arguments)
+        elif command == "go":
+            self.stop()
+            self.go(arguments)
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            self.close_searcher()
+            return False
+        return True
+
+    #setoption name <name> value <value>
+    def set_option(self, arguments):
+        if "name" not in arguments or "value" not in arguments:
+            return
+        name = " ".join(arguments[arguments.index("name") + 1:arguments.index("value")]).lower()
+        value = " ".join(arguments[arguments.index("value") + 1:])
+        if name in ("hash", "threads"):
+            try:
+                number = int(value)
+            except ValueError:
+                self.send("info string invalid value for %s: %s" % (name, value))
+                return
+        self.stop()
+        if name == "hash":
+            self.table_mb = max(1, number)
+            self.rebuild_searcher()
+        elif name == "threads":
+            self.threads = min(max(1, number), MAX_THREADS)
+            self.rebuild_searcher()
+        elif name == "bookfile":
+            try:
+                self.opening_book = OpeningBook(value) if value not in ("", "<empty>") else None
+            except (OSError, ValueError) as error:
+                self.opening_book = None
+                self.send("info string cannot open book: %s" % error)
+            self.rebuild_searcher()
+        elif name == "tablebasepath":
+            try:
+                self.tablebase = Tablebase(value) if value not in ("", "<empty>") else None
+            except (OSError, ValueError) as error:
+                self.tablebase = None
+                self.send("info string cannot load tablebase: %s" % error)
+            self.rebuild_searcher()
+        elif name == "backend" and value in ("mailbox", "bitboard"):
+            self.backend = value
+            self.game_state = notation.parse_fen(notation.to_fen(self.game_state), self.backend)
+
+    #one process searching, or a ParallelSearcher with Threads worker processes
+    def rebuild_searcher(self):
+        self.close_searcher()
+        if self.threads > 1:
+            self.searcher = ParallelSearcher(self.threads, self.table_mb, self.opening_book, self.tablebase)
+        else:
+            self.searcher = Searcher(TranspositionTable(self.table_mb), opening_book=self.opening_book, tablebase=self.tablebase)
+
+    def close_searcher(self):
+        if isinstance(self.searcher, ParallelSearcher):
+            self.searcher.close()
+        self.searcher = None
+
+    #position startpos|fen <fen> [moves <move> ...]
+    def set_position(self, arguments):
+        moves = []
+        if "moves" in arguments:
+            moves = arguments[arguments.index("moves") + 1:]
+            arguments = arguments[:arguments.index("moves")]
+        if arguments and arguments[0] == "fen":
+            fen = " ".join(arguments[1:])
+        else:
+            fen = notation.START_FEN
+        try:
+            game_state = notation.parse_fen(fen, self.backend)
+            for text in moves:
+                game_state.make_move(notation.parse_uci(game_state, text))
+        except (ValueError, KeyError, IndexError) as error:
+            self.send("info string invalid position: %s" % error)
+            return
+        self.game_state = game_state
+
+    #go [depth n] [movetime ms] [wtime ms] [btime ms] [winc ms] [binc ms] [movestogo n] [infinite]
+    def go(self, arguments):
+        options = {}
+        infinite = False
+        index = 0
+        while index < len(arguments):
+            name = arguments[index]
+            if name == "infinite":
+                infinite = True
+            elif name in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo") and index + 1 < len(arguments):
+                try:
+                    options[name] = int(arguments[index + 1])
+                except ValueError:
+                    self.send("info string invalid go argument %s: %s" % (name, arguments[index + 1]))
+                index += 1
+            index += 1
+
+        time_limit_ms = None if infinite else allocate_time(options, self.game_state.white_to_move)
+        max_depth = max(1, min(options.get("depth", MAX_PLY - 1), MAX_PLY - 1)) #depth 1 at least, so a legal move is found
+        self.stop_event = threading.Event()
+        self.search_thread = threading.Thread(target=self.search, args=(time_limit_ms, max_depth, infinite, self.stop_event),
+                                              daemon=True)
+        self.search_thread.start()
+
+    def search(self, time_limit_ms, max_depth, infinite, stop_event):
+        result = self.searcher.search(self.game_state, time_limit_ms, max_depth, stop_event, self.send_info)
+        if infinite:
+            stop_event.wait() #"go infinite" only answers after "stop"
+        if result is not None and result.from_book:
+            self.send("info string book move")
+        if result is None or result.best_move is None:
+            self.send("bestmove 0000")
+        else:
+            self.send("bestmove " + notation.to_uci(result.best_move))
+
+    def send_info(self, result):
+        elapsed_ms = int(result.elapsed * 1000)
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (
+            result.depth, format_score(result.score), result.nodes, result.nps, elapsed_ms,
+            " ".join(notation.to_uci(move) for move in result.principal_variation)))
+
+    #stop the running search, it still sends its bestmove
+    def stop(self):
+        if self.search_thread is not None:
+            self.stop_event.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+
+def main():
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+    engine.close_searcher()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+#Zobrist hashing, a 64 bit key identifying a position
+#the key is the XOR of a random number for every (piece, square), the side to move,
+#the castling rights and the en passant file, so a move only has to XOR in what changed
+import random
+
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+
+_random = random.Random(0x5EED) #fixed seed so keys are the same in every process
+#PIECE_KEYS[piece][row*8 + col]
+PIECE_KEYS = {piece: [_random.getrandbits(64) for _ in range(64)] for piece in PIECES}
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+#CASTLING_KEYS[castling bits], see castleRights
+CASTLING_KEYS = [_random.getrandbits(64) for _ in range(16)]
+#ENPASSANT_KEYS[col] of the en passant square
+ENPASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]
+
+
+#compute the key from scratch, used on a new position and to verify the incremental key
+def compute_key(game_state):
+    key = 0
+    for row in range(8):
+        for col in range(8):
+            piece = game_state.board[row][col]
+            if piece != "--":
+                key ^= PIECE_KEYS[piece][row*8 + col]
+    if not game_state.white_to_move:
+        key ^= BLACK_TO_MOVE_KEY
+    key ^= CASTLING_KEYS[game_state.castling_bits]
+    if game_state.enpassant_possible != ():
+        key ^= ENPASSANT_KEYS[game_state.enpassant_possible[1]]
+    return key